@@ -0,0 +1,3 @@
+"""
+Benchmarks of the proxy. Each module can be run with python -m benchmarks.<module>
+"""
@@ -0,0 +1,103 @@
+"""
+Counts the copies of a pushed content made by the proxy while it goes through the /push workflow.
+
+Github is replaced by a function which reads the body it receives and answers instantly. The peak of memory \
+allocated while the view runs is measured with tracemalloc : divided by the size of the body, it gives the number \
+of copies of the content alive at the same time. The bytes going through base64 decoding are counted as well : \
+divided by the size of the body, they give the number of times the content is decoded.
+
+Usage : python -m benchmarks.copies [--sizes 1,8,32] [--spool-threshold 1048576] [--raw]
+"""
+from flask import Flask
+from flask_github_proxy import GithubProxy
+from hashlib import sha256
+import argparse
+import base64
+import json
+import mock
+import os
+import tracemalloc
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode("utf-8")
+        self.headers = {}
+
+
+def fake_github(method, url, data=None, **kwargs):
+    """ Answers to the proxy as Github would for a new file on an existing branch
+    """
+    if hasattr(data, "read"):
+        for _ in iter(lambda: data.read(8192), b""):
+            pass
+    if "/git/refs/heads/" in url:
+        return FakeResponse(200, {"object": {"sha": "123456"}})
+    elif "/contents/" in url and method == "GET":
+        return FakeResponse(404, {"message": "Not Found"})
+    elif "/contents/" in url:
+        return FakeResponse(201, {"content": {"sha": "95b966ae1c166bd92f8ae7d1c313e738c731dfc3"}})
+    elif method == "GET":
+        return FakeResponse(200, [])
+    return FakeResponse(201, {"html_url": "https://github.com/perseusDL/dummy/pull/9"})
+
+
+def measure(size, spool_threshold, raw=False):
+    """ Push a content of given size and measure the copies made
+
+    :param size: Size of the decoded content in bytes
+    :param spool_threshold: Spool threshold of the proxy
+    :param raw: Push the raw content instead of its base64 encoding
+    :return: Measures
+    :rtype: dict
+    """
+    app = Flask("benchmark")
+    proxy = GithubProxy(
+        "/proxy", "ponteineptique/dummy", "perseusDL/dummy", secret="secret", token="token",
+        app=app, json_log_formatting=False, spool_threshold=spool_threshold
+    )
+    body = os.urandom(size)
+    if not raw:
+        body = base64.encodebytes(body)
+    headers = {"fproxy-secure-hash": sha256(body + b"secret").hexdigest()}
+    if raw:
+        headers["Content-Type"] = "application/octet-stream"
+    decoded = [0]
+    b64decode = base64.b64decode
+
+    def decode(data, *args, **kwargs):
+        decoded[0] += len(data)
+        return b64decode(data, *args, **kwargs)
+
+    with app.test_request_context("/proxy/push/file.xml?branch=bench", method="POST", data=body, headers=headers), \
+            mock.patch("flask_github_proxy.make_request", fake_github), \
+            mock.patch("base64.b64decode", decode):
+        tracemalloc.start()
+        response = proxy.r_receive("file.xml")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "size": len(body),
+        "raw": raw,
+        "status": response.status_code,
+        "spooled": len(body) > spool_threshold,
+        "peak": peak,
+        "copies": round(peak / len(body), 2),
+        "decodes": round(decoded[0] / len(body), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,8,32", help="Sizes of the contents, in MB, separated by commas")
+    parser.add_argument("--spool-threshold", default=1024 * 1024, type=int, help="Spool threshold of the proxy")
+    parser.add_argument("--raw", action="store_true", help="Push raw contents instead of their base64 encoding")
+    args = parser.parse_args()
+    for size in args.sizes.split(","):
+        print(json.dumps(measure(int(float(size) * 1024 * 1024), args.spool_threshold, args.raw)))
+
+
+if __name__ == "__main__":
+    main()
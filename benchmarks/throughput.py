@@ -0,0 +1,307 @@
+"""
+Measures the throughput and the latency of the proxy under realistic Github latency.
+
+The Github stand-in of the tests (tests/github.py) is served by a real local HTTP server, behind a middleware \
+injecting latency, 5xx errors, 409 conflicts on contents and a bandwidth cap. The proxy is served by another local \
+HTTP server, calling the stand-in with requests. A pool of clients then drives /push (and optionally /update) at \
+the configured concurrency.
+
+The report gives the throughput, the p50/p95/p99 latencies (overall and by route), the statuses of the responses \
+and the number of Github calls per push (from the budget of the responses, See GithubProxy.budget_in_response).
+
+Latency distributions : fixed:SECONDS, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA
+
+Usage : python -m benchmarks.throughput [--requests 200] [--concurrency 8] [--latency lognormal:0.05,0.5] \
+[--error-rate 0.01] [--conflict-rate 0.05] [--bandwidth 1048576] [--size 4096] [--update-ratio 0.1] \
+[--save benchmarks/baselines/throughput.json] [--baseline benchmarks/baselines/throughput.json] [--tolerance 0.2]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from threading import Thread, Lock
+from hashlib import sha256
+from flask import Flask
+from werkzeug.serving import make_server
+from flask_github_proxy import GithubProxy
+from tests.github import make_client
+import argparse
+import base64
+import json
+import logging
+import math
+import os
+import random
+import requests
+import sys
+import time
+
+
+ORIGIN = "ponteineptique/dummy"
+UPSTREAM = "perseusDL/dummy"
+TOKEN = "client-id"
+SECRET = "benchmark-secret"
+
+
+def distribution(spec, rng):
+    """ Parse a latency distribution
+
+    :param spec: fixed:SECONDS, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA
+    :param rng: Random generator
+    :return: Function returning a latency in seconds
+    """
+    kind, _, values = spec.partition(":")
+    values = [float(value) for value in values.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    elif kind == "uniform" and len(values) == 2:
+        return lambda: rng.uniform(*values)
+    elif kind == "lognormal" and len(values) == 2:
+        return lambda: rng.lognormvariate(math.log(values[0]), values[1])
+    raise argparse.ArgumentTypeError("Unknown latency distribution {}".format(spec))
+
+
+class Injector(object):
+    """ WSGI middleware making the Github stand-in behave like a remote API
+
+    :param app: WSGI application of the stand-in
+    :param latency: Function returning the latency of a call in seconds
+    :param error_rate: Probability of a call to fail with a 502 error
+    :param conflict_rate: Probability of a write of contents to fail with a 409 conflict
+    :param bandwidth: Bandwidth (in bytes per second) of the bodies sent and received, None for no cap
+    :param rng: Random generator
+
+    :ivar calls: Number of calls received, by method
+    :ivar injected: Number of errors injected, by status
+    """
+    def __init__(self, app, latency, error_rate=0, conflict_rate=0, bandwidth=None, rng=None):
+        self.app = app
+        self.latency = latency
+        self.error_rate = error_rate
+        self.conflict_rate = conflict_rate
+        self.bandwidth = bandwidth
+        self.rng = rng or random.Random()
+        self.calls = Counter()
+        self.injected = Counter()
+        self.__lock__ = Lock()
+
+    def transfer(self, size):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        with self.__lock__:
+            self.calls[method] += 1
+            roll = self.rng.random()
+            delay = self.latency()
+        self.transfer(int(environ.get("CONTENT_LENGTH") or 0))
+        time.sleep(delay)
+
+        status = None
+        if roll < self.error_rate:
+            status = "502 Bad Gateway"
+        elif roll < self.error_rate + self.conflict_rate and method == "PUT" and "/contents/" in environ["PATH_INFO"]:
+            status = "409 Conflict"
+        if status is None:
+            return self.throttled(self.app(environ, start_response))
+
+        environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+        with self.__lock__:
+            self.injected[status[:3]] += 1
+        body = json.dumps({"message": status[4:]}).encode("utf-8")
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def throttled(self, chunks):
+        try:
+            for chunk in chunks:
+                self.transfer(len(chunk))
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+
+class Server(object):
+    """ Serves a WSGI application on a local port, from a thread
+
+    :param app: WSGI application
+    """
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def percentile(values, rank):
+    """ Nearest-rank percentile
+
+    :param values: Sorted values
+    :param rank: Percentile (eg: 95)
+    :return: Value, or None without values
+    """
+    if not values:
+        return None
+    return values[max(int(math.ceil(rank / 100.0 * len(values))) - 1, 0)]
+
+
+def latencies(values):
+    values = sorted(round(value, 6) for value in values)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None
+    }
+
+
+def run(args):
+    """ Run the benchmark
+
+    :param args: Parsed arguments
+    :return: Report
+    :rtype: dict
+    """
+    rng = random.Random(args.seed)
+    github = make_client(TOKEN)
+    for index in range(int(args.files * args.existing)):
+        github.exist_file["bench/file-{}.xml".format(index)] = True
+    injector = Injector(
+        github.wsgi_app, distribution(args.latency, rng), args.error_rate, args.conflict_rate, args.bandwidth, rng
+    )
+    github.wsgi_app = injector
+
+    app = Flask("benchmark")
+    proxy = GithubProxy(
+        "/proxy", ORIGIN, UPSTREAM, secret=SECRET, token=TOKEN, app=app,
+        json_log_formatting=False, budget_in_response=True
+    )
+    proxy.logger.setLevel(logging.CRITICAL)
+    proxy.ProxyError.LOGGER.setLevel(logging.CRITICAL)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    content = base64.encodebytes(os.urandom(args.size))
+    headers = {"fproxy-secure-hash": sha256(content + SECRET.encode("utf-8")).hexdigest()}
+    plan = ["update" if rng.random() < args.update_ratio else "push" for _ in range(args.requests)]
+
+    with Server(github) as github_server, Server(app) as proxy_server:
+        proxy.github_api_url = github_server.url
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+        def call(index):
+            start = time.perf_counter()
+            if plan[index] == "update":
+                response = session.get("{}/proxy/update".format(proxy_server.url))
+            else:
+                response = session.post(
+                    "{}/proxy/push/bench/file-{}.xml".format(proxy_server.url, index % args.files),
+                    params={"branch": "bench-{}".format(index)}, data=content, headers=headers
+                )
+            duration = time.perf_counter() - start
+            try:
+                budget = response.json().get("budget")
+            except ValueError:
+                budget = None
+            return plan[index], response.status_code, duration, budget
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(call, range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+    calls = [budget["total"] for route, status, _, budget in results if route == "push" and status == 201 and budget]
+    return {
+        "config": {
+            key: getattr(args, key) for key in (
+                "requests", "concurrency", "latency", "error_rate", "conflict_rate", "bandwidth", "size",
+                "files", "existing", "update_ratio", "seed"
+            )
+        },
+        "results": {
+            "duration": round(elapsed, 3),
+            "throughput": round(len(results) / elapsed, 3),
+            "latency": latencies([duration for _, _, duration, _ in results]),
+            "routes": {
+                route: latencies([duration for name, _, duration, _ in results if name == route])
+                for route in sorted(set(plan))
+            },
+            "statuses": {str(status): count for status, count in sorted(Counter(r[1] for r in results).items())},
+            "github_calls_per_push": round(sum(calls) / len(calls), 3) if calls else None,
+            "github_calls": sum(injector.calls.values()),
+            "injected": dict(injector.injected)
+        }
+    }
+
+
+def compare(report, baseline, tolerance):
+    """ Compare a report to a baseline
+
+    :param report: Report of the run
+    :param baseline: Report kept as a baseline
+    :param tolerance: Relative degradation accepted (eg: 0.2 for 20%)
+    :return: Regressions found, as messages
+    :rtype: list
+    """
+    regressions = []
+    current, former = report["results"], baseline["results"]
+    if current["throughput"] < former["throughput"] * (1 - tolerance):
+        regressions.append("Throughput went from {} to {} requests/s".format(
+            former["throughput"], current["throughput"]
+        ))
+    for rank in ("p50", "p95", "p99"):
+        if current["latency"][rank] > former["latency"][rank] * (1 + tolerance):
+            regressions.append("Latency {} went from {:.3f}s to {:.3f}s".format(
+                rank, former["latency"][rank], current["latency"][rank]
+            ))
+    if (current["github_calls_per_push"] or 0) > (former["github_calls_per_push"] or 0) * (1 + tolerance):
+        regressions.append("Github calls per push went from {} to {}".format(
+            former["github_calls_per_push"], current["github_calls_per_push"]
+        ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", default=200, type=int, help="Number of requests to send")
+    parser.add_argument("--concurrency", default=8, type=int, help="Number of requests sent at the same time")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="Latency distribution of Github calls")
+    parser.add_argument("--error-rate", default=0.0, type=float, help="Probability of a 502 on a Github call")
+    parser.add_argument("--conflict-rate", default=0.0, type=float, help="Probability of a 409 on a content write")
+    parser.add_argument("--bandwidth", default=None, type=int, help="Bandwidth of the stand-in in bytes per second")
+    parser.add_argument("--size", default=4096, type=int, help="Size of the pushed contents in bytes")
+    parser.add_argument("--files", default=50, type=int, help="Number of distinct files pushed")
+    parser.add_argument("--existing", default=0.5, type=float, help="Share of the files already in the repository")
+    parser.add_argument("--update-ratio", default=0.0, type=float, help="Share of the requests going to /update")
+    parser.add_argument("--seed", default=42, type=int, help="Seed of the random generator")
+    parser.add_argument("--save", default=None, help="Write the report to this file, as a baseline")
+    parser.add_argument("--baseline", default=None, help="Compare the report to this baseline")
+    parser.add_argument("--tolerance", default=0.2, type=float, help="Relative degradation accepted by --baseline")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
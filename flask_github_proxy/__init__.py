@@ -1,12 +1,32 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, g
 from copy import deepcopy
+from collections import Counter
+from threading import Event, Lock, get_ident
 import datetime
 import json
+import time
 from requests import request as make_request
+from requests.utils import parse_header_links
 from flask_github_proxy.models import Author, File, ProxyError
+from flask_github_proxy.cache import TTLCache
+from flask_github_proxy.streams import Spool, JSONStream, Decompressor, DecompressionError
+from flask_github_proxy.uploads import UploadStore, UploadStoreFull, UploadTooLarge
+from flask_github_proxy.patches import PatchError, apply_unified, apply_delta
+from flask_github_proxy.archives import ArchiveError, ArchiveTooLarge, open_archive, entry_path
+from flask_github_proxy.metrics import Registry, Timeline, Budget, BudgetExceeded, timed
+from flask_github_proxy.tracing import Tracer, TRACE_FILTER, url_template
+from io import BytesIO
+import base64
 from hashlib import sha256
+import hmac
 import logging
-from pythonjsonlogger import jsonlogger
+from flask_github_proxy.logs import Lazy, summarize, install_json_handler
+from flask_github_proxy.profiling import Sampler
+from flask_github_proxy.memory import AllocationTracker
+
+
+# Marks a missing result of GithubProxy.results
+MISSING = object()
 
 
 class GithubProxy(object):
@@ -22,7 +42,9 @@ class GithubProxy(object):
     :param prefix: URI Prefix
     :param origin: Origin Repository (Repository to Pull Request From)
     :param upstream: Upstream Repository (Repository to Pull Request To)
-    :param secret: Secret Key. Used to check provenance of data
+    :param secret: Secret Key. Used to check provenance of data. A list of secrets can be given to rotate them : \
+    signatures made with any of them are accepted, and the first one is the current secret
+    :type secret: str or list
     :param token: Github Authentification User Token
     :param default_branch: Default Branch to push to
     :type default_branch: str
@@ -31,8 +53,73 @@ class GithubProxy(object):
     :param master_upstream: Upstream Repository Master Branch Name (Branch to Pull Request to)
     :param app: Flask Application to connect to
     :param default_author: Default Author for Commit and Modification
+    :param conflict_retries: Number of times an update is replayed after a 409 conflict (stale blob sha)
+    :type conflict_retries: int
+    :param checkpoint_ttl: Time (in seconds) during which a failed push can be resumed from its last successful step
+    :type checkpoint_ttl: int
+    :param idempotency_ttl: Time (in seconds) during which the result of a request is kept for its idempotency key
+    :type idempotency_ttl: int
+    :param idempotency_from_hash: Use the fproxy-secure-hash header as idempotency key when no Idempotency-Key \
+    header is sent
+    :type idempotency_from_hash: bool
+    :param idempotency_wait: Maximum time (in seconds) a duplicate waits for the original request to finish
+    :type idempotency_wait: int
+    :param pulls_index_ttl: Time (in seconds) after which the index of open pull requests is seeded again
+    :type pulls_index_ttl: int
+    :param blob_reuse_min_size: Size of the (base64) content from which a content already known to be in the origin \
+    repository is committed through the Git Data API instead of being uploaded again. It takes five calls to Github \
+    instead of two, so it only pays off for contents whose upload outweighs three round trips
+    :type blob_reuse_min_size: int
+    :param spool_threshold: Size (in bytes) of a pushed body from which it is spooled to disk and streamed to Github \
+    instead of being held in memory
+    :type spool_threshold: int
+    :param max_decompressed_size: Maximum size (in bytes) of a compressed body (Content-Encoding) once decompressed
+    :type max_decompressed_size: int
+    :param max_decompression_ratio: Maximum ratio between the decompressed and the compressed size of a body
+    :type max_decompression_ratio: int
+    :param sign_wire_bytes: Check the fproxy-secure-hash header against the body as sent (compressed) rather than \
+    against the decompressed body
+    :type sign_wire_bytes: bool
+    :param upload_dir: Folder where chunks of upload sessions are stored (Default to a private folder created in the \
+    temporary directory). Sessions are limited to max_decompressed_size bytes
+    :type upload_dir: str
+    :param upload_ttl: Time (in seconds) after which an idle upload session expires
+    :type upload_ttl: int
+    :param upload_max_sessions: Maximum number of live upload sessions. None for no limit
+    :type upload_max_sessions: int
+    :param upload_max_total_size: Maximum size (in bytes) of the chunks of all upload sessions. None for no limit
+    :type upload_max_total_size: int
+    :param patch_bases: Number of base contents of patches kept in memory
+    :type patch_bases: int
+    :param backend: Storage backend writing files instead of the contents API (eg: a GitBackend committing into \
+    a local repository and pushing by batches, a GraphQLBackend committing each file in a single call). Pull \
+    requests are still opened through the API
+    :type backend: flask_github_proxy.backends.GitBackend or flask_github_proxy.backends.GraphQLBackend
+    :param legacy_signatures: Accept the fproxy-secure-hash header (sha256 of the body followed by the secret) \
+    when no fproxy-signature header (HMAC) is sent
+    :type legacy_signatures: bool
+    :param trace_exporter: Exporter of the spans of the requests (eg: flask_github_proxy.tracing.JSONLinesExporter)
+    :param error_context_size: Size (in characters of JSON) above which the context of errors is truncated
+    :param error_debug_hook: Function called with each ProxyError and its full context, before it is compacted
+    :param debug_routes: Register the routes of DEBUG_URLS (eg: the sampling profiler), protected by the secret
+    :type debug_routes: bool
+    :param debug_signature_ttl: Time (in seconds) during which the signed query of a debug route is accepted \
+    (See GithubProxy.verify_debug_query)
+    :type debug_signature_ttl: int
+    :param profile_max_duration: Maximum duration (in seconds) of a profile
+    :param memory_tracking: Trace allocations with tracemalloc, to record the peak of memory allocated by each request \
+    and report the top allocation sites (See GithubProxy.r_memory). It slows allocations down
+    :type memory_tracking: bool
+    :param memory_top: Number of allocation sites reported
+    :param call_budget: Maximum number of calls to Github a request can make. A request exceeding it is rejected \
+    with a 503 error. None for no limit. Streamed archives are not accounted
+    :param budget_in_response: Add the accounting of the calls to Github (See metrics.Budget) to the JSON responses, \
+    under a "budget" key
+    :type budget_in_response: bool
 
     :cvar URLS: URLS routes of the proxy
+    :cvar DEBUG_URLS: URLS routes of the proxy only registered with debug_routes
+    :cvar PATCH_FORMATS: Functions applying a patch to its base, where keys are the name of the format
     :cvar DEFAULT_AUTHOR: Default Author
     :type DEFAULT_AUTHOR: Author
 
@@ -44,14 +131,55 @@ class GithubProxy(object):
     :ivar default_author: Default Author
     :type default_author: Author
     :ivar secret: Secret / Salt used to check provenance of data to be pushed
+    :ivar secrets: Secrets accepted to check provenance of data, the current one first
+    :ivar counters: Counters of noticeable events (conflicts, retries...)
+    :type counters: collections.Counter
+    :ivar checkpoints: Steps already done by unfinished pushes, identified by GithubProxy.checkpoint_key()
+    :type checkpoints: TTLCache
+    :ivar results: Results of finished requests, identified by GithubProxy.idempotency_key()
+    :type results: TTLCache
+    :ivar blobs: Git blob sha already in the origin repository, identified by the sha of their content
+    :type blobs: TTLCache
+    :ivar open_pulls: Index of open pull requests urls, where keys are their head ("owner:branch")
+    :type open_pulls: dict
+    :ivar uploads: Storage of upload sessions
+    :type uploads: UploadStore
+    :ivar metrics: Metrics of the proxy (durations of the steps, of the requests to Github, sizes of the bodies...)
+    :type metrics: flask_github_proxy.metrics.Registry
+    :ivar backend: Storage backend writing files instead of the contents API, if any
+    :ivar bases: Contents of git blobs used as base of patches, identified by their git blob sha
+    :type bases: TTLCache
+    :ivar tracer: Tracer of the requests of the blueprint and of their calls to Github. Spans are only recorded \
+    when a trace_exporter (eg: flask_github_proxy.tracing.JSONLinesExporter) is given
+    :type tracer: flask_github_proxy.tracing.Tracer
+    :ivar slow_workflow_threshold: Duration (in seconds) above which a request is logged as slow, with the details \
+    of each of its calls to Github. None disables the slow workflow log
+    :ivar log_payload_size: Size above which payloads of the debug logs are replaced by their length and hash
     """
 
     URLS = [
         ("/push/<path:filename>", "r_receive", ["POST"]),
+        ("/patch/<path:filename>", "r_patch", ["POST"]),
+        ("/archive", "r_archive", ["POST"]),
+        ("/upload/<path:filename>", "r_upload_open", ["POST"]),
+        ("/uploads/<upload_id>/<int:number>", "r_upload_chunk", ["PUT"]),
+        ("/uploads/<upload_id>", "r_upload_status", ["GET"]),
+        ("/uploads/<upload_id>/commit", "r_upload_commit", ["POST"]),
         ("/update", "r_update", ["GET"]),
+        ("/metrics", "r_metrics", ["GET"]),
         ("/", "r_main", ["GET"])
     ]
 
+    DEBUG_URLS = [
+        ("/debug/profile", "r_profile", ["GET"]),
+        ("/debug/memory", "r_memory", ["GET"])
+    ]
+
+    PATCH_FORMATS = {
+        "unified": apply_unified,
+        "delta": apply_delta
+    }
+
     DEFAULT_AUTHOR = Author(
         "Github Proxy",
         "anonymous@github.com"
@@ -72,28 +200,88 @@ class GithubProxy(object):
                  prefix, origin, upstream,
                  secret, token,
                  default_branch=None, master_upstream="master", master_fork="master",
-                 app=None, default_author=None, logger=None, json_log_formatting=True):
+                 app=None, default_author=None, logger=None, json_log_formatting=True,
+                 conflict_retries=3, checkpoint_ttl=3600,
+                 idempotency_ttl=600, idempotency_from_hash=False, idempotency_wait=60,
+                 pulls_index_ttl=300, blob_reuse_min_size=1048576,
+                 spool_threshold=1024 * 1024, max_decompressed_size=512 * 1024 * 1024, max_decompression_ratio=100,
+                 sign_wire_bytes=False, upload_dir=None, upload_ttl=86400, patch_bases=32,
+                 legacy_signatures=True, backend=None, trace_exporter=None,
+                 slow_workflow_threshold=None, log_payload_size=1024,
+                 error_context_size=4096, error_debug_hook=None, debug_routes=False, profile_max_duration=60,
+                 memory_tracking=False, memory_top=10, call_budget=None, budget_in_response=False,
+                 debug_signature_ttl=60, upload_max_sessions=None, upload_max_total_size=None):
 
         self.__blueprint__ = None
         self.__prefix__ = prefix
         self.__name__ = prefix.replace("/", "_").replace(".", "_")
         self.__origin__ = origin
         self.__upstream__ = upstream
-        self.__secret__ = secret
+        self.secrets = secret
+        self.legacy_signatures = legacy_signatures
+        self.backend = backend
         self.__urls__ = deepcopy(type(self).URLS)
+        if debug_routes:
+            self.__urls__ += deepcopy(type(self).DEBUG_URLS)
+        self.debug_routes = debug_routes
+        self.profile_max_duration = profile_max_duration
+        self.debug_signature_ttl = debug_signature_ttl
+        # Endpoints served by each thread, only tracked with debug_routes
+        self.__serving__ = {}
+        self.sampler = Sampler(lambda: self.__serving__)
+        self.call_budget = call_budget
+        self.budget_in_response = budget_in_response
+        self.memory_tracking = memory_tracking
+        self.allocations = AllocationTracker(top=memory_top)
+        if memory_tracking:
+            self.allocations.start()
         self.__default_author__ = default_author
         self.__default_branch__ = default_branch
         self.__token__ = token
+        self.conflict_retries = conflict_retries
+        self.counters = Counter()
+        self.metrics = Registry()
+        self.checkpoints = TTLCache(ttl=checkpoint_ttl)
+        self.results = TTLCache(ttl=idempotency_ttl)
+        self.idempotency_from_hash = idempotency_from_hash
+        self.idempotency_wait = idempotency_wait
+        self.__inflight__ = {}
+        self.__inflight_lock__ = Lock()
+        self.pulls_index_ttl = pulls_index_ttl
+        self.open_pulls = {}
+        self.__pulls_seeded__ = None
+        self.__pulls_seeding__ = False
+        self.__pulls_lock__ = Lock()
+        self.blobs = TTLCache(maxsize=4096, ttl=86400)
+        self.blob_reuse_min_size = blob_reuse_min_size
+        self.spool_threshold = spool_threshold
+        self.max_decompressed_size = max_decompressed_size
+        self.max_decompression_ratio = max_decompression_ratio
+        self.sign_wire_bytes = sign_wire_bytes
+        self.uploads = UploadStore(
+            upload_dir, ttl=upload_ttl, max_size=max_decompressed_size,
+            max_sessions=upload_max_sessions, max_total_size=upload_max_total_size
+        )
+        self.bases = TTLCache(maxsize=patch_bases, ttl=86400)
+        self.slow_workflow_threshold = slow_workflow_threshold
+        self.log_payload_size = log_payload_size
 
         self.logger = logger or logging.getLogger(__name__)
-        self.ProxyError.logger = self.logger
+        # Each proxy has its own error class, so that the settings of one proxy do not leak into the others
+        self.ProxyError = type("ProxyError", (ProxyError, ), {
+            "logger": self.logger,
+            "MAX_CONTEXT": error_context_size,
+            "DEBUG_HOOK": error_debug_hook
+        })
+        self.tracer = Tracer(trace_exporter, logger=self.logger)
+        for traced in (self.logger, self.ProxyError.LOGGER):
+            if TRACE_FILTER not in traced.filters:
+                traced.addFilter(TRACE_FILTER)
+        if backend is not None:
+            backend.bind(self)
 
         if json_log_formatting is True:
-            logHandler = logging.StreamHandler()
-            formatter = jsonlogger.JsonFormatter()
-            logHandler.setFormatter(formatter)
-            self.logger.addHandler(logHandler)
-            self.logger.setLevel(logging.DEBUG)
+            install_json_handler(self.logger)
 
         self.master_upstream = master_upstream
         self.master_fork = master_fork
@@ -120,26 +308,116 @@ class GithubProxy(object):
         """
 
         if "data" in kwargs:
-            kwargs["data"] = json.dumps(kwargs["data"])
+            kwargs["data"] = self.json_body(kwargs["data"])
 
         kwargs["headers"] = {
             'Content-Type': 'application/json',
             'Authorization': 'token %s' % self.__token__,
         }
+        root = Tracer.current()
+        span = None
+        if root is not None:
+            span = root.child(
+                "github", method=method, url=url_template(url, self.github_api_url),
+                request_bytes=len(kwargs["data"]) if kwargs.get("data") is not None else 0
+            )
+            kwargs["headers"]["traceparent"] = span.traceparent
+        budget = Budget.current()
+        if budget is not None:
+            budget.spend(method, url)
+        start = time.perf_counter()
         req = make_request(
             method,
             url,
             **kwargs
         )
-        self.logger.debug(
-            "Request::{}::{}".format(method, url),
-            extra={
-                "request": kwargs,
-                "response": {"headers": req.headers, "code": req.status_code, "data": req.content}
-            }
-        )
+        duration = time.perf_counter() - start
+        if span is not None:
+            span.set("status", req.status_code)
+            span.set("response_bytes", len(req.content or b""))
+            span.end()
+        self.metrics.github_requests.observe(duration, method, str(req.status_code))
+        self.metrics.observe_rate_limit(req.headers)
+        timeline = Timeline.current()
+        if timeline is not None:
+            timeline.add("github", duration)
+            timeline.count("github-calls")
+            if self.slow_workflow_threshold is not None:
+                timeline.calls.append({
+                    "method": method,
+                    "url": url_template(url, self.github_api_url),
+                    "status": req.status_code,
+                    "offset": round(start - timeline.start, 6),
+                    "duration": round(duration, 6),
+                    "request_bytes": len(kwargs["data"]) if kwargs.get("data") is not None else 0,
+                    "response_bytes": len(req.content or b""),
+                    "rate_limit": {
+                        key: req.headers[header] for key, header in (
+                            ("remaining", "X-RateLimit-Remaining"),
+                            ("limit", "X-RateLimit-Limit"),
+                            ("reset", "X-RateLimit-Reset")
+                        ) if header in req.headers
+                    }
+                })
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # Payloads are summarized when the record is written, off the request thread
+            self.logger.debug(
+                "Request::{}::{}".format(method, url),
+                extra={
+                    "request": Lazy(summarize, kwargs, self.log_payload_size),
+                    "response": Lazy(
+                        summarize,
+                        {"headers": req.headers, "code": req.status_code, "data": req.content},
+                        self.log_payload_size
+                    )
+                }
+            )
         return req
 
+    @staticmethod
+    def json_body(data):
+        """ Serialize the data of a request, where a File value (nested or not) stands for its base64 encoded content
+
+        The content is never copied into an intermediate string : it is either streamed or joined once with \
+        the rest of the document.
+
+        :param data: Data to serialize
+        :type data: dict
+        :return: JSON string, JSON bytes when there is a File value, or a JSONStream when its content is spooled \
+        or raw (and encoded on the fly)
+        :rtype: str or bytes or JSONStream
+        """
+        path = GithubProxy.find_file(data)
+        if path is not None:
+            value = data
+            for key in path:
+                value = value[key]
+            if value.spooled or value.raw:
+                return JSONStream(data, path, value)
+            return b"".join(JSONStream(data, path, value))
+        return json.dumps(data)
+
+    @staticmethod
+    def find_file(data, path=()):
+        """ Find the File value of data, in nested dictionaries and lists
+
+        :param data: Data to search
+        :param path: Keys leading to data
+        :return: Tuple of keys (and list indexes) leading to the File, or None
+        """
+        if isinstance(data, File):
+            return path
+        elif isinstance(data, dict):
+            items = data.items()
+        elif isinstance(data, list):
+            items = enumerate(data)
+        else:
+            return None
+        for key, value in items:
+            found = GithubProxy.find_file(value, path + (key,))
+            if found is not None:
+                return found
+
     def default_branch(self, file):
         """ Decide the name of the default branch given the file and the configuration
 
@@ -153,6 +431,15 @@ class GithubProxy(object):
         else:
             return file.sha[:8]
 
+    @staticmethod
+    def checkpoint_key(file):
+        """ Build the idempotency key of a push, used to resume it
+
+        :param file: File being pushed, with its branch set up
+        :return: Key made of the content hash, the path and the branch
+        """
+        return "{sha}:{path}:{branch}".format(sha=file.sha, path=file.path, branch=file.branch)
+
     @property
     def blueprint(self):
         return self.__blueprint__
@@ -179,7 +466,20 @@ class GithubProxy(object):
 
     @property
     def secret(self):
-        return self.__secret__
+        return self.__secrets__[0]
+
+    @property
+    def secrets(self):
+        return list(self.__secrets__)
+
+    @secrets.setter
+    def secrets(self, value):
+        if isinstance(value, str):
+            value = [value]
+        self.__secrets__ = list(value)
+        # Keyed states are computed once per secret, and copied for each signature to check
+        self.__salts__ = [secret.encode("utf-8") for secret in self.__secrets__]
+        self.__keyed__ = [hmac.new(salt, digestmod=sha256) for salt in self.__salts__]
 
     def init_app(self, app):
         """ Initialize the application and register the blueprint
@@ -203,10 +503,157 @@ class GithubProxy(object):
                 endpoint=name.replace("r_", ""),
                 methods=methods
             )
+        self.blueprint.before_request(self.before_request)
+        self.blueprint.after_request(self.after_request)
+        self.blueprint.teardown_request(self.teardown_request)
+        self.blueprint.register_error_handler(BudgetExceeded, self.budget_exceeded)
         self.app = self.app.register_blueprint(self.blueprint)
 
         return self.blueprint
 
+    def before_request(self):
+        """ Start the timeline of a request of the blueprint, and its root span when tracing is enabled
+
+        The root span continues the trace of the W3C traceparent header of the request, if any.
+        """
+        g.github_proxy_timeline = Timeline()
+        g.github_proxy_budget = Budget(self.call_budget)
+        if self.debug_routes:
+            self.__serving__[get_ident()] = self.endpoint()
+        if self.memory_tracking:
+            g.github_proxy_allocations = self.allocations.begin()
+        if self.tracer.enabled:
+            g.github_proxy_span = self.tracer.start(
+                self.endpoint(), traceparent=request.headers.get("traceparent"),
+                method=request.method, route=str(request.url_rule), retries=0
+            )
+
+    def after_request(self, response):
+        """ Record the duration of a response of the blueprint and break it down in its Server-Timing header
+
+        :param response: Response
+        :return: Response
+        """
+        timeline = g.get("github_proxy_timeline")
+        if timeline is not None:
+            elapsed = timeline.elapsed()
+            self.metrics.responses.observe(elapsed, self.endpoint(), str(response.status_code))
+            response.headers["Server-Timing"] = timeline.header()
+            if self.slow_workflow_threshold is not None and elapsed > self.slow_workflow_threshold:
+                self.slow_workflow(timeline, elapsed, response.status_code)
+        if self.memory_tracking:
+            peak = self.allocations.end(self.endpoint(), g.pop("github_proxy_allocations", None))
+            if peak is not None:
+                self.metrics.allocation_peaks.observe(peak, self.endpoint())
+        budget = g.get("github_proxy_budget")
+        if budget is not None:
+            self.account(budget, response)
+        span = g.get("github_proxy_span")
+        if span is not None:
+            span.set("status", response.status_code)
+            span.set("github_calls", timeline.counts.get("github-calls", 0) if timeline is not None else 0)
+            if budget is not None:
+                span.set("budget", budget.dict())
+            # Streamed responses (eg: archives) end their span once their body is sent
+            response.call_on_close(span.end)
+        return response
+
+    def account(self, budget, response):
+        """ Record the calls to Github made by a request, and add them to its response if budget_in_response is set
+
+        :param budget: Budget of the request
+        :type budget: Budget
+        :param response: Response
+        """
+        if budget.total:
+            for kind, calls in budget.calls.items():
+                self.metrics.workflow_calls.observe(calls, self.endpoint(), kind)
+        if self.budget_in_response and response.mimetype == "application/json" and not response.is_streamed:
+            try:
+                data = json.loads(response.get_data().decode("utf-8"))
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                data["budget"] = budget.dict()
+                response.set_data(json.dumps(data))
+
+    def budget_exceeded(self, error):
+        """ Reject a request which exceeded its budget of calls to Github
+
+        :param error: Exception raised
+        :type error: BudgetExceeded
+        :return: JSON Response
+        """
+        self.metrics.budget_rejections.inc(self.endpoint())
+        return self.ProxyError(503, str(error), step="budget", context=error.budget.dict()).response()
+
+    def spared(self, how="cached"):
+        """ Account a call to Github the current request did not need to make
+
+        :param how: cached or coalesced (See metrics.Budget)
+        """
+        budget = Budget.current()
+        if budget is not None:
+            setattr(budget, how, getattr(budget, how) + 1)
+
+    def teardown_request(self, exception=None):
+        """ Forget the endpoint served by the thread, and its allocations if no response recorded them, once its \
+        request is over
+
+        :param exception: Exception which ended the request, if any
+        """
+        if self.debug_routes:
+            self.__serving__.pop(get_ident(), None)
+        if self.memory_tracking:
+            self.allocations.cancel(g.pop("github_proxy_allocations", None))
+
+    def slow_workflow(self, timeline, elapsed, status):
+        """ Log a request which took longer than slow_workflow_threshold, with the breakdown of its duration in \
+        phases and every call it made to Github
+
+        :param timeline: Timeline of the request
+        :type timeline: Timeline
+        :param elapsed: Duration of the request in seconds
+        :param status: Status code of the response
+        """
+        self.counters["slow_workflows"] += 1
+        self.logger.warning(
+            "Slow workflow::{}".format(self.endpoint()),
+            extra={
+                "endpoint": self.endpoint(),
+                "status": status,
+                "duration": round(elapsed, 6),
+                "threshold": self.slow_workflow_threshold,
+                "phases": {phase: round(duration, 6) for phase, duration in timeline.durations.items()},
+                "events": dict(timeline.counts),
+                "budget": g.github_proxy_budget.dict() if g.get("github_proxy_budget") else None,
+                "calls": timeline.calls
+            }
+        )
+
+    def retried(self):
+        """ Count a retry of a request to Github (eg: after a conflict)
+        """
+        self.counters["conflict_retries"] += 1
+        budget = Budget.current()
+        if budget is not None:
+            budget.retries += 1
+        timeline = Timeline.current()
+        if timeline is not None:
+            timeline.count("retries")
+        span = Tracer.current()
+        if span is not None:
+            span.inc("retries")
+
+    @staticmethod
+    def endpoint():
+        """ Name of the endpoint of the current request, without the name of the blueprint
+
+        :return: Endpoint
+        """
+        return (request.endpoint or "").rsplit(".", 1)[-1]
+
+    @timed("put")
     def put(self, file):
         """ Create a new file on github
 
@@ -216,7 +663,7 @@ class GithubProxy(object):
         input_ = {
             "message": file.logs,
             "author": file.author.dict(),
-            "content": file.base64,
+            "content": file,
             "branch": file.branch
         }
         uri = "{api}/repos/{origin}/contents/{path}".format(
@@ -228,6 +675,7 @@ class GithubProxy(object):
 
         if data.status_code == 201:
             file.pushed = True
+            file.blob = json.loads(data.content.decode("utf-8"))["content"]["sha"]
             return file
         else:
             decoded_data = json.loads(data.content.decode("utf-8"))
@@ -239,6 +687,7 @@ class GithubProxy(object):
                 }
             )
 
+    @timed("get")
     def get(self, file):
         """ Check on github if a file exists
 
@@ -272,16 +721,55 @@ class GithubProxy(object):
             )
         return file
 
+    @timed("get_blob")
+    def get_blob(self, sha):
+        """ Retrieve the content of a git blob of the origin repository
+
+        Contents are kept in GithubProxy.bases, so that successive patches of a file do not fetch it again.
+
+        :param sha: Sha of the git blob
+        :return: Content of the blob or Error
+        :rtype: bytes or self.ProxyError
+        """
+        content = self.bases.get(sha)
+        if content is not None:
+            self.spared()
+            return content
+        uri = "{api}/repos/{origin}/git/blobs/{sha}".format(
+            api=self.github_api_url,
+            origin=self.origin,
+            sha=sha
+        )
+        data = self.request("GET", uri)
+        if data.status_code != 200:
+            decoded_data = json.loads(data.content.decode("utf-8"))
+            return self.ProxyError(
+                data.status_code, (decoded_data, "message"),
+                step="get_blob", context={"uri": uri}
+            )
+        data = json.loads(data.content.decode("utf-8"))
+        if data.get("encoding") == "base64":
+            content = base64.b64decode(data["content"])
+        else:
+            content = data["content"].encode("utf-8")
+        self.bases.set(sha, content)
+        return content
+
+    @timed("update")
     def update(self, file):
         """ Make an update query on Github API for given file
 
+        If Github answers with a 409 conflict, the blob sha we hold is stale : we refresh it through \
+        GithubProxy.get() and replay the same body, at most GithubProxy.conflict_retries times. The body of a \
+        patched file (File.base is set) is never replayed, as it was computed from the stale version.
+
         :param file: File to update, with its content
         :return: File with new information, including success (or Error)
         """
         params = {
             "message": file.logs,
             "author": file.author.dict(),
-            "content": file.base64,
+            "content": file,
             "sha": file.blob,
             "branch": file.branch
         }
@@ -291,10 +779,28 @@ class GithubProxy(object):
             path=file.path
         )
         data = self.request("PUT", uri, data=params)
+        retries = 0
+        while data.status_code == 409 and retries < self.conflict_retries and not file.base:
+            self.counters["conflicts"] += 1
+            retries += 1
+            file.blob = None
+            file = self.get(file)
+            if isinstance(file, self.ProxyError):
+                return file
+            elif not file.blob:
+                # The file was deleted in between, so there is nothing left to update
+                return self.put(file)
+            params["sha"] = file.blob
+            self.retried()
+            data = self.request("PUT", uri, data=params)
+
         if data.status_code == 200:
             file.pushed = True
+            file.blob = json.loads(data.content.decode("utf-8"))["content"]["sha"]
             return file
         else:
+            if data.status_code == 409:
+                self.counters["conflicts"] += 1
             reply = json.loads(data.content.decode("utf-8"))
             return self.ProxyError(
                 data.status_code, (reply, "message"),
@@ -304,12 +810,125 @@ class GithubProxy(object):
                 }
             )
 
+    @timed("list_pull_requests")
+    def list_pull_requests(self):
+        """ List the open pull requests made against the upstream master branch, following pagination
+
+        :return: Dictionary of pull request urls where keys are their head ("owner:branch") or Proxy Error
+        :rtype: dict or self.ProxyError
+        """
+        uri = "{api}/repos/{upstream}/pulls".format(
+            api=self.github_api_url,
+            upstream=self.upstream
+        )
+        params = {
+            "state": "open",
+            "base": self.master_upstream,
+            "per_page": 100
+        }
+        pulls = {}
+        while uri:
+            if params:
+                data = self.request("GET", uri, params=params)
+            else:
+                data = self.request("GET", uri)
+            if data.status_code != 200:
+                decoded_data = json.loads(data.content.decode("utf-8"))
+                return self.ProxyError(
+                    data.status_code, (decoded_data, "message"),
+                    step="list_pull_requests", context={
+                        "uri": uri,
+                        "params": params
+                    }
+                )
+            for pull in json.loads(data.content.decode("utf-8")):
+                pulls[pull["head"]["label"]] = pull["html_url"]
+            # Next pages are given by the Link header, with their parameters already set
+            uri, params = None, None
+            for link in parse_header_links(data.headers.get("Link", "")):
+                if link.get("rel") == "next":
+                    uri = link["url"]
+        return pulls
+
+    def open_pull_request(self, head, refresh=False):
+        """ Find the url of the open pull request for a given head in the index of open pull requests
+
+        The index is seeded with GithubProxy.list_pull_requests() and seeded again once it is older \
+        than GithubProxy.pulls_index_ttl seconds. The listing runs outside of the lock of the index : while \
+        it is seeded again, other requests go on with the former index. The index only counts as seeded once a \
+        listing went through, so that a failed listing (eg: an exceeded budget) is tried again by the next request.
+
+        :param head: Head of the pull request ("owner:branch")
+        :param refresh: Seed the index again, whatever its age
+        :return: URL of the pull request or None
+        """
+        with self.__pulls_lock__:
+            now = time.monotonic()
+            stale = self.__pulls_seeded__ is None or now - self.__pulls_seeded__ > self.pulls_index_ttl
+            if not refresh and (not stale or self.__pulls_seeding__):
+                return self.open_pulls.get(head)
+            self.__pulls_seeding__ = True
+
+        pulls = None
+        try:
+            pulls = self.list_pull_requests()
+        finally:
+            with self.__pulls_lock__:
+                self.__pulls_seeding__ = False
+                if isinstance(pulls, self.ProxyError):
+                    # The index is an optimization : we simply go on without it
+                    self.logger.warning("Open pull requests could not be listed", extra={"reason": pulls.message})
+                elif pulls is not None:
+                    self.open_pulls = pulls
+                    self.__pulls_seeded__ = now
+        with self.__pulls_lock__:
+            return self.open_pulls.get(head)
+
+    def still_open(self, head, html_url):
+        """ Check that a pull request found in the index is still open, and drop it from the index otherwise \
+        (eg: it was merged or closed since the index was seeded)
+
+        :param head: Head of the pull request ("owner:branch")
+        :param html_url: URL of the pull request
+        :return: Boolean indicating that the pull request is open
+        """
+        uri = "{api}/repos/{upstream}/pulls/{number}".format(
+            api=self.github_api_url,
+            upstream=self.upstream,
+            number=html_url.rstrip("/").rsplit("/", 1)[-1]
+        )
+        data = self.request("GET", uri)
+        if data.status_code == 200 and json.loads(data.content.decode("utf-8")).get("state") == "open":
+            return True
+        with self.__pulls_lock__:
+            if self.open_pulls.get(head) == html_url:
+                del self.open_pulls[head]
+        self.counters["pull_request_closed"] += 1
+        return False
+
+    @timed("pull_request")
     def pull_request(self, file):
         """ Create a pull request
 
+        If a pull request is still open for the branch of the file, its URL is returned instead.
+
         :param file: File to push through pull request
         :return: URL of the PullRequest or Proxy Error
         """
+        head = "{origin}:{branch}".format(origin=self.origin.split("/")[0], branch=file.branch)
+        existing = self.open_pull_request(head)
+        if existing and self.still_open(head, existing):
+            # Commits of the backend reach the open pull request with the next batch of the branch
+            self.counters["pull_request_reused"] += 1
+            self.spared()
+            return existing
+
+        if self.backend is not None:
+            # The branch needs to be on Github before a pull request is opened for it
+            flushed = self.backend.flush([file.branch])
+            if isinstance(flushed, self.ProxyError):
+                return flushed
+
         uri = "{api}/repos/{upstream}/pulls".format(
             api=self.github_api_url,
             upstream=self.upstream,
@@ -318,14 +937,23 @@ class GithubProxy(object):
         params = {
           "title": "[Proxy] {message}".format(message=file.logs),
           "body": "",
-          "head": "{origin}:{branch}".format(origin=self.origin.split("/")[0], branch=file.branch),
+          "head": head,
           "base": self.master_upstream
         }
         data = self.request("POST", uri, data=params)
 
         if data.status_code == 201:
-            return json.loads(data.content.decode("utf-8"))["html_url"]
+            html_url = json.loads(data.content.decode("utf-8"))["html_url"]
+            with self.__pulls_lock__:
+                self.open_pulls[head] = html_url
+            return html_url
         else:
+            if data.status_code == 422:
+                # A pull request was opened for this branch since we last seeded the index
+                existing = self.open_pull_request(head, refresh=True)
+                if existing:
+                    self.counters["pull_request_reused"] += 1
+                    return existing
             reply = json.loads(data.content.decode("utf-8"))
             return self.ProxyError(
                 data.status_code, reply["message"],
@@ -335,6 +963,137 @@ class GithubProxy(object):
                 }
             )
 
+    def commit_blob(self, file, blob):
+        """ Commit a blob already in the origin repository as the content of a file, through the Git Data API
+
+        It avoids uploading the content of the file again (See GithubProxy.commit_tree)
+
+        :param file: File to commit
+        :param blob: Sha of the git blob holding the content of the file
+        :return: File with new information, including success (or Error)
+        :rtype: File or self.ProxyError
+        """
+        commit = self.commit_tree(file, [{"path": file.path, "mode": "100644", "type": "blob", "sha": blob}])
+        if isinstance(commit, self.ProxyError):
+            return commit
+        file.pushed = True
+        file.blob = blob
+        return file
+
+    @timed("commit_tree")
+    def commit_tree(self, file, tree):
+        """ Commit tree entries on the branch of a file, through the Git Data API
+
+        If the branch moved in between, the commit is built again on the new head, at most \
+        GithubProxy.conflict_retries times. If the entries do not change the tree of the head, nothing is \
+        committed and the head is returned.
+
+        :param file: File giving the branch, the author and the message of the commit
+        :param tree: Tree entries (path, mode, type and sha of the blob) to write over the head of the branch
+        :type tree: list
+        :return: Sha of the commit or Error
+        :rtype: str or self.ProxyError
+        """
+        repository = "{api}/repos/{origin}/git".format(api=self.github_api_url, origin=self.origin)
+        retries = 0
+        while True:
+            head = self.get_ref(file.branch)
+            if isinstance(head, self.ProxyError):
+                return head
+            elif not head:
+                return self.ProxyError(
+                    404, "The branch {} does not exist".format(file.branch), step="commit_blob"
+                )
+
+            uri = "{repository}/commits/{sha}".format(repository=repository, sha=head)
+            data = self.request("GET", uri)
+            if data.status_code != 200:
+                decoded_data = json.loads(data.content.decode("utf-8"))
+                return self.ProxyError(
+                    data.status_code, (decoded_data, "message"),
+                    step="commit_blob", context={"uri": uri}
+                )
+            base_tree = json.loads(data.content.decode("utf-8"))["tree"]["sha"]
+
+            uri = "{repository}/trees".format(repository=repository)
+            params = {
+                "base_tree": base_tree,
+                "tree": tree
+            }
+            data = self.request("POST", uri, data=params)
+            if data.status_code != 201:
+                decoded_data = json.loads(data.content.decode("utf-8"))
+                return self.ProxyError(
+                    data.status_code, (decoded_data, "message"),
+                    step="commit_blob", context={"uri": uri, "entries": len(tree)}
+                )
+            tree_sha = json.loads(data.content.decode("utf-8"))["sha"]
+            if tree_sha == base_tree:
+                # The entries are already there : an empty commit would only clutter the history
+                return head
+
+            uri = "{repository}/commits".format(repository=repository)
+            params = {
+                "message": file.logs,
+                "author": file.author.dict(),
+                "tree": tree_sha,
+                "parents": [head]
+            }
+            data = self.request("POST", uri, data=params)
+            if data.status_code != 201:
+                decoded_data = json.loads(data.content.decode("utf-8"))
+                return self.ProxyError(
+                    data.status_code, (decoded_data, "message"),
+                    step="commit_blob", context={"uri": uri, "params": params}
+                )
+            commit = json.loads(data.content.decode("utf-8"))["sha"]
+
+            uri = "{repository}/refs/heads/{branch}".format(repository=repository, branch=file.branch)
+            params = {
+                "sha": commit,
+                "force": False
+            }
+            data = self.request("PATCH", uri, data=params)
+            if data.status_code == 200:
+                return commit
+            elif data.status_code == 422 and retries < self.conflict_retries:
+                # Not a fast forward : the branch moved since we read its head
+                self.counters["conflicts"] += 1
+                self.retried()
+                retries += 1
+            else:
+                decoded_data = json.loads(data.content.decode("utf-8"))
+                return self.ProxyError(
+                    data.status_code, (decoded_data, "message"),
+                    step="commit_blob", context={"uri": uri, "params": params}
+                )
+
+    @timed("make_blob")
+    def make_blob(self, file):
+        """ Create a git blob holding the content of a file, unless it is known to be in the origin repository
+
+        :param file: File whose content to upload
+        :return: Sha of the blob or Error
+        :rtype: str or self.ProxyError
+        """
+        blob = self.blobs.get(file.sha)
+        if blob:
+            self.counters["blob_reused"] += 1
+            self.spared()
+            return blob
+        uri = "{api}/repos/{origin}/git/blobs".format(api=self.github_api_url, origin=self.origin)
+        data = self.request("POST", uri, data={"content": file, "encoding": "base64"})
+        if data.status_code != 201:
+            decoded_data = json.loads(data.content.decode("utf-8"))
+            return self.ProxyError(
+                data.status_code, (decoded_data, "message"),
+                step="make_blob", context={"uri": uri, "path": file.path}
+            )
+        blob = json.loads(data.content.decode("utf-8"))["sha"]
+        self.blobs.set(file.sha, blob)
+        return blob
+
+    @timed("get_ref")
     def get_ref(self, branch, origin=None):
         """ Check if a reference exists
 
@@ -367,6 +1126,7 @@ class GithubProxy(object):
                 }
             )
 
+    @timed("make_ref")
     def make_ref(self, branch):
         """ Make a branch on github
 
@@ -404,16 +1164,111 @@ class GithubProxy(object):
                 }
             )
 
+    @staticmethod
+    def spool(stream, **kwargs):
+        """ Read a body into a Spool, accounting the time spent in the upload phase of the Server-Timing header
+
+        :param stream: Readable stream of the body
+        :param kwargs: Parameters of the Spool
+        :return: Spool
+        :rtype: Spool
+        """
+        start = time.perf_counter()
+        try:
+            return Spool(stream, **kwargs)
+        finally:
+            timeline = Timeline.current()
+            if timeline is not None:
+                timeline.add("upload", time.perf_counter() - start)
+
+    def body_stream(self):
+        """ Open the body of the current request, decompressing it on the fly according to its Content-Encoding
+
+        :return: Readable stream of the body and hash object fed with the body as sent (None if it is not \
+        compressed), or Proxy Error if the encoding is not supported
+        :rtype: (stream, hashlib.sha256) or self.ProxyError
+        """
+        encoding = request.headers.get("Content-Encoding", "identity").lower()
+        if encoding == "identity":
+            return request.stream, None
+        try:
+            stream = Decompressor(
+                request.stream, encoding,
+                max_size=self.max_decompressed_size,
+                max_ratio=self.max_decompression_ratio
+            )
+        except ValueError as error:
+            return self.ProxyError(415, str(error), step="decompress")
+        return stream, stream.wire.hash
+
     def check_sha(self, sha, content):
-        """ Check sent sha against the salted hash of the content
+        """ Check sent sha against the salted hash of the content (legacy scheme : sha256 of the content \
+        followed by the secret)
+
+        The content is hashed once : the state of the hash is copied to be salted with each secret.
 
         :param sha: SHA sent through fproxy-secure-hash header
-        :param content: Base 64 encoded Content
+        :param content: Base 64 encoded Content, or a sha256 hash object already fed with it
+        :type content: str or hashlib.sha256
         :return: Boolean indicating equality
         """
-        rightful_sha = sha256(bytes("{}{}".format(content, self.secret), "utf-8")).hexdigest()
-        return sha == rightful_sha
+        if not sha:
+            return False
+        if isinstance(content, str):
+            content = sha256(content.encode("utf-8"))
+        sha = sha.lower().encode("utf-8")
+        for salt in self.__salts__:
+            rightful_sha = content.copy()
+            rightful_sha.update(salt)
+            if hmac.compare_digest(sha, rightful_sha.hexdigest().encode("ascii")):
+                return True
+        return False
+
+    def check_hmac(self, signature, content):
+        """ Check sent signature against the HMAC-SHA256 of the sha256 digest of the content
+
+        The content is hashed once, while it streams : only its 32 bytes digest goes through the keyed state of \
+        each secret.
+
+        :param signature: Signature sent through the fproxy-signature header, eg: "sha256=<hex>"
+        :param content: Content, or a sha256 hash object already fed with it
+        :type content: str or bytes or hashlib.sha256
+        :return: Boolean indicating equality
+        """
+        if not signature:
+            return False
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            content = sha256(content)
+        digest = content.digest()
+        if signature.startswith("sha256="):
+            signature = signature[len("sha256="):]
+        signature = signature.lower().encode("utf-8")
+        for keyed in self.__keyed__:
+            rightful = keyed.copy()
+            rightful.update(digest)
+            if hmac.compare_digest(signature, rightful.hexdigest().encode("ascii")):
+                return True
+        return False
+
+    @timed("verify")
+    def verify(self, content, secure_sha=None, signature=None):
+        """ Check the provenance of a content through its HMAC signature or, if allowed, through its legacy \
+        salted hash
+
+        :param content: Content, or a sha256 hash object already fed with it
+        :param secure_sha: Salted hash sent through the fproxy-secure-hash header
+        :param signature: Signature sent through the fproxy-signature header
+        :return: Boolean indicating provenance
+        """
+        if signature:
+            return self.check_hmac(signature, content)
+        elif self.legacy_signatures:
+            return self.check_sha(secure_sha, content)
+        return False
 
+    @timed("patch_ref")
     def patch_ref(self, sha):
         """ Patch reference on the origin master branch
 
@@ -450,111 +1305,725 @@ class GithubProxy(object):
                 }
             )
 
-    def r_receive(self, filename):
-        """ Function which receives the data from Perseids
+    def idempotency_key(self):
+        """ Retrieve the idempotency key of the current request
+
+        The key is read from the Idempotency-Key header. If GithubProxy.idempotency_from_hash is True, \
+        the fproxy-signature or fproxy-secure-hash header is used as a fallback : as it only covers the body, \
+        the parameters of the request (eg: the branch) are part of the key, so that the same content sent with \
+        other parameters is another request.
 
+        :return: Key scoped to the requested path, or None if the request carries no key
+        """
+        key = request.headers.get("Idempotency-Key")
+        if key:
+            return "{}::{}".format(request.path, key)
+        if self.idempotency_from_hash:
+            signature = request.headers.get("fproxy-signature") or request.headers.get("fproxy-secure-hash")
+            if signature:
+                query = "&".join(sorted("{}={}".format(*item) for item in request.args.items(multi=True)))
+                return "{}?{}::{}".format(request.path, query, signature)
+
+    def idempotent(self, key, function, *args, fingerprint=None, keep_errors=True):
+        """ Run function(*args) once per idempotency key and keep its result for later duplicates
+
+        A duplicate which arrives while the original is still running waits for the original's result. \
+        Errors from Github's side (5xx) or from rate-limiting (429) are not kept, so that a retry can run (and \
+        resume) the workflow. A key reused for a different payload (another fingerprint) is refused with a 422 error.
+        Without keep_errors, only successes are kept and any failure can be retried.
+
+        :param key: Idempotency key. If None, the function is simply run
+        :param function: Function to run
+        :param args: Arguments for the function
+        :param fingerprint: Hash of the payload the key stands for (eg: sha of the content and branch)
+        :param keep_errors: Keep the errors which are not from Github's side or from rate-limiting
+        :return: Result of the function
+        """
+        if key is None:
+            return function(*args)
+
+        missing = (None, MISSING)
+        with self.__inflight_lock__:
+            kept, result = self.results.get(key, missing)
+            if result is not MISSING:
+                return self.replay(kept, fingerprint, result, "cached")
+            event, running = self.__inflight__.get(key, (None, None))
+            owner = event is None
+            if owner:
+                event = Event()
+                self.__inflight__[key] = (event, fingerprint)
+            elif running != fingerprint:
+                return self.reused_key()
+
+        if not owner:
+            event.wait(self.idempotency_wait)
+            kept, result = self.results.get(key, missing)
+            if result is not MISSING:
+                return self.replay(kept, fingerprint, result, "coalesced")
+            elif not event.is_set():
+                return self.ProxyError(409, "A request with the same idempotency key is still being processed")
+            # The original did not keep its result : we run it ourselves
+            return self.idempotent(key, function, *args, fingerprint=fingerprint, keep_errors=keep_errors)
+
+        try:
+            result = function(*args)
+            if not isinstance(result, self.ProxyError) or (
+                keep_errors and result.code < 500 and result.code != 429
+            ):
+                self.results.set(key, (fingerprint, result))
+        finally:
+            with self.__inflight_lock__:
+                del self.__inflight__[key]
+            event.set()
+        return result
+
+    def replay(self, kept, fingerprint, result, how):
+        """ Answer a duplicate with the result kept for its idempotency key, if it carries the same payload
+
+        :param kept: Fingerprint of the payload of the original request
+        :param fingerprint: Fingerprint of the payload of the duplicate
+        :param result: Result of the original request
+        :param how: cached or coalesced (See GithubProxy.spared)
+        :return: Result, or Error if the key was reused for another payload
+        """
+        if kept != fingerprint:
+            return self.reused_key()
+        self.counters["idempotent_replays"] += 1
+        self.spared(how)
+        return result
+
+    def reused_key(self):
+        self.counters["idempotency_key_reused"] += 1
+        return self.ProxyError(
+            422, "The idempotency key was already used for a different payload", step="idempotency"
+        )
+
+    @timed("workflow")
+    def push(self, file):
+        """ Push a file to github and open a pull request for it
+
+            - Resume from the last successful step of a former failed attempt, if any
+            - Write the file through GithubProxy.backend, if any (See GithubProxy.push_backend)
             - Check the branch does not exist
             - Make the branch if needed
-            - Receive PUT from Perseids
-            - Check if content exist
+            - Commit the blob of the content if it is known to be in the origin repository already
+            - Otherwise, check if content exist
             - Update/Create content
             - Open Pull Request
-            - Return PR link to Perseids
 
-        It can take a "branch" URI parameter for the name of the branch
+        :param file: File to push, with its branch set up
+        :return: URL of the PullRequest or Proxy Error
+        :rtype: str or self.ProxyError
+        """
+        self.metrics.in_flight.inc()
+        try:
+            return self.__push__(file)
+        finally:
+            self.metrics.in_flight.dec()
+
+    def __push__(self, file):
+        ###########################################
+        # Resuming a former attempt
+        ###########################################
+        # A checkpoint records the steps done by a former attempt which failed afterwards
+        key = self.checkpoint_key(file)
+        checkpoint = self.checkpoints.get(key)
+        if checkpoint is None:
+            checkpoint = {}
+        else:
+            self.counters["resumed"] += 1
+
+        if self.backend is not None:
+            return self.push_backend(file, key, checkpoint)
+
+        ###########################################
+        # Ensuring branch exists
+        ###########################################
+        if not checkpoint.get("branch"):
+            branch_status = self.get_ref(file.branch)
+
+            if isinstance(branch_status, self.ProxyError):  # If we have an error from github API
+                return branch_status
+            elif not branch_status:  # If it does not exist
+                # We create a branch
+                branch_status = self.make_ref(file.branch)
+                # If branch creation did not work
+                if isinstance(branch_status, self.ProxyError):
+                    return branch_status
+            checkpoint["branch"] = True
+            self.checkpoints.set(key, checkpoint)
+
+        ###########################################
+        # Pushing files
+        ###########################################
+        if not checkpoint.get("written"):
+            # If the content is already known to be in the origin repository, we commit its blob
+            blob = None
+            if file.size >= self.blob_reuse_min_size and not file.base:
+                blob = self.blobs.get(file.sha)
+            if blob:
+                written = self.commit_blob(file, blob)
+                if isinstance(written, self.ProxyError):
+                    # The blob is probably not there anymore : we fall back to the upload
+                    self.blobs.pop(file.sha)
+                    self.logger.warning("Blob could not be reused", extra={"blob": blob, "reason": written.message})
+                else:
+                    self.counters["blob_reused"] += 1
+                    file = written
+                    checkpoint["written"] = True
+                    self.checkpoints.set(key, checkpoint)
+
+        if not checkpoint.get("written"):
+            # Check if file exists
+            # It feeds file.blob parameter, which tells us the sha of the file if it exists
+            if "blob" in checkpoint:
+                file.blob = checkpoint["blob"]
+            else:
+                file = self.get(file)
+                if isinstance(file, self.ProxyError):  # If we have an error from github API
+                    return file
+                checkpoint["blob"] = file.blob
+                self.checkpoints.set(key, checkpoint)
+
+            # A patched file can only replace the version it was computed from
+            if file.base and file.blob != file.base:
+                return self.ProxyError(
+                    409, "The file changed since the base of the patch {}".format(file.base),
+                    step="patch", context={"base": file.base, "blob": file.blob}
+                )
+
+            # If it has a blob set up, it means we can update given file
+            if file.blob:
+                file = self.update(file)
+            # Otherwise, we create it
+            else:
+                file = self.put(file)
+
+            if isinstance(file, self.ProxyError):
+                return file
+            self.blobs.set(file.sha, file.blob)
+            checkpoint["written"] = True
+            self.checkpoints.set(key, checkpoint)
+
+        ###########################################
+        # Making pull request
+        ###########################################
+        pr_url = self.pull_request(file)
+        if isinstance(pr_url, self.ProxyError):
+            return pr_url
+        # The workflow is complete : there is nothing left to resume
+        self.checkpoints.pop(key)
+        return pr_url
+
+    def metadata(self, filename, args):
+        """ Read the author, the date and the commit message of a push from its parameters
 
         :param filename: Path for the file
+        :param args: Parameters of the push (author_name, author_email, date, logs)
+        :type args: dict
+        :return: Author, date and commit message
+        :rtype: (Author, str, str)
+        """
+        author = Author(
+            args.get("author_name", self.default_author.name),
+            args.get("author_email", self.default_author.email)
+        )
+        date = args.get("date", datetime.datetime.now().date().isoformat())
+        logs = args.get("logs", "{} updated {}".format(author.name, filename))
+        return author, date, logs
+
+    def push_backend(self, file, key, checkpoint):
+        """ Push a file through GithubProxy.backend and open a pull request for it
+
+        :param file: File to push, with its branch set up
+        :param key: Checkpoint key of the push
+        :param checkpoint: Steps already done by a former attempt
+        :return: URL of the PullRequest or Proxy Error
+        :rtype: str or self.ProxyError
+        """
+        if not checkpoint.get("written"):
+            branch_status = self.backend.ensure_branch(file.branch, self.master_upstream)
+            if isinstance(branch_status, self.ProxyError):
+                return branch_status
+            file = self.backend.write(file)
+            if isinstance(file, self.ProxyError):
+                return file
+            checkpoint["written"] = True
+            self.checkpoints.set(key, checkpoint)
+
+        pr_url = self.pull_request(file)
+        if isinstance(pr_url, self.ProxyError):
+            return pr_url
+        self.checkpoints.pop(key)
+        return pr_url
+
+    def receive(self, filename, stream, args, secure_sha=None, raw=False, wire_hash=None, idempotency_key=None,
+                signature=None, keep_errors=True):
+        """ Receive a body, check its provenance and push it (See GithubProxy.push)
+
+        The body is read by chunks and hashed on the fly. Past GithubProxy.spool_threshold, it stays on disk.
+
+        :param filename: Path for the file
+        :param stream: Readable stream of the body
+        :param args: Parameters of the push (author_name, author_email, date, logs, branch)
+        :type args: dict
+        :param secure_sha: Salted hash of the body sent by the client (legacy scheme)
+        :param raw: Indicates that the body is the raw content of the file, not its base64 encoding
+        :param wire_hash: Hash object fed with the body as sent, if it differs from the stream (eg: compressed)
+        :param idempotency_key: Idempotency key of the push (See GithubProxy.idempotent)
+        :param signature: HMAC signature of the body sent by the client
+        :param keep_errors: Keep the errors of the push along its idempotency key (See GithubProxy.idempotent)
         :return: JSON Response with status_code 201 if successful.
         """
         ###########################################
         # Retrieving data
         ###########################################
-        content = request.data.decode("utf-8")
+        try:
+            spool = self.spool(stream, threshold=self.spool_threshold, raw=raw)
+        except DecompressionError as error:
+            return self.ProxyError(error.code, error.message, step="decompress").response()
         # Content checking
-        if not content:
+        self.metrics.body_sizes.observe(spool.size, self.endpoint())
+        if not spool.size:
+            spool.close()
             error = self.ProxyError(300, "Content is missing")
             return error.response()
 
-        author_name = request.args.get("author_name", self.default_author.name)
-        author_email = request.args.get("author_email", self.default_author.email)
-        author = Author(author_name, author_email)
-
-        date = request.args.get("date", datetime.datetime.now().date().isoformat())
-        logs = request.args.get("logs", "{} updated {}".format(author.name, filename))
-
-        self.logger.info("Receiving query from {}".format(author_name), extra={"IP": request.remote_addr})
+        author, date, logs = self.metadata(filename, args)
+        self.logger.info("Receiving query from {}".format(author.name), extra={"IP": request.remote_addr})
 
         ###########################################
         # Checking data security
         ###########################################
-        secure_sha = None
-        if "fproxy-secure-hash" in request.headers:
-            secure_sha = request.headers["fproxy-secure-hash"]
-
-        if not secure_sha or not self.check_sha(secure_sha, content):
+        signed_hash = spool.hash
+        if wire_hash is not None and self.sign_wire_bytes:
+            signed_hash = wire_hash
+        if not self.verify(signed_hash, secure_sha, signature):
+            spool.close()
             error = self.ProxyError(300, "Hash does not correspond with content")
             return error.response()
+        if not spool.valid:
+            spool.close()
+            return self.ProxyError(400, "Content is not base64 encoded", step="receive").response()
 
         ###########################################
         # Setting up data
         ###########################################
         file = File(
             path=filename,
-            content=content,
+            content=spool,
             author=author,
             date=date,
-            logs=logs
+            logs=logs,
+            sha=spool.content_hash.hexdigest() if spool.content_hash else None
         )
-        file.branch = request.args.get("branch", self.default_branch(file))
+        try:
+            file.branch = args.get("branch", self.default_branch(file))
+
+            ###########################################
+            # Pushing and making pull request
+            ###########################################
+            pr_url = self.idempotent(
+                idempotency_key, self.push, file, fingerprint="{}::{}".format(file.branch, file.sha),
+                keep_errors=keep_errors
+            )
+        finally:
+            file.close()
+        if isinstance(pr_url, self.ProxyError):
+            return pr_url.response()
 
-        ###########################################
-        # Ensuring branch exists
-        ###########################################
-        branch_status = self.get_ref(file.branch)
-
-        if isinstance(branch_status, self.ProxyError):  # If we have an error from github API
-            return branch_status.response()
-        elif not branch_status:  # If it does not exist
-            # We create a branch
-            branch_status = self.make_ref(file.branch)
-            # If branch creation did not work
-            if isinstance(branch_status, self.ProxyError):
-                return branch_status.response()
+        reply = {
+            "status": "success",
+            "message": "The workflow was well applied",
+            "pr_url": pr_url
+        }
+        data = jsonify(reply)
+        data.status_code = 201
+        return data
+
+    def r_receive(self, filename):
+        """ Function which receives the data from Perseids
+
+            - Receive PUT from Perseids
+            - Check the provenance of the data
+            - Push the file and open a pull request (See GithubProxy.push)
+            - Return PR link to Perseids
+
+        The body is the base64 encoded content of the file or, when the Content-Type is application/octet-stream \
+        or the "raw" URI parameter is set to 1, the raw content itself. It can be compressed (Content-Encoding \
+        gzip, deflate or zstd). The fproxy-signature header is the HMAC-SHA256, keyed with the secret, of the \
+        sha256 digest of the decompressed body, or of the body as sent if GithubProxy.sign_wire_bytes is True. \
+        The legacy fproxy-secure-hash header is the salted hash of the same bytes.
+
+        It can take a "branch" URI parameter for the name of the branch. Requests carrying the same \
+        Idempotency-Key header only run the workflow once (See GithubProxy.idempotent)
+
+        :param filename: Path for the file
+        :return: JSON Response with status_code 201 if successful.
+        """
+        body = self.body_stream()
+        if isinstance(body, self.ProxyError):
+            return body.response()
+        stream, wire_hash = body
+        return self.receive(
+            filename, stream, request.args,
+            secure_sha=request.headers.get("fproxy-secure-hash"),
+            signature=request.headers.get("fproxy-signature"),
+            raw=request.mimetype == "application/octet-stream" or request.args.get("raw") in ("1", "true"),
+            wire_hash=wire_hash,
+            idempotency_key=self.idempotency_key()
+        )
+
+    def r_patch(self, filename):
+        """ Receive a patch of a file, apply it to the version it was made against and push the result
+
+            - Check the provenance of the patch
+            - Retrieve the base content (See GithubProxy.get_blob)
+            - Apply the patch and check the sha256 of the result
+            - Push the result and open a pull request (See GithubProxy.push). It only replaces the base version : \
+            if the file changed in between, the push fails with a 409 error
+
+        The body is a unified diff ("format" URI parameter set to "unified", the default) or a git binary delta \
+        ("format" set to "delta"). It can be compressed, as for the push route. It requires the "base" URI \
+        parameter (git blob sha of the version the patch was made against) and the "sha" URI parameter (sha256 of \
+        the patched content). The patch is signed as the body of the push route. Other parameters are the ones \
+        of the push route.
+
+        :param filename: Path for the file
+        :return: JSON Response with status_code 201 if successful, with the git blob sha of the new version.
+        """
+        base, expected = request.args.get("base"), request.args.get("sha")
+        apply = self.PATCH_FORMATS.get(request.args.get("format", "unified"))
+        if not base or not expected:
+            return self.ProxyError(400, "Parameters base and sha are required", step="patch").response()
+        elif apply is None:
+            return self.ProxyError(
+                400, "Patch format should be one of {}".format(", ".join(sorted(self.PATCH_FORMATS))), step="patch"
+            ).response()
+
+        body = self.body_stream()
+        if isinstance(body, self.ProxyError):
+            return body.response()
+        stream, wire_hash = body
+        try:
+            spool = self.spool(stream, threshold=self.spool_threshold, raw=True)
+        except DecompressionError as error:
+            return self.ProxyError(error.code, error.message, step="decompress").response()
+        self.metrics.body_sizes.observe(spool.size, self.endpoint())
+        try:
+            patch = b"".join(spool.chunks())
+            signed_hash = wire_hash if wire_hash is not None and self.sign_wire_bytes else spool.hash
+        finally:
+            spool.close()
+        if not self.verify(
+            signed_hash, request.headers.get("fproxy-secure-hash"), request.headers.get("fproxy-signature")
+        ):
+            return self.ProxyError(300, "Hash does not correspond with patch").response()
+
+        author, date, logs = self.metadata(filename, request.args)
+        self.logger.info("Receiving patch from {}".format(author.name), extra={"IP": request.remote_addr})
 
         ###########################################
-        # Pushing files
+        # Applying the patch
         ###########################################
-        # Check if file exists
-        # It feeds file.blob parameter, which tells us the sha of the file if it exists
-        file = self.get(file)
-        if isinstance(file, self.ProxyError):  # If we have an error from github API
-            return file.response()
-
-        # If it has a blob set up, it means we can update given file
-        if file.blob:
-            file = self.update(file)
-        # Otherwise, we create it
-        else:
-            file = self.put(file)
+        content = self.get_blob(base)
+        if isinstance(content, self.ProxyError):
+            return content.response()
+        try:
+            content = apply(content, patch)
+        except PatchError as error:
+            return self.ProxyError(
+                422, "Patch does not apply : {}".format(error), step="patch", context={"base": base}
+            ).response()
+        if sha256(content).hexdigest() != expected.lower():
+            return self.ProxyError(
+                422, "Patched content does not correspond with sha", step="patch", context={"base": base}
+            ).response()
 
-        if isinstance(file, self.ProxyError):
-            return file.response()
         ###########################################
-        # Making pull request
+        # Pushing and making pull request
         ###########################################
-
-        pr_url = self.pull_request(file)
+        file = File(
+            path=filename,
+            content=Spool(BytesIO(content), threshold=self.spool_threshold, raw=True),
+            author=author,
+            date=date,
+            logs=logs,
+            sha=expected.lower()
+        )
+        file.base = base
+        try:
+            file.branch = request.args.get("branch", self.default_branch(file))
+            pr_url = self.idempotent(
+                self.idempotency_key(), self.push, file, fingerprint="{}::{}::{}".format(file.branch, base, expected)
+            )
+        finally:
+            file.close()
+        if file.pushed:
+            # The new version is the most likely base of the next patch
+            self.bases.set(file.blob, content)
         if isinstance(pr_url, self.ProxyError):
             return pr_url.response()
 
-        reply = {
+        reply = jsonify({
             "status": "success",
             "message": "The workflow was well applied",
-            "pr_url": pr_url
+            "pr_url": pr_url,
+            "blob": file.blob
+        })
+        reply.status_code = 201
+        return reply
+
+    def ingest(self, archive, entries, prefix=""):
+        """ Commit the files of an archive as one commit on the branch of the archive and open a pull request
+
+            - Make the branch if needed
+            - Upload each file as a git blob, unless it is known to be in the origin repository already
+            - Commit all of them at once (See GithubProxy.commit_tree)
+            - Open Pull Request
+
+        Each file is spooled (to disk past GithubProxy.spool_threshold) and streamed to Github, so that a single \
+        file is never held in memory, whatever the size of the archive.
+
+        :param archive: File of the archive, giving the branch, the author and the message of the commit
+        :type archive: File
+        :param entries: Iterator of (name, executable, stream) for each file of the archive (See open_archive)
+        :param prefix: Folder of the repository where the archive is extracted
+        :return: Iterator of progress reports, the last one being the result of the workflow
+        :rtype: iterator of dict
+        """
+        def failed(error):
+            return error.response(callback=lambda data, status_code: dict(data, code=status_code))
+
+        branch_status = self.get_ref(archive.branch)
+        if not isinstance(branch_status, self.ProxyError) and not branch_status:
+            branch_status = self.make_ref(archive.branch)
+        if isinstance(branch_status, self.ProxyError):
+            yield failed(branch_status)
+            return
+        yield {"status": "progress", "step": "branch", "branch": archive.branch}
+
+        tree = []
+        try:
+            for name, executable, stream in entries:
+                path = entry_path(prefix, name)
+                if path is None:
+                    yield {"status": "skipped", "path": name, "message": "Path leaves the repository"}
+                    continue
+                # The entries are bounded while they are read (See open_archive), not once they are extracted
+                spool = Spool(stream, threshold=self.spool_threshold, raw=True)
+                file = File(
+                    path=path, content=spool, author=archive.author, date=archive.date, logs=archive.logs,
+                    sha=spool.content_hash.hexdigest()
+                )
+                try:
+                    blob = self.make_blob(file)
+                finally:
+                    file.close()
+                if isinstance(blob, self.ProxyError):
+                    yield failed(blob)
+                    return
+                tree.append({"path": path, "mode": "100755" if executable else "100644", "type": "blob", "sha": blob})
+                yield {"status": "progress", "step": "blob", "path": path, "blob": blob, "files": len(tree)}
+        except ArchiveTooLarge as error:
+            yield failed(self.ProxyError(413, str(error), step="archive"))
+            return
+        except ArchiveError as error:
+            yield failed(self.ProxyError(400, str(error), step="archive"))
+            return
+
+        if not tree:
+            yield failed(self.ProxyError(300, "Archive holds no file", step="archive"))
+            return
+        commit = self.commit_tree(archive, tree)
+        if isinstance(commit, self.ProxyError):
+            yield failed(commit)
+            return
+        yield {"status": "progress", "step": "commit", "commit": commit, "files": len(tree)}
+
+        pr_url = self.pull_request(archive)
+        if isinstance(pr_url, self.ProxyError):
+            yield failed(pr_url)
+            return
+        yield {
+            "status": "success",
+            "message": "The workflow was well applied",
+            "pr_url": pr_url,
+            "commit": commit,
+            "files": len(tree)
         }
-        data = jsonify(reply)
-        data.status_code = 201
-        return data
+
+    def r_archive(self):
+        """ Receive a tar (optionally compressed) or zip archive and commit its files as one change
+
+            - Check the provenance of the archive
+            - Commit its files and open a pull request (See GithubProxy.ingest)
+            - Report progress as it goes
+
+        The archive is spooled to disk while it is hashed : it is signed as the body of the push route. It takes \
+        the same URI parameters as the push route, and a "path" parameter for the folder of the repository where \
+        the archive is extracted.
+
+        Once the archive is checked, the response is a stream of JSON lines (application/x-ndjson), one per \
+        step. The last line has a "success" or an "error" status, along with the code of the error.
+
+        :return: Stream of JSON lines, or JSON Response if the archive is refused.
+        """
+        body = self.body_stream()
+        if isinstance(body, self.ProxyError):
+            return body.response()
+        stream, wire_hash = body
+        try:
+            # A zip archive needs to be read from its end : the spool always goes to disk
+            spool = self.spool(stream, threshold=0, raw=True)
+        except DecompressionError as error:
+            return self.ProxyError(error.code, error.message, step="decompress").response()
+        self.metrics.body_sizes.observe(spool.size, self.endpoint())
+        if not spool.size:
+            spool.close()
+            return self.ProxyError(300, "Content is missing").response()
+
+        signed_hash = wire_hash if wire_hash is not None and self.sign_wire_bytes else spool.hash
+        if not self.verify(
+            signed_hash, request.headers.get("fproxy-secure-hash"), request.headers.get("fproxy-signature")
+        ):
+            spool.close()
+            return self.ProxyError(300, "Hash does not correspond with content").response()
+        try:
+            entries = open_archive(
+                spool.file, max_size=self.max_decompressed_size, max_ratio=self.max_decompression_ratio
+            )
+        except ArchiveError as error:
+            spool.close()
+            return self.ProxyError(415, str(error), step="archive").response()
+
+        prefix = request.args.get("path", "")
+        author, date, logs = self.metadata(prefix or "the repository", request.args)
+        self.logger.info("Receiving archive from {}".format(author.name), extra={"IP": request.remote_addr})
+        archive = File(
+            path=prefix, content=spool, author=author, date=date, logs=logs, sha=spool.content_hash.hexdigest()
+        )
+        archive.branch = request.args.get("branch", self.default_branch(archive))
+
+        def report():
+            self.metrics.in_flight.inc()
+            try:
+                for step in self.ingest(archive, entries, prefix):
+                    yield json.dumps(step) + "\n"
+            finally:
+                self.metrics.in_flight.dec()
+                entries.close()
+                archive.close()
+
+        return Response(report(), mimetype="application/x-ndjson")
+
+    def r_upload_open(self, filename):
+        """ Open an upload session for a file sent in several chunks
+
+        It takes the same URI parameters as the push route, kept until the session is committed. The \
+        path of the file is signed as the body of the push route.
+
+        :param filename: Path for the file
+        :return: JSON Response with the upload_id and status_code 201 if successful.
+        """
+        if not self.verify(
+            filename, request.headers.get("fproxy-secure-hash"), request.headers.get("fproxy-signature")
+        ):
+            return self.ProxyError(300, "Hash does not correspond with path", step="upload_open").response()
+        try:
+            upload_id = self.uploads.open({
+                "path": filename,
+                "args": request.args.to_dict(),
+                "raw": request.mimetype == "application/octet-stream" or request.args.get("raw") in ("1", "true")
+            })
+        except UploadStoreFull as error:
+            return self.ProxyError(503, str(error), step="upload_open").response()
+        reply = jsonify({"status": "success", "upload_id": upload_id})
+        reply.status_code = 201
+        return reply
+
+    def r_upload_chunk(self, upload_id, number):
+        """ Receive a chunk of an upload session
+
+        A chunk sent again replaces the former one. If the fproxy-chunk-hash header is given, the chunk is kept \
+        only if its sha256 matches it.
+
+        :param upload_id: Identifier of the session
+        :param number: Number of the chunk, starting from 0
+        :return: JSON Response with the received ranges and status_code 201 if successful.
+        """
+        if not self.uploads.path(upload_id):
+            return self.ProxyError(404, "Upload session does not exist", step="upload_chunk").response()
+        body = self.body_stream()
+        if isinstance(body, self.ProxyError):
+            return body.response()
+        try:
+            size = self.uploads.write(upload_id, number, body[0], sha=request.headers.get("fproxy-chunk-hash"))
+        except DecompressionError as error:
+            return self.ProxyError(error.code, error.message, step="decompress").response()
+        except UploadTooLarge as error:
+            return self.ProxyError(413, str(error), step="upload_chunk").response()
+        except UploadStoreFull as error:
+            return self.ProxyError(503, str(error), step="upload_chunk").response()
+        if size is None:
+            return self.ProxyError(300, "Hash does not correspond with chunk", step="upload_chunk").response()
+        self.metrics.body_sizes.observe(size, self.endpoint())
+        reply = jsonify({
+            "status": "success",
+            "ranges": self.uploads.ranges(self.uploads.chunks(upload_id))
+        })
+        reply.status_code = 201
+        return reply
+
+    def r_upload_status(self, upload_id):
+        """ Describe the chunks received by an upload session
+
+        :param upload_id: Identifier of the session
+        :return: JSON Response with the size of each chunk and the ranges of consecutive chunks received
+        """
+        if not self.uploads.path(upload_id):
+            return self.ProxyError(404, "Upload session does not exist", step="upload_status").response()
+        chunks = self.uploads.chunks(upload_id)
+        return jsonify({
+            "status": "success",
+            "chunks": {str(number): size for number, size in chunks.items()},
+            "ranges": self.uploads.ranges(chunks),
+            "size": sum(chunks.values())
+        })
+
+    def r_upload_commit(self, upload_id):
+        """ Commit an upload session : its chunks, joined in order, go through the push workflow
+
+        The whole body is signed as the body of the push route. The session is \
+        removed once the workflow succeeded, so that a failed commit can be retried.
+
+        :param upload_id: Identifier of the session
+        :return: JSON Response with status_code 201 if successful.
+        """
+        metadata = self.uploads.metadata(upload_id)
+        if metadata is None:
+            return self.ProxyError(404, "Upload session does not exist", step="upload_commit").response()
+        chunks = self.uploads.chunks(upload_id)
+        if sorted(chunks) != list(range(len(chunks))):
+            return self.ProxyError(
+                409, "Chunks are missing : received {}".format(self.uploads.ranges(chunks)), step="upload_commit"
+            ).response()
+        reader = self.uploads.reader(upload_id, len(chunks))
+        try:
+            response = self.receive(
+                metadata["path"], reader, metadata["args"],
+                secure_sha=request.headers.get("fproxy-secure-hash"),
+                signature=request.headers.get("fproxy-signature"),
+                raw=metadata["raw"],
+                idempotency_key="{}::{}".format(request.path, upload_id),
+                # The session is kept until the workflow succeeds : a failed commit must be retried, not replayed
+                keep_errors=False
+            )
+        finally:
+            reader.close()
+        if response.status_code == 201:
+            self.uploads.delete(upload_id)
+        return response
 
     def r_update(self):
         """ Updates a fork Master
@@ -569,7 +2038,7 @@ class GithubProxy(object):
         # Getting Master Branch
         upstream = self.get_ref(self.master_upstream, origin=self.upstream)
         if isinstance(upstream, bool):
-            return (ProxyError(
+            return (self.ProxyError(
                 404, "Upstream Master branch '{0}' does not exist".format(self.master_upstream),
                 step="get_upstream_ref"
             )).response()
@@ -587,6 +2056,86 @@ class GithubProxy(object):
             "commit": new_sha
         })
 
+    def r_metrics(self):
+        """ Metrics of the proxy, in the Prometheus text exposition format
+
+        It exposes the durations of the workflow steps and of the requests made to Github, the durations of the \
+        responses by status, the sizes of the bodies received, the number of workflows in flight, the rate limit \
+        reported by Github and the counters of events (See GithubProxy.counters)
+
+        :return: Text Response
+        """
+        return Response(self.metrics.expose(self.counters), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def verify_debug_query(self, step):
+        """ Check the query string of a debug route : it must be signed as a content, through the fproxy-signature \
+        or fproxy-secure-hash header, and carry a timestamp (in seconds since epoch) of less than \
+        GithubProxy.debug_signature_ttl seconds, so that a signature cannot be replayed later on
+
+        :param step: Step of the errors
+        :return: Error, or None if the query is accepted
+        :rtype: self.ProxyError or None
+        """
+        if not self.verify(
+            request.query_string.decode("utf-8"),
+            request.headers.get("fproxy-secure-hash"), request.headers.get("fproxy-signature")
+        ):
+            return self.ProxyError(300, "Hash does not correspond with query", step=step)
+        try:
+            age = abs(time.time() - float(request.args.get("timestamp", "")))
+        except ValueError:
+            age = None
+        if age is None or age > self.debug_signature_ttl:
+            return self.ProxyError(
+                300, "Query should carry a timestamp of less than {} seconds".format(self.debug_signature_ttl),
+                step=step
+            )
+
+    def r_profile(self):
+        """ Profile the requests served during a few seconds with a sampling profiler
+
+        The query string (eg: seconds=10&interval=0.005&timestamp=1476000000) must be signed (See \
+        GithubProxy.verify_debug_query). The stacks are prefixed with the endpoint the thread serves.
+
+        :return: Text Response with the collapsed stacks (for flamegraph.pl or speedscope)
+        """
+        error = self.verify_debug_query("profile")
+        if error is not None:
+            return error.response()
+        try:
+            seconds = float(request.args.get("seconds", 10))
+            interval = float(request.args.get("interval", self.sampler.interval))
+        except ValueError:
+            return self.ProxyError(400, "Seconds and interval should be numbers", step="profile").response()
+        if not 0 < seconds <= self.profile_max_duration or not 0.001 <= interval <= 1:
+            return self.ProxyError(
+                400, "Seconds should be between 0 and {}, interval between 0.001 and 1".format(
+                    self.profile_max_duration
+                ), step="profile"
+            ).response()
+
+        stacks = self.sampler.profile(seconds, interval)
+        if stacks is None:
+            return self.ProxyError(409, "A profile is already running", step="profile").response()
+        response = Response(self.sampler.collapsed(stacks), content_type="text/plain; charset=utf-8")
+        response.headers["X-Profile-Samples"] = str(self.sampler.samples)
+        return response
+
+    def r_memory(self):
+        """ Report of the allocations traced with memory_tracking : peaks of memory allocated by the requests of each \
+        route, top allocation sites and the sites which grew since the previous report
+
+        The query string (eg: timestamp=1476000000) must be signed (See GithubProxy.verify_debug_query).
+
+        :return: JSON Response
+        """
+        error = self.verify_debug_query("memory")
+        if error is not None:
+            return error.response()
+        if not self.memory_tracking:
+            return self.ProxyError(409, "Memory tracking is not enabled", step="memory").response()
+        return jsonify(self.allocations.report())
+
     def r_main(self):
         """ Main Route of the API
 
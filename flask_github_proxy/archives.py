@@ -0,0 +1,129 @@
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+
+class ArchiveError(ValueError):
+    """ Raised when a body is not a supported archive or when it is corrupted
+    """
+
+
+class ArchiveTooLarge(ArchiveError):
+    """ Raised when the entries of an archive decompress past the allowed limits
+    """
+
+
+# zipfile raises RuntimeError for encrypted entries
+ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error, NotImplementedError, RuntimeError)
+
+
+class Limits(object):
+    """ Bounds the size of the entries of an archive altogether, while they are read
+
+    :param archive_size: Size (in bytes) of the archive
+    :param max_size: Maximum size (in bytes) of the entries altogether. None for no limit
+    :param max_ratio: Maximum ratio between the size of the entries and the size of the archive. None for no limit
+
+    :ivar size: Size of the entries read so far
+    """
+    def __init__(self, archive_size, max_size=None, max_ratio=None):
+        self.archive_size = archive_size
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.size = 0
+
+    def count(self, length):
+        """ Count bytes read from an entry
+
+        :param length: Number of bytes read
+        :raises ArchiveTooLarge: If the entries go past the limits
+        """
+        self.size += length
+        if self.max_size and self.size > self.max_size:
+            raise ArchiveTooLarge("Archive is larger than {} bytes".format(self.max_size))
+        elif self.max_ratio and self.size > 1024 * 1024 and self.size > self.max_ratio * self.archive_size:
+            raise ArchiveTooLarge("Archive decompresses more than {} times its size".format(self.max_ratio))
+
+
+class EntryReader(object):
+    """ Readable stream of an archive entry, raising ArchiveError when the entry is corrupted or goes past the limits
+
+    :param stream: Stream opened by tarfile or zipfile
+    :param limits: Limits shared by the entries of the archive
+    :type limits: Limits
+    """
+    def __init__(self, stream, limits=None):
+        self.__stream__ = stream
+        self.__limits__ = limits
+
+    def read(self, size=-1):
+        try:
+            data = self.__stream__.read(size)
+        except ERRORS as error:
+            raise ArchiveError("Archive entry is corrupted : {}".format(error))
+        if self.__limits__ is not None:
+            self.__limits__.count(len(data))
+        return data
+
+
+def entry_path(prefix, name):
+    """ Build the path of an archive entry in the repository
+
+    :param prefix: Folder of the repository where the archive is extracted
+    :param name: Name of the entry in the archive
+    :return: Normalized path, or None if it would leave the prefix (absolute path, "..")
+    """
+    name = posixpath.normpath(name.replace("\\", "/"))
+    if name.startswith("/") or name == ".." or name.startswith("../") or name == ".":
+        return None
+    return posixpath.join(prefix.strip("/"), name) if prefix.strip("/") else name
+
+
+def open_archive(file, max_size=None, max_ratio=None):
+    """ Open a tar (optionally compressed) or a zip archive and iterate over its regular files
+
+    A tar archive is read as a stream : each entry must be consumed before the next one is reached. A zip archive \
+    needs to be seekable (eg: a temporary file), as its index is at its end.
+
+    :param file: Seekable binary file holding the archive
+    :param max_size: Maximum size (in bytes) of the entries altogether, checked while they are read
+    :param max_ratio: Maximum ratio between the size of the entries and the size of the archive (checked past 1MB)
+    :return: Iterator of (name, executable, EntryReader) for each regular file
+    :raises ArchiveError: If the file is neither a tar nor a zip archive
+    """
+    limits = Limits(file.seek(0, 2), max_size=max_size, max_ratio=max_ratio)
+    file.seek(0)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        try:
+            return __zip_entries__(zipfile.ZipFile(file), limits)
+        except zipfile.BadZipFile as error:
+            raise ArchiveError("Zip archive could not be read : {}".format(error))
+    file.seek(0)
+    try:
+        return __tar_entries__(tarfile.open(fileobj=file, mode="r|*"), limits)
+    except ERRORS:
+        raise ArchiveError("Body is neither a tar nor a zip archive")
+
+
+def __tar_entries__(archive, limits):
+    try:
+        for member in archive:
+            if member.isfile():
+                yield member.name, bool(member.mode & 0o111), EntryReader(archive.extractfile(member), limits)
+    except ERRORS as error:
+        raise ArchiveError("Tar archive is corrupted : {}".format(error))
+    finally:
+        archive.close()
+
+
+def __zip_entries__(archive, limits):
+    try:
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, bool((info.external_attr >> 16) & 0o111), EntryReader(archive.open(info), limits)
+    except ERRORS as error:
+        raise ArchiveError("Zip archive is corrupted : {}".format(error))
+    finally:
+        archive.close()
@@ -0,0 +1,508 @@
+from threading import Event, Lock, RLock, Thread
+import json
+import logging
+import os
+import subprocess
+import uuid
+from urllib.parse import urlsplit, urlunsplit, unquote
+from flask_github_proxy.models import ProxyError
+from flask_github_proxy.cache import TTLCache
+
+
+class GitError(Exception):
+    """ Raised when a git command fails
+
+    :param command: Arguments of the command
+    :param message: Error output of the command
+    """
+    def __init__(self, command, message):
+        super(GitError, self).__init__("git {} : {}".format(" ".join(command), message))
+        self.command = command
+        self.message = message
+
+
+# Credential helper answering git with the credentials given in its environment (See GitBackend.run)
+CREDENTIAL_HELPER = '!f() { echo "username=${GIT_PROXY_USERNAME}"; echo "password=${GIT_PROXY_PASSWORD}"; }; f'
+
+
+class GitBackend(object):
+    """ Writes files as commits into a local bare repository and pushes them to the origin repository by batches
+
+    Commits are built with git plumbing commands, without any working tree. Commits of a branch stay local until \
+    GitBackend.flush() pushes them : it happens when a branch holds max_commits commits or max_size bytes, every \
+    interval seconds, and whenever a pull request is about to be opened for the branch.
+
+    Each branch has its own lock, held while it is fetched or committed to, so that a slow remote only holds the \
+    requests writing to the same branch. Pushes do not hold the locks of the branches.
+
+    :param path: Path of the local bare repository, created if needed
+    :type path: str
+    :param remote: URL (or path) of the origin repository, including its credentials. Credentials are taken out of \
+    the URL and given to git through a credential helper, so that they never show in the arguments of commands \
+    nor in errors
+    :type remote: str
+    :param interval: Time (in seconds) after which pending commits are pushed. None to push them only on triggers
+    :type interval: int
+    :param max_commits: Number of pending commits of a branch from which it is pushed
+    :type max_commits: int
+    :param max_size: Size (in bytes) of the pending contents of a branch from which it is pushed
+    :type max_size: int
+    :param git: Path of the git executable
+    :param logger: Logger
+
+    :cvar ProxyError: Class of the errors, replaced by the one of the proxy the backend is bound to
+    :ivar pending: Number of commits and size of the contents waiting to be pushed, where keys are branches
+    :type pending: dict
+    """
+    ProxyError = ProxyError
+
+    def __init__(self, path, remote, interval=30, max_commits=50, max_size=16 * 1024 * 1024, git="git", logger=None):
+        self.path = path
+        self.remote, self.__credentials__ = self.split_credentials(remote)
+        self.interval = interval
+        self.max_commits = max_commits
+        self.max_size = max_size
+        self.git = git
+        self.logger = logger or logging.getLogger(__name__)
+        self.pending = {}
+        self.__lock__ = Lock()
+        self.__branches__ = {}
+        self.__push_lock__ = Lock()
+        self.__stopped__ = Event()
+        self.__thread__ = None
+        if not os.path.isdir(path):
+            self.run("init", "--bare", "--quiet", path, git_dir=False)
+
+    def bind(self, proxy):
+        """ Attach the backend to the proxy using it
+
+        :param proxy: Proxy using the backend
+        :type proxy: flask_github_proxy.GithubProxy
+        """
+        self.logger = proxy.logger
+        self.ProxyError = proxy.ProxyError
+
+    @staticmethod
+    def split_credentials(remote):
+        """ Take the credentials out of the URL of a remote
+
+        :param remote: URL (or path) of the remote
+        :return: URL without credentials, and the environment variables read by CREDENTIAL_HELPER (None if the URL \
+        has no credentials)
+        :rtype: (str, dict)
+        """
+        parts = urlsplit(remote)
+        if not parts.scheme or "@" not in parts.netloc:
+            return remote, None
+        return urlunsplit(parts._replace(netloc=parts.netloc.rpartition("@")[2])), {
+            "GIT_PROXY_USERNAME": unquote(parts.username or ""),
+            "GIT_PROXY_PASSWORD": unquote(parts.password or "")
+        }
+
+    def run(self, *command, stdin=None, env=None, git_dir=True):
+        """ Run a git command
+
+        :param command: Arguments of the command
+        :param stdin: Iterator of bytes to write to the command
+        :param env: Additional environment variables
+        :param git_dir: Run the command against the local repository
+        :return: Output of the command, stripped
+        :rtype: str
+        :raises GitError: If the command fails
+        """
+        arguments = [self.git] + (["--git-dir", self.path] if git_dir else [])
+        environment = dict(os.environ, GIT_TERMINAL_PROMPT="0", **(env or {}))
+        if self.__credentials__:
+            # The first, empty, helper discards the helpers of the system, which could store the credentials
+            arguments += ["-c", "credential.helper=", "-c", "credential.helper={}".format(CREDENTIAL_HELPER)]
+            environment.update(self.__credentials__)
+        arguments += list(command)
+        process = subprocess.Popen(
+            arguments, env=environment,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if stdin is not None:
+            try:
+                for chunk in stdin:
+                    process.stdin.write(chunk)
+            except BrokenPipeError:
+                pass
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise GitError(command, error.decode("utf-8", "replace").strip())
+        return output.decode("utf-8").strip()
+
+    def error(self, error, step):
+        """ Turn a GitError into a ProxyError
+
+        :param error: Error raised
+        :type error: GitError
+        :param step: Step of the workflow
+        :return: Error
+        :rtype: ProxyError
+        """
+        return self.ProxyError(
+            500, error.message, step=step,
+            context={"command": [argument for argument in error.command if argument != self.remote]}
+        )
+
+    def lock(self, branch):
+        """ Lock of a branch
+
+        :param branch: Name of the branch
+        :return: Lock held while the branch is fetched or committed to
+        :rtype: threading.RLock
+        """
+        with self.__lock__:
+            return self.__branches__.setdefault(branch, RLock())
+
+    def head(self, branch):
+        """ Sha of the local head of a branch
+
+        :param branch: Name of the branch
+        :return: Sha of the branch, or None if it does not exist locally
+        """
+        try:
+            return self.run("rev-parse", "--verify", "--quiet", "refs/heads/{}".format(branch))
+        except GitError:
+            return None
+
+    def blob(self, commit, path):
+        """ Sha of the blob of a file in a commit
+
+        :param commit: Sha of the commit
+        :param path: Path of the file
+        :return: Sha of the blob, or None if the file does not exist
+        """
+        try:
+            return self.run("rev-parse", "--verify", "--quiet", "{}:{}".format(commit, path))
+        except GitError:
+            return None
+
+    def fetch(self, branch):
+        """ Update the local branch with the one of the origin repository
+
+        :param branch: Name of the branch
+        :return: Sha of the branch, or None if it does not exist on the origin repository
+        """
+        try:
+            self.run("fetch", "--quiet", self.remote, "+refs/heads/{0}:refs/heads/{0}".format(branch))
+        except GitError as error:
+            if "couldn't find remote ref" in error.message:
+                return None
+            raise
+        return self.head(branch)
+
+    def ensure_branch(self, branch, base):
+        """ Make sure a branch exists locally, up to date with the origin repository unless it has pending commits
+
+        :param branch: Name of the branch
+        :param base: Name of the branch to create it from if it does not exist on the origin repository
+        :return: Sha of the branch or ProxyError
+        :rtype: str or ProxyError
+        """
+        with self.lock(branch):
+            if self.has_pending(branch):
+                return self.head(branch)
+            try:
+                sha = self.fetch(branch)
+                if sha is None:
+                    with self.lock(base):
+                        # Commits of the base which were not pushed yet would be lost by a fetch
+                        sha = self.head(base) if self.has_pending(base) else self.fetch(base)
+                    if sha is None:
+                        return self.ProxyError(
+                            404,
+                            "The default branch from which to checkout is either not available or does not exist",
+                            step="make_ref"
+                        )
+                    self.run("update-ref", "refs/heads/{}".format(branch), sha)
+            except GitError as error:
+                return self.error(error, "get_ref")
+            return sha
+
+    def has_pending(self, branch):
+        """ Check whether a branch has commits waiting to be pushed
+
+        :param branch: Name of the branch
+        :rtype: bool
+        """
+        with self.__lock__:
+            return branch in self.pending
+
+    def write(self, file):
+        """ Commit the content of a file on its branch, locally
+
+        :param file: File to commit, with its branch set up and existing locally (See GitBackend.ensure_branch)
+        :return: File with new information, including success (or Error)
+        :rtype: File or ProxyError
+        """
+        env = {
+            "GIT_AUTHOR_NAME": file.author.name, "GIT_AUTHOR_EMAIL": file.author.email,
+            "GIT_COMMITTER_NAME": file.author.name, "GIT_COMMITTER_EMAIL": file.author.email
+        }
+        ref = "refs/heads/{}".format(file.branch)
+        with self.lock(file.branch):
+            index = os.path.join(self.path, "index-{}".format(uuid.uuid4().hex))
+            try:
+                blob = self.run("hash-object", "-w", "--stdin", stdin=file.decoded_chunks())
+                parent = self.run("rev-parse", "--verify", ref)
+                if file.base and file.base != self.blob(parent, file.path):
+                    return self.ProxyError(
+                        409, "The file changed since the base of the patch {}".format(file.base),
+                        step="patch", context={"base": file.base}
+                    )
+                # A temporary index holds the tree of the parent, updated with the file
+                index_env = {"GIT_INDEX_FILE": index}
+                self.run("read-tree", parent, env=index_env)
+                self.run("update-index", "--add", "--cacheinfo", "100644,{},{}".format(blob, file.path), env=index_env)
+                tree = self.run("write-tree", env=index_env)
+                if tree != self.run("rev-parse", "{}^{{tree}}".format(parent)):
+                    commit = self.run("commit-tree", tree, "-p", parent, "-m", file.logs, env=env)
+                    self.run("update-ref", ref, commit, parent)
+                    with self.__lock__:
+                        commits, size = self.pending.get(file.branch, (0, 0))
+                        self.pending[file.branch] = (commits + 1, size + file.size)
+            except GitError as error:
+                return self.error(error, "commit")
+            finally:
+                if os.path.exists(index):
+                    os.remove(index)
+        with self.__lock__:
+            commits, size = self.pending.get(file.branch, (0, 0))
+        full = commits >= self.max_commits or size >= self.max_size
+
+        file.pushed = True
+        file.blob = blob
+        if full:
+            flushed = self.flush([file.branch])
+            if isinstance(flushed, ProxyError):
+                return flushed
+        elif self.interval:
+            self.start()
+        return file
+
+    def flush(self, branches=None):
+        """ Push pending commits to the origin repository
+
+        Writes go on while pushing : only the commits which were pending when the push started are marked as \
+        pushed. A branch which could not be pushed (eg: it moved on the origin repository) keeps its commits pending. \
+        Flushes run one at a time, so that commits are not marked as pushed twice.
+
+        :param branches: Branches to push. Defaults to every branch with pending commits
+        :return: True or ProxyError for the last branch which could not be pushed
+        :rtype: bool or ProxyError
+        """
+        with self.__push_lock__:
+            return self.__flush__(branches)
+
+    def __flush__(self, branches):
+        if branches is None:
+            with self.__lock__:
+                branches = list(self.pending)
+        snapshot = {}
+        for branch in branches:
+            # The head and the pending commits of a branch are read together, between two writes
+            with self.lock(branch):
+                with self.__lock__:
+                    pending = self.pending.get(branch)
+                if pending is not None:
+                    snapshot[branch] = (self.head(branch), pending)
+        if not snapshot:
+            return True
+
+        def refspec(branch):
+            return "{sha}:refs/heads/{branch}".format(sha=snapshot[branch][0], branch=branch)
+
+        try:
+            self.run("push", "--quiet", self.remote, *[refspec(branch) for branch in snapshot])
+            pushed, result = list(snapshot), True
+        except GitError:
+            # Branches are pushed again one by one, so that one rejected branch does not hold the others
+            pushed, result = [], True
+            for branch in snapshot:
+                try:
+                    self.run("push", "--quiet", self.remote, refspec(branch))
+                    pushed.append(branch)
+                except GitError as error:
+                    self.logger.error("Branch could not be pushed", extra={"branch": branch, "reason": error.message})
+                    result = self.error(error, "push")
+
+        with self.__lock__:
+            for branch in pushed:
+                commits, size = self.pending.get(branch, (0, 0))
+                done_commits, done_size = snapshot[branch][1]
+                if commits <= done_commits:
+                    self.pending.pop(branch, None)
+                else:
+                    self.pending[branch] = (commits - done_commits, size - done_size)
+        return result
+
+    def start(self):
+        """ Start the thread pushing pending commits every GitBackend.interval seconds, if it is not running
+        """
+        with self.__lock__:
+            if self.__thread__ is not None or not self.interval:
+                return
+            self.__stopped__.clear()
+            self.__thread__ = Thread(target=self.__loop__, name="GitBackend", daemon=True)
+            self.__thread__.start()
+
+    def __loop__(self):
+        while not self.__stopped__.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """ Stop the pushing thread and push pending commits
+
+        :return: True or ProxyError (See GitBackend.flush)
+        """
+        self.__stopped__.set()
+        if self.__thread__ is not None:
+            self.__thread__.join()
+            self.__thread__ = None
+        return self.flush()
+
+
+class GraphQLBackend(object):
+    """ Writes files through the createCommitOnBranch mutation of the Github GraphQL API
+
+    A file is committed in a single call, given the head the branch is expected to point to : neither the sha of \
+    the blob of the file nor the head of the branch is requested beforehand. Heads are kept in a cache, updated \
+    with each commit and refreshed when the branch moved in between.
+
+    .. note:: The author of the commits is the owner of the token : the author of the file is credited through a \
+    Co-authored-by trailer.
+
+    :param heads_ttl: Time (in seconds) during which the head of a branch is trusted without being requested
+    :type heads_ttl: int
+
+    :cvar MUTATION: GraphQL document of the mutation
+    :cvar ERRORS: HTTP codes of GraphQL error types
+    :cvar ProxyError: Class of the errors, replaced by the one of the proxy the backend is bound to
+    :ivar heads: Heads of the branches, where keys are branches
+    :type heads: TTLCache
+    """
+    MUTATION = """mutation ($input: CreateCommitOnBranchInput!, $path: String!) {
+  createCommitOnBranch(input: $input) { commit { oid file(path: $path) { oid } } }
+}"""
+
+    ERRORS = {
+        "NOT_FOUND": 404,
+        "FORBIDDEN": 403,
+        "STALE_DATA": 409,
+        "UNPROCESSABLE": 422,
+        "RATE_LIMITED": 429
+    }
+
+    ProxyError = ProxyError
+
+    def __init__(self, heads_ttl=300):
+        self.heads = TTLCache(ttl=heads_ttl)
+        self.proxy = None
+
+    def bind(self, proxy):
+        """ Attach the backend to the proxy using it : requests go through its credentials
+
+        :param proxy: Proxy using the backend
+        :type proxy: flask_github_proxy.GithubProxy
+        """
+        self.proxy = proxy
+        self.ProxyError = proxy.ProxyError
+
+    def ensure_branch(self, branch, base):
+        """ Make sure a branch exists, reading its head from the cache when possible
+
+        :param branch: Name of the branch
+        :param base: Name of the branch to create it from
+        :return: Sha of the head of the branch or ProxyError
+        :rtype: str or ProxyError
+        """
+        head = self.heads.get(branch)
+        if head:
+            return head
+        head = self.proxy.get_ref(branch)
+        if not isinstance(head, ProxyError) and not head:
+            head = self.proxy.make_ref(branch)
+        if not isinstance(head, ProxyError):
+            self.heads.set(branch, head)
+        return head
+
+    def write(self, file):
+        """ Commit the content of a file on its branch
+
+        If the branch moved since its head was cached, the head is requested again and the commit is replayed, at \
+        most GithubProxy.conflict_retries times. A patched file (File.base is set) is checked against its base first.
+
+        :param file: File to commit, with its branch set up
+        :return: File with new information, including success (or Error)
+        :rtype: File or ProxyError
+        """
+        proxy = self.proxy
+        if file.base:
+            current = proxy.get(file)
+            if isinstance(current, ProxyError):
+                return current
+            elif file.blob != file.base:
+                return self.ProxyError(
+                    409, "The file changed since the base of the patch {}".format(file.base),
+                    step="patch", context={"base": file.base, "blob": file.blob}
+                )
+
+        uri = "{api}/graphql".format(api=proxy.github_api_url)
+        retries = 0
+        while True:
+            head = self.ensure_branch(file.branch, proxy.master_upstream)
+            if isinstance(head, ProxyError):
+                return head
+            params = {
+                "query": self.MUTATION,
+                "variables": {
+                    "path": file.path,
+                    "input": {
+                        "branch": {"repositoryNameWithOwner": proxy.origin, "branchName": file.branch},
+                        "message": {
+                            "headline": file.logs,
+                            "body": "Co-authored-by: {name} <{email}>".format(
+                                name=file.author.name, email=file.author.email
+                            )
+                        },
+                        "fileChanges": {"additions": [{"path": file.path, "contents": file}]},
+                        "expectedHeadOid": head
+                    }
+                }
+            }
+            data = proxy.request("POST", uri, data=params)
+            reply = json.loads(data.content.decode("utf-8"))
+            if data.status_code != 200:
+                return self.ProxyError(data.status_code, (reply, "message"), step="graphql", context={"uri": uri})
+            elif not reply.get("errors"):
+                commit = reply["data"]["createCommitOnBranch"]["commit"]
+                self.heads.set(file.branch, commit["oid"])
+                file.pushed = True
+                file.blob = commit["file"]["oid"] if commit.get("file") else None
+                return file
+
+            error = reply["errors"][0]
+            code = self.ERRORS.get(error.get("type"), 502)
+            if code == 409 and not file.base and retries < proxy.conflict_retries:
+                # The branch moved since we cached its head
+                proxy.counters["conflicts"] += 1
+                proxy.retried()
+                retries += 1
+                self.heads.pop(file.branch)
+                continue
+            elif code == 409:
+                proxy.counters["conflicts"] += 1
+            return self.ProxyError(
+                code, error.get("message", "GraphQL error"),
+                step="graphql", context={"uri": uri, "branch": file.branch, "expectedHeadOid": head}
+            )
+
+    def flush(self, branches=None):
+        """ Commits are written right away : there is nothing to push
+
+        :param branches: Branches to push
+        :return: True
+        """
+        return True
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class TTLCache(object):
+    """ Bounded and thread-safe mapping whose items expire after a given time
+
+    When the cache is full, the least recently set item is dropped.
+
+    :param maxsize: Maximum number of items to keep
+    :type maxsize: int
+    :param ttl: Time to live of an item, in seconds
+    :type ttl: int or float
+    :param timer: Function returning the current time in seconds
+    """
+    def __init__(self, maxsize=1024, ttl=3600, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.__items__ = OrderedDict()
+        self.__lock__ = Lock()
+
+    def __expire__(self, now):
+        """ Drop expired items. Must be called with the lock held
+
+        :param now: Current time
+        """
+        while self.__items__:
+            key, (expires, _) = next(iter(self.__items__.items()))
+            if expires > now:
+                break
+            del self.__items__[key]
+
+    def get(self, key, default=None):
+        """ Retrieve an item
+
+        :param key: Key of the item
+        :param default: Value to return if the item is unknown or expired
+        :return: Value of the item
+        """
+        with self.__lock__:
+            self.__expire__(self.timer())
+            if key in self.__items__:
+                return self.__items__[key][1]
+            return default
+
+    def set(self, key, value):
+        """ Store an item, resetting its time to live
+
+        :param key: Key of the item
+        :param value: Value of the item
+        """
+        with self.__lock__:
+            now = self.timer()
+            self.__expire__(now)
+            self.__items__.pop(key, None)
+            self.__items__[key] = (now + self.ttl, value)
+            while len(self.__items__) > self.maxsize:
+                self.__items__.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """ Remove an item and return it
+
+        :param key: Key of the item
+        :param default: Value to return if the item is unknown
+        :return: Value of the item
+        """
+        with self.__lock__:
+            if key in self.__items__:
+                return self.__items__.pop(key)[1]
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        with self.__lock__:
+            self.__expire__(self.timer())
+            return len(self.__items__)
@@ -0,0 +1,123 @@
+from logging.handlers import QueueHandler, QueueListener
+from hashlib import sha256
+from queue import Queue
+from threading import Lock
+import atexit
+import logging
+from pythonjsonlogger import jsonlogger
+
+
+# Listeners of the loggers whose JSON handler is installed, by name of the logger
+LISTENERS = {}
+__listeners_lock__ = Lock()
+
+REDACTED = "<redacted>"
+SECRET_HEADERS = ("authorization",)
+
+
+def summarize(value, size=1024):
+    """ Make a payload cheap to log : strings and bytes longer than size are replaced by their length, their first \
+    characters and their sha256, secret headers are redacted and streams are replaced by their length
+
+    :param value: Payload (dict, list, str, bytes, stream...)
+    :param size: Number of characters or bytes above which a value is truncated and hashed
+    :return: Summary of the payload, which can be serialized to JSON
+    """
+    if isinstance(value, dict) or hasattr(value, "items"):
+        return {
+            key: REDACTED if str(key).lower() in SECRET_HEADERS else summarize(item, size)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [summarize(item, size) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) <= size:
+            return value.decode("utf-8", "replace")
+        return {
+            "length": len(value), "sha256": sha256(value).hexdigest(),
+            "head": bytes(value[:64]).decode("utf-8", "replace")
+        }
+    if isinstance(value, str):
+        if len(value) <= size:
+            return value
+        return {
+            "length": len(value), "sha256": sha256(value.encode("utf-8")).hexdigest(),
+            "head": value[:64]
+        }
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    if hasattr(value, "__len__"):
+        # Streams (eg: JSONStream) are consumed by the request, only their length is known
+        return {"length": len(value)}
+    return str(value)
+
+
+class Lazy(object):
+    """ Value of a log record computed only when the record is handled (See ResolveFilter)
+
+    :param function: Function computing the value
+    :param args: Arguments of the function
+    """
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def resolve(self):
+        return self.function(*self.args)
+
+    def __str__(self):
+        return str(self.resolve())
+
+
+class ResolveFilter(logging.Filter):
+    """ Computes the Lazy values of a record. Used on the handler of the listener, so that they are computed \
+    off the request thread and only for records which are handled
+    """
+    def filter(self, record):
+        for key, value in list(record.__dict__.items()):
+            if isinstance(value, Lazy):
+                setattr(record, key, value.resolve())
+        return True
+
+
+def install_json_handler(logger, level=logging.INFO):
+    """ Route the records of a logger through a queue to a background thread writing them as JSON
+
+    The handler is installed once per logger, however many proxies use it. The level of the logger is only set \
+    if the application did not set one : records of Github calls, logged at DEBUG, are left out unless the \
+    application asks for them.
+
+    :param logger: Logger
+    :type logger: logging.Logger
+    :param level: Level of the logger if it has none
+    :return: Listener of the queue
+    :rtype: QueueListener
+    """
+    with __listeners_lock__:
+        listener = LISTENERS.get(logger.name)
+        if listener is not None:
+            return listener
+
+        stream = logging.StreamHandler()
+        stream.setFormatter(jsonlogger.JsonFormatter())
+        stream.addFilter(ResolveFilter())
+        queue = Queue()
+        listener = QueueListener(queue, stream)
+        listener.start()
+
+        logger.addHandler(QueueHandler(queue))
+        if logger.level == logging.NOTSET:
+            logger.setLevel(level)
+        LISTENERS[logger.name] = listener
+        return listener
+
+
+def shutdown():
+    """ Write the records left in the queues and stop the listeners. Called at exit
+    """
+    with __listeners_lock__:
+        while LISTENERS:
+            LISTENERS.popitem()[1].stop()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,136 @@
+from threading import Lock
+import tracemalloc
+
+
+# Allocations of the instrumentation itself, left out of the snapshots
+IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+)
+
+
+# tracemalloc.reset_peak() only exists from Python 3.9
+RESET_PEAK = hasattr(tracemalloc, "reset_peak")
+
+
+class AllocationTracker(object):
+    """ Records the peak of memory allocated by each request, by route, and the allocation sites growing between \
+    two snapshots, with tracemalloc
+
+    tracemalloc has a single peak for the whole process. It is only reset when no other request is tracked, so \
+    that a request never lowers the peak of another one. The peak of a request running alone is exact. When \
+    requests overlap, it is approximate in both directions : it includes the allocations of the others, and \
+    memory they free while it runs may hide some of its own.
+
+    Before Python 3.9, the peak cannot be reset : the memory still allocated when the request ends, above the one \
+    allocated when it started, is recorded instead. It leaves out what the request freed before its end.
+
+    :param top: Number of allocation sites reported
+    :param frames: Number of frames kept for each allocation (more frames make tracemalloc slower)
+
+    :ivar routes: Number of calls, maximum and total peak (in bytes) of the requests of each route
+    :type routes: dict
+    """
+    def __init__(self, top=10, frames=1):
+        self.top = top
+        self.frames = frames
+        self.routes = {}
+        self.__snapshot__ = None
+        self.__running__ = 0
+        self.__lock__ = Lock()
+
+    def start(self):
+        """ Start tracing allocations, if they are not traced yet
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def begin(self):
+        """ Mark the start of a request
+
+        :return: Memory allocated when the request starts, to be given to AllocationTracker.end()
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        with self.__lock__:
+            current, _ = tracemalloc.get_traced_memory()
+            if not self.__running__ and RESET_PEAK:
+                tracemalloc.reset_peak()
+            self.__running__ += 1
+        return current
+
+    def end(self, route, baseline):
+        """ Record the peak of allocations of a request
+
+        :param route: Route (endpoint) of the request
+        :param baseline: Value returned by AllocationTracker.begin() at the start of the request
+        :return: Peak (in bytes) allocated above the baseline
+        """
+        if baseline is None:
+            return None
+        self.cancel(baseline)
+        if not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max((peak if RESET_PEAK else current) - baseline, 0)
+        with self.__lock__:
+            stats = self.routes.setdefault(route, {"calls": 0, "peak_max": 0, "peak_total": 0})
+            stats["calls"] += 1
+            stats["peak_total"] += peak
+            stats["peak_max"] = max(stats["peak_max"], peak)
+        return peak
+
+    def cancel(self, baseline):
+        """ Stop tracking a request without recording its peak (eg: a request which ended before its response)
+
+        :param baseline: Value returned by AllocationTracker.begin() at the start of the request
+        """
+        if baseline is not None:
+            with self.__lock__:
+                self.__running__ -= 1
+
+    def report(self):
+        """ Take a snapshot and compare it to the one of the previous report
+
+        :return: Traced memory, peaks of the routes and top allocation sites (by size, and by growth since the \
+        previous report)
+        :rtype: dict
+        """
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+        with self.__lock__:
+            previous, self.__snapshot__ = self.__snapshot__, snapshot
+            routes = {route: dict(stats) for route, stats in self.routes.items()}
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "tracing": True,
+            "current": current,
+            "peak": peak,
+            "routes": routes,
+            "top": [
+                {"site": self.site(stat.traceback), "size": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:self.top]
+            ]
+        }
+        if previous is not None:
+            report["growth"] = [
+                {
+                    "site": self.site(stat.traceback), "size": stat.size, "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff
+                }
+                for stat in snapshot.compare_to(previous, "lineno")[:self.top]
+            ]
+        return report
+
+    @staticmethod
+    def site(traceback):
+        """ Represent the innermost frame of an allocation
+
+        :param traceback: tracemalloc.Traceback
+        :return: filename:lineno
+        """
+        frame = traceback[0]
+        return "{}:{}".format(frame.filename, frame.lineno)
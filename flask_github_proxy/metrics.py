@@ -0,0 +1,413 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from flask import g, has_request_context
+import functools
+import time
+
+
+# Phases of the Server-Timing header the workflow steps belong to
+PHASES = {
+    "verify": "hash",
+    "get_ref": "branch",
+    "make_ref": "branch",
+    "get": "exists",
+    "get_blob": "base",
+    "put": "write",
+    "update": "write",
+    "commit_tree": "write",
+    "make_blob": "write",
+    "list_pull_requests": "pr",
+    "pull_request": "pr",
+    "patch_ref": "update"
+}
+
+CALL_BUCKETS = (1, 2, 3, 4, 5, 6, 7, 8, 10, 15, 20, 50)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(11))
+
+
+def escape(value):
+    """ Escape a label value for the text exposition format
+
+    :param value: Value of the label
+    :return: Escaped value
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+class Metric(object):
+    """ Metric whose values are identified by the values of its labels
+
+    :param name: Name of the metric
+    :param documentation: Help text of the metric
+    :param labels: Names of the labels
+    :type labels: tuple
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.__values__ = {}
+        self.__lock__ = Lock()
+
+    def selector(self, values, extra=()):
+        """ Format the labels of a sample
+
+        :param values: Values of the labels
+        :param extra: Additional (name, value) labels
+        :return: Labels between braces, or an empty string
+        """
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join("{}=\"{}\"".format(name, escape(value)) for name, value in pairs) + "}"
+
+    def samples(self):
+        """ Lines of the samples of the metric
+
+        :return: Iterator of lines
+        """
+        with self.__lock__:
+            values = sorted(self.__values__.items())
+        for labels, value in values:
+            yield "{}{} {}".format(self.name, self.selector(labels), value)
+
+    def expose(self):
+        """ Lines of the metric in the text exposition format
+
+        :return: Iterator of lines
+        """
+        yield "# HELP {} {}".format(self.name, self.documentation)
+        yield "# TYPE {} {}".format(self.name, self.TYPE)
+        for line in self.samples():
+            yield line
+
+
+class Counter(Metric):
+    """ Value which only goes up
+    """
+    TYPE = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.__lock__:
+            self.__values__[labels] = self.__values__.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """ Value which goes up and down
+    """
+    TYPE = "gauge"
+
+    def set(self, value, *labels):
+        with self.__lock__:
+            self.__values__[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.__lock__:
+            self.__values__[labels] = self.__values__.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """ Distribution of observed values in buckets
+
+    Each observation only increments one bucket : cumulative counts are computed when the metric is exposed.
+
+    :param buckets: Upper bounds of the buckets, sorted
+    :type buckets: tuple
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.__lock__:
+            series = self.__values__.get(labels)
+            if series is None:
+                # Counts of each bucket (the last one being +Inf), then the sum of observations
+                series = self.__values__[labels] = [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self.__lock__:
+            values = sorted((labels, list(series)) for labels, series in self.__values__.items())
+        for labels, series in values:
+            cumulated = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulated += count
+                yield "{}_bucket{} {}".format(self.name, self.selector(labels, [("le", bound)]), cumulated)
+            yield "{}_sum{} {}".format(self.name, self.selector(labels), series[-1])
+            yield "{}_count{} {}".format(self.name, self.selector(labels), cumulated)
+
+
+class Registry(object):
+    """ Metrics of a proxy, exposed in the Prometheus text format
+
+    :param prefix: Prefix of the names of the metrics
+
+    :ivar steps: Duration of the steps of the workflows, by step and outcome (success or error)
+    :ivar github_requests: Duration of the requests made to Github, by method and status
+    :ivar responses: Duration of the responses of the proxy, by endpoint and status
+    :ivar body_sizes: Size of the bodies received, by endpoint
+    :ivar in_flight: Number of workflows running
+    :ivar rate_limit: Rate limit reported by Github, by resource and kind (limit, remaining, reset)
+    :ivar allocation_peaks: Peak of memory allocated by the requests, by endpoint (only with memory tracking)
+    :ivar workflow_calls: Number of calls to Github made by the requests, by endpoint and kind (See Budget)
+    :ivar budget_rejections: Number of requests rejected for exceeding their budget of calls, by endpoint
+    """
+    def __init__(self, prefix="github_proxy"):
+        self.prefix = prefix
+        self.metrics = []
+        self.steps = self.histogram("step_duration_seconds", "Duration of the workflow steps", ("step", "outcome"))
+        self.github_requests = self.histogram(
+            "github_request_duration_seconds", "Duration of the requests to Github", ("method", "status")
+        )
+        self.responses = self.histogram(
+            "response_duration_seconds", "Duration of the responses of the proxy", ("endpoint", "status")
+        )
+        self.body_sizes = self.histogram(
+            "body_size_bytes", "Size of the bodies received", ("endpoint",), buckets=SIZE_BUCKETS
+        )
+        self.in_flight = self.gauge("workflows_in_flight", "Number of workflows running")
+        self.rate_limit = self.gauge("github_rate_limit", "Rate limit reported by Github", ("resource", "kind"))
+        self.allocation_peaks = self.histogram(
+            "allocation_peak_bytes", "Peak of memory allocated by the requests", ("endpoint",), buckets=SIZE_BUCKETS
+        )
+        self.workflow_calls = self.histogram(
+            "workflow_github_calls", "Calls to Github made by the requests", ("endpoint", "kind"), buckets=CALL_BUCKETS
+        )
+        self.budget_rejections = self.counter(
+            "budget_rejections_total", "Requests rejected for exceeding their budget of calls to Github", ("endpoint",)
+        )
+
+    def histogram(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram("{}_{}".format(self.prefix, name), documentation, labels, buckets))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge("{}_{}".format(self.prefix, name), documentation, labels))
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter("{}_{}".format(self.prefix, name), documentation, labels))
+
+    def register(self, metric):
+        """ Add a metric to the registry
+
+        :param metric: Metric to expose
+        :return: Metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def observe_rate_limit(self, headers):
+        """ Record the rate limit headroom reported by the headers of a Github response
+
+        :param headers: Headers of the response
+        """
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is None:
+            return
+        resource = headers.get("X-RateLimit-Resource", "core")
+        self.rate_limit.set(int(remaining), resource, "remaining")
+        for header, kind in (("X-RateLimit-Limit", "limit"), ("X-RateLimit-Reset", "reset")):
+            if headers.get(header) is not None:
+                self.rate_limit.set(int(headers[header]), resource, kind)
+
+    def expose(self, counters=None):
+        """ Text exposition of the metrics
+
+        :param counters: Counters of events to expose along (eg: GithubProxy.counters)
+        :type counters: collections.Counter
+        :return: Text of the metrics
+        :rtype: str
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        if counters is not None:
+            events = Counter("{}_events_total".format(self.prefix), "Noticeable events of the workflows", ("event",))
+            for event, value in sorted(counters.items()):
+                events.inc(event, amount=value)
+            lines.extend(events.expose())
+        return "\n".join(lines) + "\n"
+
+
+class Timeline(object):
+    """ Durations of the phases of a request, and counts of its events, rendered as a Server-Timing header
+
+    Durations of a phase are summed. Only the outermost step is recorded, so that a step called by another one \
+    (eg: get_ref called while writing) is accounted in the phase of the latter.
+
+    :ivar start: Time at which the request started
+    :ivar depth: Number of recorded steps running
+    :ivar calls: Details of the calls to Github, only recorded when the request might be reported as slow
+    :type calls: list
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.depth = 0
+        self.durations = OrderedDict()
+        self.counts = OrderedDict()
+        self.calls = []
+
+    @staticmethod
+    def current():
+        """ Timeline of the current request
+
+        :return: Timeline or None outside of a request of the proxy
+        """
+        if has_request_context():
+            return g.get("github_proxy_timeline")
+
+    def add(self, phase, duration):
+        """ Record time spent in a phase
+
+        :param phase: Name of the phase
+        :param duration: Duration in seconds
+        """
+        self.durations[phase] = self.durations.get(phase, 0) + duration
+
+    def count(self, event, amount=1):
+        """ Count an event
+
+        :param event: Name of the event
+        :param amount: Amount to add
+        """
+        self.counts[event] = self.counts.get(event, 0) + amount
+
+    def elapsed(self):
+        """ Time elapsed since the request started
+
+        :return: Duration in seconds
+        """
+        return time.perf_counter() - self.start
+
+    def header(self):
+        """ Value of the Server-Timing header
+
+        :return: Durations (in milliseconds) of each phase and of the whole request, then counts of events
+        """
+        entries = ["{};dur={:.1f}".format(phase, duration * 1000) for phase, duration in self.durations.items()]
+        entries.append("total;dur={:.1f}".format(self.elapsed() * 1000))
+        entries.extend("{};desc=\"{}\"".format(event, count) for event, count in self.counts.items())
+        return ", ".join(entries)
+
+
+class BudgetExceeded(Exception):
+    """ Raised when a request is about to make more calls to Github than its budget allows
+
+    :param budget: Budget of the request
+    :type budget: Budget
+    """
+    def __init__(self, budget):
+        super(BudgetExceeded, self).__init__("Budget of {} calls to Github exceeded".format(budget.limit))
+        self.budget = budget
+
+
+class Budget(object):
+    """ Accounting of the calls to Github made by a request, and of the calls it spared
+
+    Calls are classified as reads (GET), writes, or pull requests (any call on the pulls of a repository). \
+    Spared calls are the ones served from a cache (pull requests index, known blobs, patch bases, kept results) \
+    or coalesced with an identical request running at the same time.
+
+    :param limit: Maximum number of calls. None for no limit
+
+    :ivar calls: Number of calls by kind (read, write, pr)
+    :ivar cached: Number of calls served from a cache, a kept result counting as one
+    :ivar coalesced: Number of results shared by an identical request running at the same time
+    :ivar retries: Number of calls made again after a failure (eg: a conflict)
+    """
+    KINDS = ("read", "write", "pr")
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.calls = OrderedDict((kind, 0) for kind in self.KINDS)
+        self.cached = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    @staticmethod
+    def current():
+        """ Budget of the current request
+
+        :return: Budget or None outside of a request of the proxy
+        """
+        if has_request_context():
+            return g.get("github_proxy_budget")
+
+    @staticmethod
+    def kind(method, url):
+        """ Classify a call to Github
+
+        :param method: HTTP Method of the call
+        :param url: URL of the call
+        :return: read, write or pr
+        """
+        if "/pulls" in url:
+            return "pr"
+        return "read" if method.upper() in ("GET", "HEAD") else "write"
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+    def spend(self, method, url):
+        """ Account a call about to be made
+
+        :param method: HTTP Method of the call
+        :param url: URL of the call
+        :raises BudgetExceeded: If the call would exceed the limit
+        """
+        if self.limit is not None and self.total >= self.limit:
+            raise BudgetExceeded(self)
+        self.calls[self.kind(method, url)] += 1
+
+    def dict(self):
+        """ Builds a dictionary representation of the object (eg: for JSON)
+
+        :return: Dictionary representation of the object
+        """
+        return dict(
+            self.calls, total=self.total, cached=self.cached, coalesced=self.coalesced, retries=self.retries,
+            limit=self.limit
+        )
+
+
+def timed(step):
+    """ Decorate a method of GithubProxy so that its duration is recorded as a workflow step, and in the \
+    Server-Timing header of the current request (See PHASES)
+
+    :param step: Name of the step
+    :return: Decorator
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            timeline = Timeline.current() if step in PHASES else None
+            if timeline is not None:
+                timeline.depth += 1
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = method(self, *args, **kwargs)
+                if not isinstance(result, self.ProxyError):
+                    outcome = "success"
+                return result
+            finally:
+                duration = time.perf_counter() - start
+                self.metrics.steps.observe(duration, step, outcome)
+                if timeline is not None:
+                    timeline.depth -= 1
+                    if not timeline.depth:
+                        timeline.add(PHASES[step], duration)
+        return wrapper
+    return decorator
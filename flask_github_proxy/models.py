@@ -1,8 +1,46 @@
 import base64
 from slugify import slugify
-from hashlib import sha256
+from hashlib import sha1, sha256
 from flask import jsonify
+from flask_github_proxy.streams import Spool, Base64Decoder, is_base64
+import json
 import logging
+import re
+
+
+WHITESPACES = re.compile(b"\\s")
+# Keys of a context which are never kept, as their value is a credential
+SECRET_KEYS = ("token", "authorization", "secret", "password")
+
+
+def compact(value, size=256):
+    """ Compact a value so that it can be kept and logged cheaply : files, strings and bytes longer than size are \
+    replaced by their length and their sha256, credentials are dropped
+
+    :param value: Value to compact (dict, list, File, str, bytes...)
+    :param size: Number of characters or bytes above which a value is replaced by its length and hash
+    :return: Compacted value
+    """
+    if isinstance(value, dict):
+        return {
+            key: compact(item, size) for key, item in value.items()
+            if not any(secret in str(key).lower() for secret in SECRET_KEYS)
+        }
+    if isinstance(value, (list, tuple)):
+        return [compact(item, size) for item in value]
+    if isinstance(value, File):
+        return {"file": value.path, "length": value.size, "sha256": value.sha}
+    if isinstance(value, str):
+        if len(value) <= size:
+            return value
+        value = value.encode("utf-8")
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) <= size:
+            return value.decode("utf-8", "replace")
+        return {"length": len(value), "sha256": sha256(value).hexdigest()}
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return compact(str(value), size)
 
 
 class Author(object):
@@ -49,17 +87,26 @@ class ProxyError(object):
     :param message: Message to display or a dict and its key
     :type message: str or tuple
 
+    :param context: Data about the failed step. It is kept compacted (See compact()) and capped to MAX_CONTEXT \
+    characters once serialized
+    :type context: dict
+
     :ivar code: HTTP Code Error
-    :ivar message: Message to display
+    :ivar message: Message to display, capped to MAX_MESSAGE characters
+    :ivar context: Compacted context
 
+    :cvar DEBUG_HOOK: Function called with each new error and its full context, before it is compacted
     """
     LOGGER = logging.getLogger(__name__)
+    MAX_MESSAGE = 1024
+    MAX_CONTEXT = 4096
+    MAX_VALUE = 256
+    DEBUG_HOOK = None
 
     def __init__(self, code, message, step=None, context=None):
         self.code = code
         self.message = message
         self.step = step
-        self.context = context
 
         if isinstance(message, tuple):
             # This way to work prevents failure if there is a huge issue on Github side or there is a change in API
@@ -70,6 +117,21 @@ class ProxyError(object):
             else:
                 self.message = dic
 
+        if type(self).DEBUG_HOOK is not None:
+            try:
+                type(self).DEBUG_HOOK(self, context)
+            except Exception as error:
+                self.LOGGER.warning("Debug hook of errors failed", extra={"reason": str(error)})
+
+        if isinstance(self.message, str) and len(self.message) > self.MAX_MESSAGE:
+            self.message = self.message[:self.MAX_MESSAGE] + "..."
+        if context is not None:
+            context = compact(context, self.MAX_VALUE)
+            size = len(json.dumps(context, default=str))
+            if size > self.MAX_CONTEXT:
+                context = {"truncated": size, "keys": sorted(str(key) for key in context)}
+        self.context = context
+
     @staticmethod
     def AdvancedJsonify(data, status_code):
         """ Advanced Jsonify Response Maker
@@ -108,14 +170,17 @@ class File(object):
 
     :param path: Path of the file on the repository
     :type path: str
-    :param content: Base64 encoded content of the file
-    :type content: byte
+    :param content: Base64 encoded content of the file, or a Spool holding it. Whitespaces are not kept
+    :raises ValueError: If the content (not held by a Spool) holds characters out of the base64 alphabet
+    :type content: str or bytes or Spool
     :param author: Author of the file
     :type author: Author
     :param date: Date of the modification
     :type date: str
     :param logs: Message about the modification (Usually for commit message)
     :type logs: str
+    :param sha: Sha256 hash of the decoded content, if it is already known
+    :type sha: str
 
     :ivar path: Path of the file on the repository
     :ivar content: Content of the file
@@ -123,15 +188,37 @@ class File(object):
     :ivar author: Author of the file
     :ivar date: Date of the modification
     :ivar sha: Sha hash of the content
+    :ivar git_sha: Sha of the git blob of the content
+    :ivar size: Size of the base64 encoded content
+    :ivar raw: Indicates that the content is held raw by a Spool, and encoded to base64 on the fly
+    :ivar spooled: Indicates if the content is held by a Spool on disk rather than in memory
+    :ivar blob: Sha of the git blob of the file on the branch
+    :ivar base: Sha of the git blob the content was patched from, which is the only version it can replace
+    :ivar pushed: Indicates that the content was written to the branch
+
+    .. note:: The content is decoded at most once and values derived from it are computed lazily and cached. \
+    The decoded content of a spooled file is never cached : hashes are computed over its chunks.
 
     """
-    def __init__(self, path, content, author, date, logs):
+    def __init__(self, path, content, author, date, logs, sha=None):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if not isinstance(content, Spool) and WHITESPACES.search(content):
+            # Whitespaces (line breaks) are dropped so that the content can go as is in a JSON document
+            content = b"".join(bytes(content).split())
+        if not isinstance(content, Spool) and not is_base64(content):
+            raise ValueError("Content of {} is not base64 encoded".format(path))
         self.__path__ = path
         self.__content__ = content
+        self.__decoded__ = None
+        self.__sha__ = sha
+        self.__git_sha__ = None
         self.__author__ = author
         self.__date__ = date
         self.__logs__ = logs
         self.blob = None
+        self.base = None
+        self.pushed = False
         self.posted = False
         self.__branch__ = None
 
@@ -149,7 +236,39 @@ class File(object):
 
     @property
     def content(self):
-        return base64.decodebytes(self.__content__.encode("utf-8"))
+        if self.spooled:
+            return b"".join(self.decoded_chunks())
+        if self.__decoded__ is None:
+            if self.raw:
+                self.__decoded__ = bytes(self.__in_memory__())
+            else:
+                self.__decoded__ = base64.b64decode(self.__in_memory__())
+        return self.__decoded__
+
+    @property
+    def raw(self):
+        return isinstance(self.__content__, Spool) and self.__content__.raw
+
+    @property
+    def spooled(self):
+        return isinstance(self.__content__, Spool) and self.__content__.on_disk
+
+    @property
+    def size(self):
+        if self.raw:
+            return (self.__content__.size + 2) // 3 * 4
+        elif isinstance(self.__content__, Spool):
+            return self.__content__.size
+        return len(self.__content__)
+
+    def __in_memory__(self):
+        """ Access the base64 content without copying it when it is held in memory
+
+        :return: Bytes-like base64 content
+        """
+        if isinstance(self.__content__, Spool):
+            return self.__content__.getbuffer()
+        return self.__content__
 
     @property
     def author(self):
@@ -163,13 +282,74 @@ class File(object):
     def logs(self):
         return self.__logs__
 
+    def decoded_chunks(self):
+        """ Iterate over the decoded content, without loading it at once when it is spooled
+
+        :return: Iterator of bytes
+        """
+        if not self.spooled:
+            yield self.content
+            return
+        elif self.raw:
+            for chunk in self.__content__.chunks():
+                yield chunk
+            return
+        decoder = Base64Decoder()
+        for chunk in self.chunks():
+            yield decoder.decode(chunk)
+        decoder.finish()
+
     @property
     def sha(self):
-        return sha256(self.content).hexdigest()
+        if not self.__sha__:
+            hashed = sha256()
+            for chunk in self.decoded_chunks():
+                hashed.update(chunk)
+            self.__sha__ = hashed.hexdigest()
+        return self.__sha__
+
+    @property
+    def git_sha(self):
+        if not self.__git_sha__:
+            if self.spooled:
+                length = sum(len(chunk) for chunk in self.decoded_chunks())
+            else:
+                length = len(self.content)
+            hashed = sha1("blob {}\0".format(length).encode("ascii"))
+            for chunk in self.decoded_chunks():
+                hashed.update(chunk)
+            self.__git_sha__ = hashed.hexdigest()
+        return self.__git_sha__
 
     @property
     def base64(self):
-        return self.__content__
+        if isinstance(self.__content__, Spool):
+            return self.__content__.read()
+        return self.__content__.decode("utf-8")
+
+    def chunks(self, size=64 * 1024):
+        """ Iterate over the base64 encoded content without loading it at once when it is spooled
+
+        :param size: Size of the chunks
+        :return: Iterator of bytes-like objects
+        """
+        if self.raw:
+            # Raw content is encoded on the fly, by chunks whose size is a multiple of 3
+            size = size // 3 * 3
+            for chunk in self.__content__.chunks(size):
+                for start in range(0, len(chunk), size):
+                    yield base64.b64encode(chunk[start:start + size])
+        elif isinstance(self.__content__, Spool):
+            for chunk in self.__content__.chunks(size):
+                yield chunk
+        else:
+            yield self.__content__
+
+    def close(self):
+        """ Release the Spool holding the content, if any
+        """
+        if isinstance(self.__content__, Spool):
+            self.__content__.close()
 
     def dict(self):
         """ Builds a dictionary representation of the object (eg: for JSON)
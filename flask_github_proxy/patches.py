@@ -0,0 +1,136 @@
+import re
+
+
+class PatchError(ValueError):
+    """ Raised when a patch is malformed or does not apply to its base
+    """
+
+
+HUNK = re.compile(b"^@@ -(\\d+)(?:,(\\d+))? \\+(\\d+)(?:,(\\d+))? @@")
+
+
+def apply_unified(base, patch):
+    """ Apply a unified diff of a single file to its base content
+
+    Context and removed lines must match the base exactly. Headers (---, +++, diff, index...) are ignored.
+
+    :param base: Content the diff was made against
+    :type base: bytes
+    :param patch: Unified diff
+    :type patch: bytes
+    :return: Patched content
+    :rtype: bytes
+    :raises PatchError: If the diff is malformed or does not apply
+    """
+    source = base.splitlines(True)
+    lines = patch.splitlines(True)
+    result, position, index = [], 0, 0
+
+    while index < len(lines):
+        match = HUNK.match(lines[index])
+        index += 1
+        if not match:
+            continue
+        start = int(match.group(1))
+        length = int(match.group(2)) if match.group(2) is not None else 1
+        # An empty range starts after the given line, otherwise at it
+        start = start if length == 0 else start - 1
+        if start < position or start > len(source):
+            raise PatchError("Hunk at line {} is out of order or out of the file".format(start + 1))
+        result.extend(source[position:start])
+        position, last = start, None
+
+        while index < len(lines) and not lines[index].startswith(b"@@"):
+            line = lines[index]
+            index += 1
+            kind, text = line[:1], line[1:]
+            if kind == b"\\":
+                # "\ No newline at end of file" applies to the line before. Context lines come from the base as is
+                if last == b"+" and result[-1].endswith(b"\n"):
+                    result[-1] = result[-1][:-1]
+                continue
+            last = kind
+            if kind in (b" ", b"-"):
+                if position >= len(source) or source[position].rstrip(b"\r\n") != text.rstrip(b"\r\n"):
+                    raise PatchError("Patch does not apply at line {}".format(position + 1))
+                if kind == b" ":
+                    result.append(source[position])
+                position += 1
+            elif kind == b"+":
+                result.append(text)
+            elif line.strip() == b"":
+                # Some tools strip the leading space of empty context lines
+                if position >= len(source) or source[position].strip() != b"":
+                    raise PatchError("Patch does not apply at line {}".format(position + 1))
+                result.append(source[position])
+                position += 1
+            else:
+                break
+
+    result.extend(source[position:])
+    return b"".join(result)
+
+
+def apply_delta(base, delta):
+    """ Apply a git binary delta (as used in git packs) to its base content
+
+    :param base: Content the delta was made against
+    :type base: bytes
+    :param delta: Git delta
+    :type delta: bytes
+    :return: Patched content
+    :rtype: bytes
+    :raises PatchError: If the delta is malformed or does not apply
+    """
+    def varint(position):
+        value, shift = 0, 0
+        while True:
+            if position >= len(delta):
+                raise PatchError("Delta header is truncated")
+            byte = delta[position]
+            position += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, position
+
+    source_size, position = varint(0)
+    target_size, position = varint(position)
+    if source_size != len(base):
+        raise PatchError("Delta expects a base of {} bytes, not {}".format(source_size, len(base)))
+
+    result = bytearray()
+    while position < len(delta):
+        opcode = delta[position]
+        position += 1
+        if opcode & 0x80:
+            # Copy from the base : offset on up to 4 bytes, size on up to 3 bytes
+            offset, size = 0, 0
+            for shift in range(7):
+                if opcode & (1 << shift):
+                    if position >= len(delta):
+                        raise PatchError("Delta is truncated")
+                    if shift < 4:
+                        offset |= delta[position] << (8 * shift)
+                    else:
+                        size |= delta[position] << (8 * (shift - 4))
+                    position += 1
+            size = size or 0x10000
+            if offset + size > len(base):
+                raise PatchError("Delta copies out of its base")
+            result += base[offset:offset + size]
+        elif opcode:
+            # Insert the next opcode bytes
+            if position + opcode > len(delta):
+                raise PatchError("Delta is truncated")
+            result += delta[position:position + opcode]
+            position += opcode
+        else:
+            raise PatchError("Delta uses a reserved instruction")
+        # The target size is known upfront : a delta producing more is refused before it grows any further
+        if len(result) > target_size:
+            raise PatchError("Delta produces more than {} bytes".format(target_size))
+
+    if len(result) != target_size:
+        raise PatchError("Delta produced {} bytes instead of {}".format(len(result), target_size))
+    return bytes(result)
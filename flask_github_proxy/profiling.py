@@ -0,0 +1,92 @@
+from collections import Counter
+from threading import Thread, Lock, get_ident
+import os
+import sys
+import time
+
+
+def collapse(frame, label=None, labels=None):
+    """ Represent a stack as a line of the collapsed format (root first, frames separated by semicolons)
+
+    :param frame: Innermost frame of the stack
+    :param label: First element of the stack (eg: endpoint served by the thread)
+    :param labels: Cache of the names of the code objects
+    :type labels: dict
+    :return: Collapsed stack
+    """
+    labels = {} if labels is None else labels
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = labels.get(code)
+        if name is None:
+            name = labels[code] = "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+        names.append(name)
+        frame = frame.f_back
+    if label:
+        names.append(label)
+    return ";".join(reversed(names))
+
+
+class Sampler(object):
+    """ Sampling profiler : a timer thread records the stacks of the threads serving requests at a fixed interval
+
+    Sampling only reads the current frames of the threads, so that the overhead does not depend on the code \
+    being profiled. Only one profile runs at a time.
+
+    :param threads: Function returning the threads to sample, as a dict of their ident and their label
+    :param interval: Time (in seconds) between two samples
+
+    :ivar stacks: Number of samples of each collapsed stack of the last profile
+    :type stacks: collections.Counter
+    :ivar samples: Number of sampling rounds of the last profile
+    """
+    def __init__(self, threads, interval=0.005):
+        self.threads = threads
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.__lock__ = Lock()
+
+    def profile(self, duration, interval=None):
+        """ Sample the threads for duration seconds, waiting for the end of the profile
+
+        :param duration: Duration of the profile in seconds
+        :param interval: Time (in seconds) between two samples, if not the default one
+        :return: Number of samples of each collapsed stack, or None if a profile is already running
+        :rtype: collections.Counter
+        """
+        if not self.__lock__.acquire(blocking=False):
+            return None
+        try:
+            self.stacks, self.samples = Counter(), 0
+            thread = Thread(
+                target=self.__sample__, args=(duration, interval or self.interval, get_ident()), daemon=True
+            )
+            thread.start()
+            thread.join()
+            return self.stacks
+        finally:
+            self.__lock__.release()
+
+    def __sample__(self, duration, interval, caller):
+        labels = {}
+        own = {get_ident(), caller}
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            frames = sys._current_frames()
+            for ident, label in list(self.threads().items()):
+                frame = frames.get(ident)
+                if frame is not None and ident not in own:
+                    self.stacks[collapse(frame, label, labels)] += 1
+            self.samples += 1
+            time.sleep(interval)
+
+    @staticmethod
+    def collapsed(stacks):
+        """ Render stacks in the collapsed format read by flamegraph.pl or speedscope
+
+        :param stacks: Number of samples of each collapsed stack
+        :return: Text of the profile
+        """
+        return "".join("{} {}\n".format(stack, count) for stack, count in stacks.most_common())
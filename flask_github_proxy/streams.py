@@ -0,0 +1,342 @@
+import base64
+import binascii
+import json
+import zlib
+from hashlib import sha256
+from io import BytesIO
+from tempfile import TemporaryFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Bytes a base64 content can hold once its whitespaces are removed
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+
+def is_base64(data):
+    """ Check that data only holds characters of the base64 alphabet, so that it can go as is in a JSON string
+
+    :param data: Base64 data, without whitespaces
+    :type data: bytes
+    :return: Boolean
+    """
+    return not bytes(data).translate(None, BASE64_ALPHABET)
+
+
+class Base64Decoder(object):
+    """ Incremental base64 decoder : chunks can be cut anywhere, whitespaces are ignored
+    """
+    def __init__(self):
+        self.__rest__ = b""
+
+    def decode(self, chunk):
+        """ Decode a chunk of base64 data
+
+        :param chunk: Base64 encoded data
+        :type chunk: bytes
+        :return: Decoded data available so far
+        :rtype: bytes
+        """
+        chunk = self.__rest__ + b"".join(chunk.split())
+        cut = len(chunk) - len(chunk) % 4
+        self.__rest__ = chunk[cut:]
+        return base64.b64decode(chunk[:cut])
+
+    def finish(self):
+        """ Check that the data decoded so far ended on a complete group of four characters
+
+        :raises binascii.Error: If characters are left over
+        """
+        if self.__rest__:
+            raise binascii.Error("Base64 data is truncated : {} characters left over".format(len(self.__rest__)))
+
+
+class DecompressionError(Exception):
+    """ Raised when a compressed body is corrupted or decompresses past the allowed limits
+
+    :param code: HTTP Code Error
+    :param message: Message to display
+    """
+    def __init__(self, code, message):
+        super(DecompressionError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class HashingReader(object):
+    """ Readable stream hashing what is read through it
+
+    :param stream: Readable binary stream
+
+    :ivar hash: sha256 hash object fed with what was read
+    :ivar size: Number of bytes read
+    """
+    def __init__(self, stream):
+        self.__stream__ = stream
+        self.hash = sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.__stream__.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+
+class Decompressor(object):
+    """ Readable stream decompressing another one on the fly, according to a Content-Encoding
+
+    Supported encodings are gzip, deflate and, if the zstandard package is installed, zstd. The output of each read \
+    is bounded, so that a small compressed chunk never expands into memory at once.
+
+    :param stream: Readable binary stream of compressed data
+    :param encoding: Content-Encoding of the stream
+    :type encoding: str
+    :param max_size: Maximum size of the decompressed data
+    :type max_size: int
+    :param max_ratio: Maximum ratio between decompressed and compressed sizes, checked past 1MB of decompressed data
+    :type max_ratio: int
+    :param chunk_size: Size of the chunks read from the stream
+    :type chunk_size: int
+
+    :cvar ENCODINGS: Supported encodings
+    :ivar size: Size of the data decompressed so far
+    :ivar wire: Reader of the compressed stream, hashing it
+    :type wire: HashingReader
+    """
+    ENCODINGS = ("gzip", "x-gzip", "deflate") + (("zstd",) if zstandard else ())
+
+    def __init__(self, stream, encoding, max_size=None, max_ratio=None, chunk_size=64 * 1024):
+        if encoding not in self.ENCODINGS:
+            raise ValueError("Content-Encoding {} is not supported".format(encoding))
+        self.wire = HashingReader(stream)
+        self.__chunk_size__ = chunk_size
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.size = 0
+        self.__reader__ = None
+        self.__decompressor__ = None
+        if encoding == "zstd":
+            self.__reader__ = zstandard.ZstdDecompressor().stream_reader(self.wire, read_across_frames=True)
+        elif encoding == "deflate":
+            self.__decompressor__ = zlib.decompressobj()
+        else:
+            self.__decompressor__ = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def __decompress__(self, size):
+        """ Decompress at most size bytes
+
+        :param size: Maximum number of bytes to return
+        :return: Decompressed bytes, empty at the end of the stream
+        """
+        if self.__reader__ is not None:
+            return self.__reader__.read(size)
+        decompressor = self.__decompressor__
+        while True:
+            data = decompressor.unconsumed_tail
+            if not data and not decompressor.eof:
+                data = self.wire.read(self.__chunk_size__)
+                if not data:
+                    return decompressor.flush()
+            elif not data:
+                return b""
+            output = decompressor.decompress(data, size)
+            if output:
+                return output
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.__chunk_size__
+        try:
+            data = self.__decompress__(size)
+        except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as error:
+            raise DecompressionError(400, "Body could not be decompressed : {}".format(error))
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise DecompressionError(413, "Decompressed body is larger than {} bytes".format(self.max_size))
+        elif self.max_ratio and self.size > 1024 * 1024 and self.size > self.max_ratio * self.wire.size:
+            raise DecompressionError(413, "Body decompresses more than {} times its size".format(self.max_ratio))
+        return data
+
+
+class Spool(object):
+    """ Request body read by chunks into memory, then into a temporary file once it goes past a threshold
+
+    The body is hashed while it streams, so that it never needs to be read again to be checked. The base64 \
+    content is stored without its whitespaces (line breaks), so that it can go as is into a JSON document.
+
+    :param stream: Readable binary stream (eg: flask.request.stream)
+    :param threshold: Size (in bytes) from which the body is written to disk
+    :type threshold: int
+    :param chunk_size: Size of the chunks read from the stream
+    :type chunk_size: int
+    :param raw: Indicates that the body is the raw content, and not its base64 encoding
+    :type raw: bool
+
+    :ivar file: BytesIO or temporary file holding the base64 content, without whitespaces, or the raw content
+    :ivar size: Size of the content stored in file
+    :ivar hash: sha256 hash object fed with the body, as received
+    :ivar content_hash: sha256 hash object fed with the decoded content, None if the body is not valid base64
+    :ivar raw: Indicates that file holds the raw content
+    :ivar valid: Indicates that the body only holds base64 characters (and whitespaces) in complete groups of four, \
+    always True for a raw body. An invalid body must not be written to Github, as it would go unescaped into a JSON \
+    document
+    """
+    def __init__(self, stream, threshold=1024 * 1024, chunk_size=64 * 1024, raw=False):
+        self.file = BytesIO()
+        self.size = 0
+        self.raw = raw
+        self.hash = sha256()
+        self.content_hash = sha256()
+        self.valid = True
+        decoder = Base64Decoder()
+
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            self.hash.update(chunk)
+            if raw:
+                self.content_hash.update(chunk)
+            else:
+                chunk = b"".join(chunk.split())
+                if self.valid and not is_base64(chunk):
+                    self.valid, self.content_hash = False, None
+                if self.content_hash:
+                    try:
+                        self.content_hash.update(decoder.decode(chunk))
+                    except binascii.Error:
+                        self.content_hash = None
+            if not self.on_disk and self.size + len(chunk) > threshold:
+                rolled = TemporaryFile()
+                rolled.write(self.file.getbuffer())
+                self.file.close()
+                self.file = rolled
+            self.file.write(chunk)
+            self.size += len(chunk)
+        if not raw and self.valid:
+            try:
+                decoder.finish()
+            except binascii.Error:
+                self.valid, self.content_hash = False, None
+        self.file.seek(0)
+
+    @property
+    def on_disk(self):
+        return not isinstance(self.file, BytesIO)
+
+    def getbuffer(self):
+        """ Access the content held in memory without copying it
+
+        :return: View on the base64 content, or None if it is on disk
+        :rtype: memoryview
+        """
+        if not self.on_disk:
+            return self.file.getbuffer()
+
+    def chunks(self, size=64 * 1024):
+        """ Iterate over the content, without loading it at once when it is on disk
+
+        :param size: Size of the chunks read from disk
+        :return: Iterator of bytes-like objects
+        """
+        if not self.on_disk:
+            yield self.getbuffer()
+            return
+        self.file.seek(0)
+        for chunk in iter(lambda: self.file.read(size), b""):
+            yield chunk
+
+    def read(self):
+        """ Read the whole base64 content
+
+        :return: Base64 content
+        :rtype: str
+        """
+        self.file.seek(0)
+        if self.raw:
+            return base64.b64encode(self.file.read()).decode("ascii")
+        return self.file.read().decode("ascii")
+
+    def close(self):
+        try:
+            self.file.close()
+        except BufferError:
+            # A view on the memory buffer is still alive : the buffer is freed along with it
+            pass
+
+
+class JSONStream(object):
+    """ File-like JSON document streaming the (base64) content of a file as one of its values
+
+    It never holds more than one chunk of the content in memory. Its length is known beforehand, so that it can \
+    be sent with a Content-Length header.
+
+    :param document: Dictionary to serialize
+    :type document: dict
+    :param key: Key of the document whose value is the content of the file, or tuple of keys (and list indexes) \
+    leading to it in nested values
+    :param file: File whose content is streamed
+    :type file: flask_github_proxy.models.File
+    """
+    MARKER = "\u0000content\u0000"
+
+    def __init__(self, document, key, file):
+        path = key if isinstance(key, tuple) else (key,)
+        head, tail = json.dumps(self.__replace__(document, path)).split(json.dumps(self.MARKER))
+        self.__head__ = (head + "\"").encode("utf-8")
+        self.__tail__ = ("\"" + tail).encode("utf-8")
+        self.__length__ = len(self.__head__) + file.size + len(self.__tail__)
+        self.__chunks__ = self.__iterate__(file)
+        self.__buffer__ = b""
+        self.__offset__ = 0
+
+    @classmethod
+    def __replace__(cls, value, path):
+        """ Copy the containers leading to the content, with the content replaced by a marker
+
+        :param value: Document or nested value
+        :param path: Keys (or indexes) leading to the content
+        :return: Copy of value
+        """
+        if not path:
+            return cls.MARKER
+        copy = list(value) if isinstance(value, list) else dict(value)
+        copy[path[0]] = cls.__replace__(value[path[0]], path[1:])
+        return copy
+
+    def __iterate__(self, file):
+        yield self.__head__
+        for chunk in file.chunks():
+            yield chunk
+        yield self.__tail__
+
+    def __len__(self):
+        return self.__length__
+
+    def __iter__(self):
+        if self.__offset__ < len(self.__buffer__):
+            yield self.__buffer__[self.__offset__:]
+        self.__buffer__, self.__offset__ = b"", 0
+        for chunk in self.__chunks__:
+            yield chunk
+
+    def read(self, size=-1):
+        """ Read the document
+
+        :param size: Maximum number of bytes to read. Reads everything if negative or None
+        :return: Bytes of the document
+        """
+        if size is None or size < 0:
+            return b"".join(self)
+        parts = []
+        while size > 0:
+            if self.__offset__ >= len(self.__buffer__):
+                self.__buffer__, self.__offset__ = next(self.__chunks__, b""), 0
+                if not self.__buffer__:
+                    break
+            part = self.__buffer__[self.__offset__:self.__offset__ + size]
+            self.__offset__ += len(part)
+            size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
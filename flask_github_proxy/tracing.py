@@ -0,0 +1,194 @@
+from threading import Lock
+from flask import g, has_request_context
+import json
+import logging
+import os
+import re
+import time
+
+
+TRACEPARENT = re.compile("^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+TEMPLATES = [
+    (re.compile("^/repos/[^/]+/[^/]+"), "/repos/{owner}/{repo}"),
+    (re.compile("/contents/.*$"), "/contents/{path}"),
+    (re.compile("/refs/heads/.*$"), "/refs/heads/{branch}"),
+    (re.compile("/(commits|blobs|trees)/[0-9a-f]+$"), "/\\1/{sha}")
+]
+
+
+def url_template(url, api=""):
+    """ Turn the URL of a Github call into its template, so that calls of the same kind share a name
+
+    :param url: URL of the call
+    :param api: URL of the Github API, removed from the template
+    :return: Template (eg: /repos/{owner}/{repo}/contents/{path})
+    """
+    path = url.split("?")[0]
+    if api and path.startswith(api):
+        path = path[len(api):]
+    for pattern, replacement in TEMPLATES:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+class Span(object):
+    """ Timed operation of a trace
+
+    :param name: Name of the operation
+    :param trace_id: Identifier of the trace (32 hexadecimal characters). A new trace is started if None
+    :param parent_id: Identifier of the parent span (16 hexadecimal characters), if any
+    :param attributes: Attributes of the span
+    :type attributes: dict
+    :param tracer: Tracer exporting the span once it ends
+
+    :ivar span_id: Identifier of the span
+    :ivar start: Time (epoch) at which the span started
+    :ivar duration: Duration of the span in seconds, None until it ends
+    """
+    def __init__(self, name, trace_id=None, parent_id=None, attributes=None, tracer=None):
+        self.name = name
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.parent_id = parent_id
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.duration = None
+        self.__tracer__ = tracer
+        self.__start__ = time.perf_counter()
+
+    def set(self, key, value):
+        """ Set an attribute of the span
+
+        :param key: Name of the attribute
+        :param value: Value of the attribute
+        """
+        self.attributes[key] = value
+
+    def inc(self, key, amount=1):
+        """ Increment a counting attribute of the span
+
+        :param key: Name of the attribute
+        :param amount: Amount to add
+        """
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def child(self, name, **attributes):
+        """ Start a span whose parent is this one
+
+        :param name: Name of the operation
+        :param attributes: Attributes of the span
+        :return: Span
+        """
+        return Span(name, self.trace_id, self.span_id, attributes, tracer=self.__tracer__)
+
+    def end(self):
+        """ End the span and export it. A span only ends once
+        """
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.__start__
+            if self.__tracer__ is not None:
+                self.__tracer__.export(self)
+
+    @property
+    def traceparent(self):
+        """ W3C traceparent header identifying this span
+        """
+        return "00-{}-{}-01".format(self.trace_id, self.span_id)
+
+    def dict(self):
+        """ Builds a dictionary representation of the object (eg: for JSON)
+
+        :return: Dictionary representation of the object
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes
+        }
+
+
+class Tracer(object):
+    """ Starts the root span of requests and hands finished spans to an exporter
+
+    Without exporter, no span is created at all.
+
+    :param exporter: Object with an export(span) method receiving each finished Span
+    :param logger: Logger reporting failures of the exporter
+    """
+    def __init__(self, exporter=None, logger=None):
+        self.exporter = exporter
+        self.logger = logger or logging.getLogger(__name__)
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def start(self, name, traceparent=None, **attributes):
+        """ Start a root span, continuing the trace of the W3C traceparent header if it is valid
+
+        :param name: Name of the operation
+        :param traceparent: Value of the traceparent header of the incoming request
+        :param attributes: Attributes of the span
+        :return: Span
+        """
+        match = TRACEPARENT.match((traceparent or "").strip().lower())
+        if match and match.group(1) != "0" * 32 and match.group(2) != "0" * 16:
+            return Span(name, match.group(1), match.group(2), attributes, tracer=self)
+        return Span(name, attributes=attributes, tracer=self)
+
+    @staticmethod
+    def current():
+        """ Root span of the current request
+
+        :return: Span or None outside of a traced request
+        """
+        if has_request_context():
+            return g.get("github_proxy_span")
+
+    def export(self, span):
+        """ Hand a finished span to the exporter. Failures of the exporter never fail a request
+
+        :param span: Finished Span
+        """
+        try:
+            self.exporter.export(span)
+        except Exception as error:
+            self.logger.warning("Span could not be exported", extra={"reason": str(error)})
+
+
+class JSONLinesExporter(object):
+    """ Exports spans as JSON lines appended to a file
+
+    :param path: Path of the file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__lock__ = Lock()
+        self.__file__ = open(path, "a", buffering=1)
+
+    def export(self, span):
+        line = json.dumps(span.dict(), default=str) + "\n"
+        with self.__lock__:
+            self.__file__.write(line)
+
+    def close(self):
+        with self.__lock__:
+            self.__file__.close()
+
+
+class TraceFilter(logging.Filter):
+    """ Adds the trace_id and span_id of the current request to log records, so that logs can be linked to traces
+    """
+    def filter(self, record):
+        span = Tracer.current()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+
+TRACE_FILTER = TraceFilter()
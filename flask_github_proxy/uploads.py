@@ -0,0 +1,276 @@
+from hashlib import sha256
+from threading import Lock
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+
+class UploadTooLarge(ValueError):
+    """ Raised when a chunk would make its session larger than allowed
+    """
+
+
+class UploadStoreFull(ValueError):
+    """ Raised when the store holds as many sessions or bytes as allowed
+    """
+
+
+class UploadStore(object):
+    """ Stores chunked uploads on local disk until they are committed
+
+    Each upload session is a folder holding its metadata and one file per received chunk. Sessions which were not \
+    modified for more than ttl seconds are gone : UploadStore.path() does not return them anymore and \
+    UploadStore.sweep() removes them
+
+    :param directory: Folder where sessions are stored. Defaults to a private folder created in the temporary directory
+    :type directory: str
+    :param ttl: Time (in seconds) after which an idle session expires
+    :type ttl: int
+    :param chunk_size: Size of the blocks used to copy chunks
+    :type chunk_size: int
+    :param max_size: Maximum size (in bytes) of the chunks of a session altogether. None for no limit
+    :type max_size: int
+    :param max_sessions: Maximum number of live sessions. None for no limit
+    :type max_sessions: int
+    :param max_total_size: Maximum size (in bytes) of the chunks of all sessions altogether. None for no limit
+    :type max_total_size: int
+
+    :cvar ID: Regular expression of valid session identifiers
+    """
+    ID = re.compile("^[0-9a-f]{32}$")
+
+    def __init__(self, directory=None, ttl=86400, chunk_size=64 * 1024, max_size=None,
+                 max_sessions=None, max_total_size=None):
+        # Chunks are not authenticated until their session is committed : they are kept out of reach of other users
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="flask_github_proxy_uploads_")
+        else:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.directory = directory
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.max_sessions = max_sessions
+        self.max_total_size = max_total_size
+        self.__lock__ = Lock()
+
+    def path(self, upload_id):
+        """ Folder of a session
+
+        :param upload_id: Identifier of the session
+        :return: Path of the folder, or None if the session does not exist or expired
+        """
+        if not self.ID.match(upload_id):
+            return None
+        path = os.path.join(self.directory, upload_id)
+        try:
+            expired = os.path.getmtime(path) < time.time() - self.ttl
+        except OSError:
+            return None
+        if expired:
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        if os.path.isdir(path):
+            return path
+
+    def sessions(self):
+        """ List the sessions stored, expired ones included until they are swept
+
+        :return: Identifiers of the sessions
+        :rtype: list
+        """
+        return [name for name in os.listdir(self.directory) if self.ID.match(name)]
+
+    def size(self):
+        """ Size of the chunks of all sessions
+
+        :return: Size in bytes
+        :rtype: int
+        """
+        size = 0
+        for upload_id in self.sessions():
+            path = os.path.join(self.directory, upload_id)
+            for name in os.listdir(path):
+                if name.endswith(".chunk") or name.endswith(".part"):
+                    try:
+                        size += os.path.getsize(os.path.join(path, name))
+                    except OSError:
+                        # Removed in between by a sweep or a replaced chunk
+                        pass
+        return size
+
+    def open(self, metadata):
+        """ Open a new session
+
+        :param metadata: Information to keep along the chunks (eg: the parameters of the push)
+        :type metadata: dict
+        :return: Identifier of the session
+        :raises UploadStoreFull: If the store already holds UploadStore.max_sessions sessions or \
+        UploadStore.max_total_size bytes
+        """
+        self.sweep()
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, upload_id)
+        with self.__lock__:
+            if self.max_sessions is not None and len(self.sessions()) >= self.max_sessions:
+                raise UploadStoreFull("Upload store holds {} sessions already".format(self.max_sessions))
+            if self.max_total_size is not None and self.size() >= self.max_total_size:
+                raise UploadStoreFull("Upload store holds {} bytes already".format(self.max_total_size))
+            os.makedirs(path, mode=0o700)
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+        return upload_id
+
+    def metadata(self, upload_id):
+        """ Read the metadata of a session
+
+        :param upload_id: Identifier of the session
+        :return: Metadata or None if the session does not exist
+        """
+        path = self.path(upload_id)
+        if path:
+            with open(os.path.join(path, "metadata.json")) as f:
+                return json.load(f)
+
+    def write(self, upload_id, number, stream, sha=None):
+        """ Store a chunk, replacing any chunk previously received with the same number
+
+        :param upload_id: Identifier of the session
+        :param number: Number of the chunk
+        :type number: int
+        :param stream: Readable stream of the chunk
+        :param sha: Sha256 of the chunk. If given, the chunk is kept only if it matches
+        :return: Size of the chunk, or None if its sha does not match
+        :raises UploadTooLarge: If the chunk makes the session larger than UploadStore.max_size
+        :raises UploadStoreFull: If the chunk makes the store larger than UploadStore.max_total_size
+        """
+        path = self.path(upload_id)
+        target = os.path.join(path, "{}.chunk".format(number))
+        hashed, size = sha256(), 0
+        limit, error = None, None
+        replaced = self.chunks(upload_id).get(number, 0)
+        if self.max_size is not None:
+            limit = self.max_size - sum(self.chunks(upload_id).values()) + replaced
+            error = UploadTooLarge("Upload session is larger than {} bytes".format(self.max_size))
+        if self.max_total_size is not None:
+            left = self.max_total_size - self.size() + replaced
+            if limit is None or left < limit:
+                limit = left
+                error = UploadStoreFull("Upload store is larger than {} bytes".format(self.max_total_size))
+        # The chunk is written aside first, so that an interrupted chunk never replaces a complete one
+        with tempfile.NamedTemporaryFile(dir=path, suffix=".part", delete=False) as f:
+            for block in iter(lambda: stream.read(self.chunk_size), b""):
+                size += len(block)
+                if limit is not None and size > limit:
+                    break
+                hashed.update(block)
+                f.write(block)
+        if limit is not None and size > limit:
+            os.remove(f.name)
+            raise error
+        if sha is not None and sha.lower() != hashed.hexdigest():
+            os.remove(f.name)
+            return None
+        os.replace(f.name, target)
+        os.utime(path)
+        return size
+
+    def chunks(self, upload_id):
+        """ List the chunks received
+
+        :param upload_id: Identifier of the session
+        :return: Dictionary of chunk sizes where keys are chunk numbers
+        :rtype: dict
+        """
+        path = self.path(upload_id)
+        return {
+            int(name.split(".")[0]): os.path.getsize(os.path.join(path, name))
+            for name in os.listdir(path)
+            if name.endswith(".chunk")
+        }
+
+    @staticmethod
+    def ranges(numbers):
+        """ Group chunk numbers into ranges of consecutive numbers
+
+        :param numbers: Chunk numbers
+        :return: List of [first, last] numbers of each range
+        """
+        ranges = []
+        for number in sorted(numbers):
+            if ranges and ranges[-1][1] == number - 1:
+                ranges[-1][1] = number
+            else:
+                ranges.append([number, number])
+        return ranges
+
+    def reader(self, upload_id, count):
+        """ Open the chunks of a session as one stream
+
+        :param upload_id: Identifier of the session
+        :param count: Number of chunks, numbered from 0
+        :return: Readable stream
+        :rtype: ChunksReader
+        """
+        path = self.path(upload_id)
+        return ChunksReader([os.path.join(path, "{}.chunk".format(number)) for number in range(count)])
+
+    def delete(self, upload_id):
+        """ Remove a session and its chunks
+
+        :param upload_id: Identifier of the session
+        """
+        path = self.path(upload_id)
+        if path:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def sweep(self):
+        """ Remove the sessions which expired
+
+        :return: Number of sessions removed
+        """
+        removed = 0
+        limit = time.time() - self.ttl
+        with self.__lock__:
+            for name in self.sessions():
+                path = os.path.join(self.directory, name)
+                try:
+                    expired = os.path.getmtime(path) < limit
+                except OSError:
+                    # Removed in between when it was found expired by UploadStore.path()
+                    continue
+                if expired:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        return removed
+
+
+class ChunksReader(object):
+    """ Readable stream going through several files one after the other
+
+    :param paths: Paths of the files
+    :type paths: list
+    """
+    def __init__(self, paths):
+        self.__paths__ = list(paths)
+        self.__file__ = None
+
+    def read(self, size=-1):
+        while self.__paths__ or self.__file__:
+            if self.__file__ is None:
+                self.__file__ = open(self.__paths__.pop(0), "rb")
+            data = self.__file__.read(size)
+            if data:
+                return data
+            self.__file__.close()
+            self.__file__ = None
+        return b""
+
+    def close(self):
+        if self.__file__:
+            self.__file__.close()
+            self.__file__ = None
@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name='flask_github_proxy',
     version="0.0.2",
-    packages=find_packages(exclude=["examples", "tests"]),
+    packages=find_packages(exclude=["examples", "tests", "benchmarks"]),
     url='https://github.com/ponteineptique/flask-github-proxy',
     license='GNU GPL',
     author='Thibault Clerice',
@@ -18,6 +18,9 @@ setup(
         "python-slugify==1.2.1",
         "python-json-logger==0.1.5"
     ],
+    extras_require={
+        "zstd": ["zstandard"]
+    },
     include_package_data=True,
     zip_safe=False,
     classifiers=[
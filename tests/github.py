@@ -1,5 +1,6 @@
 from flask import Flask, jsonify, request
 import base64
+import hashlib
 import json
 from collections import defaultdict
 
@@ -14,9 +15,30 @@ def make_client(token, route_fail=None):
     github_api.pr_number = 9
     github_api.exist_file = defaultdict(lambda: False)
     github_api.calls = 0
+    github_api.conflicts = 0
+    github_api.pulls = []
+    github_api.closed = set()
+    github_api.trees = []
+    github_api.entries = {}
+    github_api.commits = []
+    github_api.uploads = []
+    github_api.blobs = {}
+    github_api.heads = {}
+    github_api.graphql = []
     if not route_fail:
         github_api.route_fail = {}
 
+    github_api.rate_limit = 5000
+
+    @github_api.after_request
+    def rate_limit(response):
+        github_api.rate_limit -= 1
+        response.headers["X-RateLimit-Limit"] = "5000"
+        response.headers["X-RateLimit-Remaining"] = str(github_api.rate_limit)
+        response.headers["X-RateLimit-Reset"] = "1466000000"
+        response.headers["X-RateLimit-Resource"] = "core"
+        return response
+
     def check_secret(response):
         if request.headers["Authorization"] != "token %s" % github_api.token:
             response = jsonify(
@@ -122,7 +144,7 @@ def make_client(token, route_fail=None):
                 return resp
 
         if owner == "ponteineptique":
-            sha = github_api.sha_origin
+            sha = github_api.heads.get(branch, github_api.sha_origin)
         else:
             sha = github_api.sha_fork
         return jsonify({
@@ -151,12 +173,23 @@ def make_client(token, route_fail=None):
 
     @github_api.route("/repos/<owner>/<repo>/contents/<path:file>", methods=["PUT"])
     def update_file(owner, repo, file):
+        github_api.uploads.append(json.loads(request.data.decode("utf-8")))
         if request.url.split("?")[0] in github_api.route_fail.keys():
             resp = jsonify({
                 "message": "Not Found",
                 "documentation_url": "https://developer.github.com/v3"
             })
             resp.status_code = 404
+        elif github_api.conflicts > 0 and github_api.exist_file[file] is True:
+            # Simulates a stale blob sha : someone else wrote the file in between
+            github_api.conflicts -= 1
+            resp = jsonify({
+                "message": "{file} does not match {sha}".format(
+                    file=file, sha=json.loads(request.data.decode("utf-8"))["sha"]
+                ),
+                "documentation_url": "https://developer.github.com/v3"
+            })
+            resp.status_code = 409
         elif github_api.exist_file[file] is True:
             data = json.loads(request.data.decode("utf-8"))
             resp = {
@@ -228,7 +261,7 @@ def make_client(token, route_fail=None):
                     )
                 }
             }
-            resp = jsonify(data)
+            resp = jsonify(resp)
             resp.status_code = 200
         else:
             data = json.loads(request.data.decode("utf-8"))
@@ -353,6 +386,34 @@ def make_client(token, route_fail=None):
         }
         return check_secret(jsonify(model))
 
+    @github_api.route("/repos/<owner>/<repo>/pulls", methods=["GET"])
+    def list_pr(owner, repo):
+        page, per_page = int(request.args.get("page", 1)), int(request.args.get("per_page", 30))
+        pulls = [
+            pull for pull in github_api.pulls
+            if pull["base"]["ref"] == request.args.get("base", pull["base"]["ref"])
+        ]
+        resp = jsonify(pulls[(page - 1) * per_page:page * per_page])
+        if page * per_page < len(pulls):
+            resp.headers["Link"] = '<{url}?state=open&per_page={per_page}&page={page}>; rel="next"'.format(
+                url=request.base_url, per_page=per_page, page=page + 1
+            )
+        return resp
+
+    @github_api.route("/repos/<owner>/<repo>/pulls/<int:number>", methods=["GET"])
+    def get_pr(owner, repo, number):
+        known = [pull for pull in github_api.pulls if pull["number"] == number]
+        if not known and number != github_api.pr_number:
+            resp = jsonify({"message": "Not Found", "documentation_url": "https://developer.github.com/v3"})
+            resp.status_code = 404
+            return resp
+        pull = dict(known[0]) if known else {
+            "number": number,
+            "html_url": "https://github.com/{owner}/{repo}/pull/{nb}".format(owner=owner, repo=repo, nb=number)
+        }
+        pull["state"] = "closed" if number in github_api.closed else "open"
+        return jsonify(pull)
+
     @github_api.route("/repos/<owner>/<repo>/pulls", methods=["POST"])
     def make_pr(owner, repo):
         pr_number = github_api.pr_number
@@ -365,6 +426,14 @@ def make_client(token, route_fail=None):
             resp.status_code = 404
             return resp
         data = json.loads(request.data.decode("utf-8"))
+        if data["head"] in [pull["head"]["label"] for pull in github_api.pulls]:
+            resp = jsonify({
+                "message": "Validation Failed",
+                "errors": [{"message": "A pull request already exists for {}.".format(data["head"])}],
+                "documentation_url": "https://developer.github.com/v3"
+            })
+            resp.status_code = 422
+            return resp
         reply = jsonify({
           "id": 1,
           "url": "https://api.github.com/repos/{owner}/{repo}/pulls/{nb}".format(
@@ -379,6 +448,100 @@ def make_client(token, route_fail=None):
         reply.status_code = 201
         return reply
 
+    @github_api.route("/repos/<owner>/<repo>/git/commits/<sha>", methods=["GET"])
+    def get_commit(owner, repo, sha):
+        return jsonify({
+            "sha": sha,
+            "tree": {
+                "sha": "691272480426f78a0138979dd3ce63b77f706feb",
+                "url": "https://api.github.com/repos/{owner}/{repo}/git/trees/691272480426f78a0138979dd3ce63b77f706feb".format(
+                    owner=owner, repo=repo
+                )
+            },
+            "parents": []
+        })
+
+    @github_api.route("/repos/<owner>/<repo>/git/blobs/<sha>", methods=["GET"])
+    def get_blob(owner, repo, sha):
+        if sha not in github_api.blobs:
+            resp = jsonify({
+                "message": "Not Found",
+                "documentation_url": "https://developer.github.com/v3"
+            })
+            resp.status_code = 404
+            return resp
+        return jsonify({
+            "sha": sha,
+            "size": len(github_api.blobs[sha]),
+            "encoding": "base64",
+            "content": base64.encodebytes(github_api.blobs[sha]).decode("utf-8")
+        })
+
+    @github_api.route("/graphql", methods=["POST"])
+    def graphql():
+        data = json.loads(request.data.decode("utf-8"))
+        if "createCommitOnBranch" not in data["query"]:
+            return jsonify({"errors": [{"message": "Unknown query"}]})
+        mutation = data["variables"]["input"]
+        branch = mutation["branch"]["branchName"]
+        head = github_api.heads.get(branch, github_api.sha_origin)
+        if mutation["branch"]["repositoryNameWithOwner"] != "ponteineptique/dummy":
+            return jsonify({"data": None, "errors": [{
+                "type": "NOT_FOUND", "message": "Could not resolve to a Repository"
+            }]})
+        elif mutation["expectedHeadOid"] != head:
+            return jsonify({"data": None, "errors": [{
+                "type": "STALE_DATA",
+                "message": "Expected branch to point to \"{}\" but it did not.".format(mutation["expectedHeadOid"])
+            }]})
+        github_api.graphql.append(mutation)
+        content = base64.b64decode(mutation["fileChanges"]["additions"][0]["contents"])
+        blob = hashlib.sha1("blob {}\0".format(len(content)).encode("ascii") + content).hexdigest()
+        github_api.heads[branch] = hashlib.sha1((head + blob).encode("ascii")).hexdigest()
+        return jsonify({"data": {"createCommitOnBranch": {"commit": {
+            "oid": github_api.heads[branch], "file": {"oid": blob}
+        }}}})
+
+    @github_api.route("/repos/<owner>/<repo>/git/blobs", methods=["POST"])
+    def make_blob(owner, repo):
+        content = base64.b64decode(json.loads(request.data.decode("utf-8"))["content"])
+        sha = hashlib.sha1("blob {}\0".format(len(content)).encode("ascii") + content).hexdigest()
+        github_api.blobs[sha] = content
+        resp = jsonify({
+            "sha": sha,
+            "url": "https://api.github.com/repos/{owner}/{repo}/git/blobs/{sha}".format(owner=owner, repo=repo, sha=sha)
+        })
+        resp.status_code = 201
+        return resp
+
+    @github_api.route("/repos/<owner>/<repo>/git/trees", methods=["POST"])
+    def make_tree(owner, repo):
+        data = json.loads(request.data.decode("utf-8"))
+        github_api.trees.append(data)
+        sha = "cd8274d15fa3ae2ab983129fb037999f264ba9a7"
+        if all(github_api.entries.get(entry["path"]) == entry["sha"] for entry in data["tree"]):
+            # The base tree already holds these entries : Github gives it back
+            sha = data["base_tree"]
+        resp = jsonify({
+            "sha": sha,
+            "tree": data["tree"]
+        })
+        resp.status_code = 201
+        return resp
+
+    @github_api.route("/repos/<owner>/<repo>/git/commits", methods=["POST"])
+    def make_commit(owner, repo):
+        data = json.loads(request.data.decode("utf-8"))
+        github_api.commits.append(data)
+        resp = jsonify({
+            "sha": "7638417db6d59f3c431d3e1f261cc637155684cd",
+            "tree": {"sha": data["tree"]},
+            "message": data["message"],
+            "parents": [{"sha": sha} for sha in data["parents"]]
+        })
+        resp.status_code = 201
+        return resp
+
     @github_api.route("/repos/<owner>/<repo>/git/refs/heads/<branch>", methods=["PATCH"])
     def patch_ref(owner, repo, branch):
         r = request.url.split("?")[0]
@@ -0,0 +1,65 @@
+from unittest import TestCase
+from flask_github_proxy.archives import ArchiveError, ArchiveTooLarge, entry_path, open_archive
+import io
+import tarfile
+import zipfile
+
+
+class TestArchives(TestCase):
+    """ Test the reading of archives
+    """
+    def test_entry_path(self):
+        """ Test that paths are normalized and kept inside their prefix
+        """
+        self.assertEqual(entry_path("", "a/./b.xml"), "a/b.xml")
+        self.assertEqual(entry_path("/data/", "a\\b.xml"), "data/a/b.xml")
+        self.assertEqual(entry_path("data", "a/../b.xml"), "data/b.xml")
+        for name in ("../b.xml", "a/../../b.xml", "/etc/passwd", "."):
+            self.assertIsNone(entry_path("data", name))
+
+    def test_executable_and_corrupted(self):
+        """ Test that the executable bit is read and that corrupted archives raise ArchiveError
+        """
+        body = io.BytesIO()
+        with tarfile.open(fileobj=body, mode="w") as archive:
+            info = tarfile.TarInfo("run.sh")
+            info.size, info.mode = 2048, 0o755
+            archive.addfile(info, io.BytesIO(b"#" * 2048))
+        entries = list((name, executable) for name, executable, _ in open_archive(io.BytesIO(body.getvalue())))
+        self.assertEqual(entries, [("run.sh", True)])
+
+        with self.assertRaises(ArchiveError):
+            for name, executable, stream in open_archive(io.BytesIO(body.getvalue()[:1024])):
+                stream.read()
+        with self.assertRaises(ArchiveError):
+            open_archive(io.BytesIO(b"Not an archive"))
+
+    def test_limits(self):
+        """ Test that entries are stopped while they are read, once they go past the size or the ratio allowed
+        """
+        body = io.BytesIO()
+        with tarfile.open(fileobj=body, mode="w:gz") as archive:
+            for name in ("a.xml", "b.xml"):
+                info = tarfile.TarInfo(name)
+                info.size = 2 * 1024 * 1024
+                archive.addfile(info, io.BytesIO(b"\x00" * info.size))
+
+        read = []
+        with self.assertRaises(ArchiveTooLarge):
+            for name, _, stream in open_archive(io.BytesIO(body.getvalue()), max_size=3 * 1024 * 1024):
+                read.append(len(b"".join(iter(lambda: stream.read(64 * 1024), b""))))
+        self.assertEqual(read, [2 * 1024 * 1024], "Second entry should be stopped before it is extracted")
+
+        with self.assertRaises(ArchiveTooLarge):
+            for name, _, stream in open_archive(io.BytesIO(body.getvalue()), max_ratio=100):
+                b"".join(iter(lambda: stream.read(64 * 1024), b""))
+
+    def test_encrypted(self):
+        """ Test that encrypted zip entries raise ArchiveError
+        """
+        body = io.BytesIO()
+        with zipfile.ZipFile(body, "w") as archive:
+            archive.writestr("a.xml", b"Some content")
+            archive.infolist()[0].flag_bits |= 0x1
+        with self.assertRaises(ArchiveError):
+            list(open_archive(io.BytesIO(body.getvalue())))
@@ -0,0 +1,26 @@
+from unittest import TestCase
+from flask_github_proxy.cache import TTLCache
+
+
+class TestTTLCache(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=lambda: self.now)
+
+    def test_expiry(self):
+        self.cache.set("a", 1)
+        self.now = 5
+        self.assertEqual(self.cache.get("a"), 1, "Item should still be alive")
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"), "Item should have expired")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_bounded(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.set("a", 3)
+        self.cache.set("c", 4)
+        self.assertNotIn("b", self.cache, "Oldest item should be dropped")
+        self.assertEqual((self.cache.get("a"), self.cache.get("c")), (3, 4))
+        self.assertEqual(self.cache.pop("a"), 3)
+        self.assertEqual(len(self.cache), 1)
@@ -2,14 +2,24 @@
 This file is intended to test integration. It offers a replicate of Github API for the commands we cover.
 """
 from flask_github_proxy import GithubProxy
+from flask_github_proxy.models import File, ProxyError
+from flask_github_proxy.metrics import Budget, BudgetExceeded
 from unittest import TestCase
-from flask import Flask
+from flask import Flask, Response
 import mock
 from hashlib import sha256
 from tests.github import make_client
 import base64
+import gzip
+import hmac
+import io
+import tarfile
+import zipfile
 import json
+import time
+import tracemalloc
 import logging
+from threading import Event, Thread
 
 
 def make_secret(data, secret):
@@ -412,10 +422,49 @@ class TestIntegration(TestCase):
         )
         self.assertEqual(http, 404, "Status code should be carried by ProxyError")
 
+    @mock.patch('logging.Logger.error')
+    def test_fail_compact_context(self, logger):
+        """ Test that errors keep and log a compact context, while the debug hook receives the full one
+        """
+        contexts = []
+        self.proxy.ProxyError.DEBUG_HOOK = lambda error, context: contexts.append(context)
+        self.assertIsNone(ProxyError.DEBUG_HOOK, "The hook should only be set for this proxy")
+        self.github_api.exist_file["path/to/some/file.xml"] = False
+        self.github_api.route_fail[
+            "http://localhost/repos/ponteineptique/dummy/contents/path/to/some/file.xml"
+        ] = 500
+        raw = b'Some content' * 1024
+        content = base64.encodebytes(raw)
+        result = self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        self.assertEqual(result.status_code, 404)
+
+        self.assertIs(contexts[-1]["params"]["content"].__class__, File)
+        context = logger.call_args[1]["extra"]["context"]
+        self.assertEqual(context["params"]["content"], {
+            "file": "path/to/some/file.xml",
+            "length": len(base64.b64encode(raw)),
+            "sha256": sha256(raw).hexdigest()
+        })
+        self.assertEqual(context["params"]["branch"], "uuid-1234")
+
+        other = GithubProxy(
+            "/other", "ponteineptique/dummy", "perseusDL/dummy", token="client-id", secret=self.secret,
+            error_context_size=64
+        )
+        error = other.ProxyError(
+            500, "x" * 2048, step="put", context={"token": "client-id", "uri": "/repos", "params": {"a": "b" * 512}}
+        )
+        self.assertEqual(len(error.message), error.MAX_MESSAGE + 3)
+        self.assertEqual(error.context, {"truncated": mock.ANY, "keys": ["params", "uri"]})
+        self.assertEqual(len(contexts), 1, "The debug hook of a proxy should not be called for the others")
+        self.assertEqual(self.proxy.ProxyError.MAX_CONTEXT, 4096, "Settings should stay with their proxy")
+
     @mock.patch('logging.Logger.debug')
     def test_fail_update_file(self, logger):
         """ Test when update the file fails
         """
+        self.addCleanup(self.proxy.logger.setLevel, self.proxy.logger.level)
+        self.proxy.logger.setLevel(logging.DEBUG)
         self.github_api.sha_origin = "789456"
         self.github_api.exist_file["path/to/some/file.xml"] = True
         self.github_api.route_fail[
@@ -617,4 +666,954 @@ class TestIntegration(TestCase):
             json.loads(self.calls["POST::/repos/ponteineptique/dummy/git/refs"]["data"]),
             {"ref": "refs/heads/users-laurimarjamaki", "sha": "123456"},
             "Assert we create for the branch users-laurimarjamaki"
-        )
\ No newline at end of file
+        )
+
+    def test_update_conflict_retry(self):
+        """ Test that a 409 on update refreshes the blob and replays the update
+        """
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.conflicts = 2
+        result = self.makeRequest(
+            base64.encodebytes(b'Some content'),
+            make_secret(base64.encodebytes(b'Some content').decode("utf-8"), self.secret),
+            {
+                "author_name": "ponteineptique",
+                "date": "19/06/2016",
+                "logs": "Hard work of transcribing file",
+                "branch": "uuid-1234"
+            }
+        )
+        data, http = response_read(result)
+        self.assertEqual(http, 201, "Conflicts should be recovered")
+        self.assertEqual(data["pr_url"], "https://github.com/perseusDL/dummy/pull/9")
+        self.assertEqual(
+            (self.proxy.counters["conflicts"], self.proxy.counters["conflict_retries"]), (2, 2),
+            "Conflicts and retries should be counted"
+        )
+
+    def test_update_conflict_exhausted(self):
+        """ Test that conflicts stop being retried after GithubProxy.conflict_retries attempts
+        """
+        self.proxy.conflict_retries = 1
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.conflicts = 5
+        result = self.makeRequest(
+            base64.encodebytes(b'Some content'),
+            make_secret(base64.encodebytes(b'Some content').decode("utf-8"), self.secret),
+            {
+                "author_name": "ponteineptique",
+                "date": "19/06/2016",
+                "logs": "Hard work of transcribing file",
+                "branch": "uuid-1234"
+            }
+        )
+        data, http = response_read(result)
+        self.assertEqual(http, 409, "Status code should be carried by ProxyError")
+        self.assertEqual(data["step"], "update")
+        self.assertEqual(self.github_api.conflicts, 3, "Only two PUT should have been made")
+        self.assertEqual(
+            (self.proxy.counters["conflicts"], self.proxy.counters["conflict_retries"]), (2, 1),
+            "Conflicts and retries should be counted"
+        )
+
+    def test_resume_after_pull_request_failure(self):
+        """ Test that a retry after a failed pull request resumes at the pull request step
+        """
+        self.github_api.route_fail[
+            "http://localhost/repos/perseusDL/dummy/pulls"
+        ] = 500
+        query = {
+            "author_name": "ponteineptique",
+            "date": "19/06/2016",
+            "logs": "Hard work of transcribing file",
+            "branch": "uuid-1234"
+        }
+        content = base64.encodebytes(b'Some content')
+        secure_sha = make_secret(content.decode("utf-8"), self.secret)
+        data, http = response_read(self.makeRequest(content, secure_sha, query))
+        self.assertEqual(http, 404, "Pull request should have failed")
+
+        self.calls.clear()
+        self.github_api.route_fail = {}
+        data, http = response_read(self.makeRequest(content, secure_sha, query))
+        self.assertEqual(http, 201, "Retry should succeed")
+        self.assertEqual(
+            sorted(self.calls.keys()), ["POST::/repos/perseusDL/dummy/pulls"],
+            "Only the pull request should have been retried"
+        )
+        self.assertEqual(self.proxy.counters["resumed"], 1)
+        self.assertEqual(len(self.proxy.checkpoints), 0, "Successful workflow should drop its checkpoint")
+
+    def test_idempotency_key(self):
+        """ Test that requests sharing an Idempotency-Key run the workflow once
+        """
+        content = base64.encodebytes(b'Some content')
+        url = "/perseids/push/path/to/some/file.xml?branch=uuid-1234"
+        headers = {
+            "fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret),
+            "Idempotency-Key": "an-id"
+        }
+        first, http = response_read(self.client.post(url, data=content, headers=headers))
+        self.assertEqual(http, 201)
+        self.calls.clear()
+        second, http = response_read(self.client.post(url, data=content, headers=headers))
+        self.assertEqual(http, 201)
+        self.assertEqual(first, second, "Duplicate should receive the original result")
+        self.assertEqual(self.calls, {}, "Duplicate should not call Github")
+        self.assertEqual(self.proxy.counters["idempotent_replays"], 1)
+
+        headers["Idempotency-Key"] = "another-id"
+        response_read(self.client.post(url, data=content, headers=headers))
+        self.assertIn(
+            "PUT::/repos/ponteineptique/dummy/contents/path/to/some/file.xml", self.calls,
+            "A new key should run the workflow"
+        )
+
+    def test_idempotency_from_hash(self):
+        """ Test that keys derived from the signature tell apart the same content sent to different branches
+        """
+        self.proxy.idempotency_from_hash = True
+        content = base64.encodebytes(b'Some content')
+        secure = make_secret(content.decode("utf-8"), self.secret)
+        for branch in ("a", "b", "a"):
+            data, http = response_read(self.makeRequest(content, secure, {"branch": branch}))
+            self.assertEqual(http, 201, "The same content on another branch is another request")
+        self.assertEqual(self.proxy.counters["idempotency_key_reused"], 0)
+        self.assertEqual(self.proxy.counters["idempotent_replays"], 1, "Only the duplicate should be replayed")
+
+    def test_not_base64(self):
+        """ Test that a signed body out of the base64 alphabet is refused instead of being spliced in a Github request
+        """
+        content = b'QUJD","branch":"master'
+        result = self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        data, http = response_read(result)
+        self.assertEqual(http, 400)
+        self.assertEqual(data["step"], "receive")
+        self.assertNotIn("PUT::/repos/ponteineptique/dummy/contents/path/to/some/file.xml", self.calls)
+
+    def test_idempotency_key_reused(self):
+        """ Test that a key reused with a different payload is refused instead of replaying the former result
+        """
+        url = "/perseids/push/path/to/some/file.xml?branch=uuid-1234"
+        for content, status in ((b'Some content', 201), (b'Other content', 422), (b'Some content', 201)):
+            content = base64.encodebytes(content)
+            headers = {"fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret), "Idempotency-Key": "an-id"}
+            data, http = response_read(self.client.post(url, data=content, headers=headers))
+            self.assertEqual(http, status)
+        self.assertEqual(data["pr_url"], "https://github.com/perseusDL/dummy/pull/9")
+        self.assertEqual(self.proxy.counters["idempotency_key_reused"], 1)
+        self.assertEqual(self.proxy.counters["idempotent_replays"], 1)
+
+        started, release = Event(), Event()
+
+        def workflow():
+            started.set()
+            release.wait(5)
+            return "https://github.com/perseusDL/dummy/pull/9"
+
+        original = Thread(target=self.proxy.idempotent, args=("key", workflow), kwargs={"fingerprint": "a"})
+        original.start()
+        started.wait(5)
+        error = self.proxy.idempotent("key", workflow, fingerprint="b")
+        release.set()
+        original.join(5)
+        self.assertEqual(error.code, 422, "A running key should not be waited for with another payload")
+
+    def test_idempotency_in_flight(self):
+        """ Test that a duplicate arriving while the original runs waits for it
+        """
+        started, release, runs, results = Event(), Event(), [], []
+
+        def workflow():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return "https://github.com/perseusDL/dummy/pull/9"
+
+        original = Thread(target=lambda: results.append(self.proxy.idempotent("key", workflow)))
+        original.start()
+        started.wait(5)
+        duplicate = Thread(target=lambda: results.append(self.proxy.idempotent("key", workflow)))
+        duplicate.start()
+        release.set()
+        original.join(5)
+        duplicate.join(5)
+        self.assertEqual(len(runs), 1, "Workflow should run only once")
+        self.assertEqual(results, ["https://github.com/perseusDL/dummy/pull/9"] * 2)
+
+    def make_pull(self, number, branch, owner="ponteineptique"):
+        return {
+            "number": number,
+            "html_url": "https://github.com/perseusDL/dummy/pull/{}".format(number),
+            "head": {"label": "{}:{}".format(owner, branch), "ref": branch},
+            "base": {"label": "perseusDL:master", "ref": "master"}
+        }
+
+    def test_reuse_open_pull_request(self):
+        """ Test that a branch with an open pull request reuses it, the index being seeded through pagination
+        """
+        self.github_api.pulls = [self.make_pull(number, "branch-{}".format(number)) for number in range(150)]
+        self.github_api.pulls.append(self.make_pull(200, "uuid-1234"))
+        result = self.makeRequest(
+            base64.encodebytes(b'Some content'),
+            make_secret(base64.encodebytes(b'Some content').decode("utf-8"), self.secret),
+            {
+                "author_name": "ponteineptique",
+                "logs": "Hard work of transcribing file",
+                "branch": "uuid-1234"
+            }
+        )
+        data, http = response_read(result)
+        self.assertEqual(http, 201)
+        self.assertEqual(data["pr_url"], "https://github.com/perseusDL/dummy/pull/200")
+        self.assertNotIn("POST::/repos/perseusDL/dummy/pulls", self.calls, "No pull request should be made")
+        self.assertEqual(len(self.proxy.open_pulls), 151, "Every page should have been read")
+
+    def test_pull_request_index_kept_current(self):
+        """ Test that pull requests opened by the proxy or found after a 422 feed the index
+        """
+        self.proxy.open_pull_request("ponteineptique:seed")
+        self.assertEqual(self.proxy.pull_request(self.make_file("uuid-1234")), "https://github.com/perseusDL/dummy/pull/9")
+        self.calls.clear()
+        self.assertEqual(self.proxy.pull_request(self.make_file("uuid-1234")), "https://github.com/perseusDL/dummy/pull/9")
+        self.assertEqual(
+            list(self.calls), ["GET::/repos/perseusDL/dummy/pulls/9"],
+            "Opened pull request should be reused once checked to be open"
+        )
+
+        # Merged since : the index entry is dropped and a new pull request is opened
+        self.github_api.closed.add(9)
+        self.github_api.pr_number = 10
+        self.calls.clear()
+        self.assertEqual(self.proxy.pull_request(self.make_file("uuid-1234")), "https://github.com/perseusDL/dummy/pull/10")
+        self.assertIn("POST::/repos/perseusDL/dummy/pulls", self.calls)
+        self.assertEqual(self.proxy.open_pulls["ponteineptique:uuid-1234"], "https://github.com/perseusDL/dummy/pull/10")
+        self.assertEqual(self.proxy.counters["pull_request_closed"], 1)
+
+        # A pull request opened by someone else since the index was seeded
+        self.github_api.pulls.append(self.make_pull(12, "uuid-5678"))
+        self.assertEqual(
+            self.proxy.pull_request(self.make_file("uuid-5678")), "https://github.com/perseusDL/dummy/pull/12",
+            "A 422 should lead to the existing pull request"
+        )
+        self.assertIn("GET::/repos/perseusDL/dummy/pulls", self.calls, "Index should be seeded again")
+
+    def test_pull_request_index_seeded_unlocked(self):
+        """ Test that seeding the index again does not block the requests using it
+        """
+        self.proxy.open_pulls = {"ponteineptique:uuid-1234": "https://github.com/perseusDL/dummy/pull/9"}
+        self.proxy.pulls_index_ttl = 0
+        started, release = Event(), Event()
+
+        def list_pull_requests():
+            started.set()
+            release.wait(5)
+            return {}
+
+        with mock.patch.object(self.proxy, "list_pull_requests", list_pull_requests):
+            seeding = Thread(target=self.proxy.open_pull_request, args=("ponteineptique:other",))
+            seeding.start()
+            started.wait(5)
+            self.assertEqual(
+                self.proxy.open_pull_request("ponteineptique:uuid-1234"), "https://github.com/perseusDL/dummy/pull/9",
+                "The former index should be used while it is seeded"
+            )
+            release.set()
+            seeding.join(5)
+        self.assertEqual(self.proxy.open_pulls, {})
+
+    def test_pull_request_index_seed_failure(self):
+        """ Test that a listing interrupted by the budget does not leave an empty index counting as fresh
+        """
+        with mock.patch.object(self.proxy, "list_pull_requests", side_effect=BudgetExceeded(Budget(1))):
+            with self.assertRaises(BudgetExceeded):
+                self.proxy.open_pull_request("ponteineptique:uuid-1234")
+        self.assertIsNone(self.proxy.__pulls_seeded__, "The index should not count as seeded")
+        pulls = {"ponteineptique:uuid-1234": "https://github.com/perseusDL/dummy/pull/9"}
+        with mock.patch.object(self.proxy, "list_pull_requests", return_value=pulls):
+            self.assertEqual(
+                self.proxy.open_pull_request("ponteineptique:uuid-1234"), "https://github.com/perseusDL/dummy/pull/9",
+                "The next request should seed the index"
+            )
+
+    def make_file(self, branch):
+        file = File("path/to/some/file.xml", "U29tZSBjb250ZW50\n", GithubProxy.DEFAULT_AUTHOR, "19/06/2016", "Logs")
+        file.branch = branch
+        return file
+
+    def test_blob_reuse(self):
+        """ Test that a content already pushed is committed from its blob on another path and branch
+        """
+        self.proxy.blob_reuse_min_size = 0
+        content = base64.encodebytes(b'Some content')
+        secure_sha = make_secret(content.decode("utf-8"), self.secret)
+        self.makeRequest(content, secure_sha, {"branch": "uuid-1234"})
+        self.calls.clear()
+        result = self.client.post(
+            "/perseids/push/edition/file.xml?branch=uuid-5678",
+            data=content,
+            headers={"fproxy-secure-hash": secure_sha}
+        )
+        data, http = response_read(result)
+        self.assertEqual(http, 201, "Workflow should succeed")
+        self.assertNotIn(
+            "PUT::/repos/ponteineptique/dummy/contents/edition/file.xml", self.calls,
+            "Content should not be uploaded again"
+        )
+        self.assertEqual(
+            self.github_api.trees[0]["tree"],
+            [{"path": "edition/file.xml", "mode": "100644", "type": "blob", "sha": "95b966ae1c166bd92f8ae7d1c313e738c731dfc3"}],
+            "The tree should be built from the known blob"
+        )
+        self.assertEqual(self.github_api.commits[0]["parents"], ["123456"], "The commit should follow the branch head")
+        self.assertEqual(
+            json.loads(self.calls["PATCH::/repos/ponteineptique/dummy/git/refs/heads/uuid-5678"]["data"]),
+            {"sha": "7638417db6d59f3c431d3e1f261cc637155684cd", "force": False},
+            "The branch should be moved to the new commit"
+        )
+        self.assertEqual(self.proxy.counters["blob_reused"], 1)
+
+    def test_blob_reuse_calls(self):
+        """ Test that reusing a blob costs five calls and commits nothing when the path already holds the blob
+        """
+        self.proxy.blob_reuse_min_size = 0
+        content = base64.encodebytes(b'Some content')
+        secure_sha = make_secret(content.decode("utf-8"), self.secret)
+        self.makeRequest(content, secure_sha, {"branch": "uuid-1234"})
+        git_data = [
+            ("GET", "/repos/ponteineptique/dummy/git/refs/heads/uuid-5678"),
+            ("GET", "/repos/ponteineptique/dummy/git/commits/123456"),
+            ("POST", "/repos/ponteineptique/dummy/git/trees"),
+            ("POST", "/repos/ponteineptique/dummy/git/commits"),
+            ("PATCH", "/repos/ponteineptique/dummy/git/refs/heads/uuid-5678")
+        ]
+        for held, expected in ((False, git_data), (True, git_data[:3])):
+            if held:
+                # The path now holds the blob on the head of the branch
+                self.github_api.entries["edition/file.xml"] = "95b966ae1c166bd92f8ae7d1c313e738c731dfc3"
+            with mock.patch.object(self.proxy, "request", wraps=self.proxy.request) as request:
+                result = self.client.post(
+                    "/perseids/push/edition/file.xml?branch=uuid-5678",
+                    data=content,
+                    headers={"fproxy-secure-hash": secure_sha}
+                )
+            data, http = response_read(result)
+            self.assertEqual(http, 201, "Workflow should succeed")
+            calls = [call[0][:2] for call in request.call_args_list if "/git/" in call[0][1]]
+            # The first call checks that the branch exists
+            self.assertEqual(calls[1:], expected)
+        self.assertEqual(len(self.github_api.commits), 1, "Pushing the same blob again should not commit")
+
+    def test_blob_reuse_threshold(self):
+        """ Test that small contents are simply uploaded
+        """
+        content = base64.encodebytes(b'Some content')
+        secure_sha = make_secret(content.decode("utf-8"), self.secret)
+        self.makeRequest(content, secure_sha, {"branch": "uuid-1234"})
+        self.makeRequest(content, secure_sha, {"branch": "uuid-5678"})
+        self.assertEqual(self.github_api.trees, [], "Small contents should not go through the Git Data API")
+
+    def test_spooled_push(self):
+        """ Test that a body past the spool threshold is streamed to Github
+        """
+        self.proxy.spool_threshold = 64
+        self.proxy.__default_branch__ = GithubProxy.DEFAULT_BRANCH.AUTO_SHA
+        content = base64.encodebytes(b'Some content' * 100)
+        result = self.makeRequest(
+            content,
+            make_secret(content.decode("utf-8"), self.secret),
+            {"author_name": "ponteineptique", "logs": "Hard work of transcribing file"}
+        )
+        data, http = response_read(result)
+        self.assertEqual(http, 201, "Workflow should succeed")
+        self.assertEqual(
+            base64.b64decode(self.github_api.uploads[-1]["content"]), b'Some content' * 100,
+            "Spooled content should be sent"
+        )
+        self.assertEqual(
+            self.github_api.uploads[-1]["branch"], sha256(b'Some content' * 100).hexdigest()[:8],
+            "Sha of the content should be computed while streaming"
+        )
+
+    def test_raw_push(self):
+        """ Test that raw bodies are accepted and encoded to base64 for Github, in memory or spooled
+        """
+        content = bytes(range(256)) * 10
+        secure_sha = sha256(content + self.secret.encode("utf-8")).hexdigest()
+        for threshold in (1024 * 1024, 100):
+            self.proxy.spool_threshold = threshold
+            result = self.client.post(
+                "/perseids/push/path/to/some/file.bin?branch=uuid-1234",
+                data=content,
+                headers={"fproxy-secure-hash": secure_sha, "Content-Type": "application/octet-stream"}
+            )
+            data, http = response_read(result)
+            self.assertEqual(http, 201, "Workflow should succeed")
+            self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), content)
+
+        result = self.client.post(
+            "/perseids/push/path/to/some/file.bin?branch=uuid-1234&raw=1",
+            data=b"Some content",
+            headers={"fproxy-secure-hash": sha256(b"Some content" + self.secret.encode("utf-8")).hexdigest()}
+        )
+        self.assertEqual(result.status_code, 201, "raw parameter should flag raw bodies")
+        self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), b"Some content")
+
+    def test_compressed_push(self):
+        """ Test that compressed bodies are decompressed and signed before or after compression
+        """
+        content = base64.encodebytes(b'Some content' * 100)
+        compressed = gzip.compress(content)
+        result = self.client.post(
+            "/perseids/push/path/to/some/file.xml?branch=uuid-1234", data=compressed,
+            headers={"fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret), "Content-Encoding": "gzip"}
+        )
+        self.assertEqual(result.status_code, 201, "Signature should be checked against the decompressed body")
+        self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), b'Some content' * 100)
+
+        self.proxy.sign_wire_bytes = True
+        result = self.client.post(
+            "/perseids/push/path/to/some/file.xml?branch=uuid-5678", data=compressed,
+            headers={
+                "fproxy-secure-hash": sha256(compressed + self.secret.encode("utf-8")).hexdigest(),
+                "Content-Encoding": "gzip"
+            }
+        )
+        self.assertEqual(result.status_code, 201, "Signature should be checked against the body as sent")
+
+    def test_compressed_push_errors(self):
+        """ Test that unsupported encodings and decompression bombs are refused
+        """
+        data, http = response_read(self.client.post(
+            "/perseids/push/path/to/some/file.xml", data=b"...", headers={"Content-Encoding": "br"}
+        ))
+        self.assertEqual((http, data["step"]), (415, "decompress"))
+        self.proxy.max_decompressed_size = 1024
+        data, http = response_read(self.client.post(
+            "/perseids/push/path/to/some/file.xml", data=gzip.compress(b"A" * 4096),
+            headers={"Content-Encoding": "gzip"}
+        ))
+        self.assertEqual((http, data["step"]), (413, "decompress"))
+        self.assertEqual(self.github_api.uploads, [], "Nothing should be pushed")
+
+    def test_upload_session(self):
+        """ Test a chunked upload : open, chunks in any order, status, commit
+        """
+        content = base64.encodebytes(b'Some content' * 100)
+        result = self.client.post(
+            "/perseids/upload/path/to/some/file.xml?branch=uuid-1234&logs=Chunked",
+            headers={"fproxy-secure-hash": make_secret("path/to/some/file.xml", self.secret)}
+        )
+        data, http = response_read(result)
+        self.assertEqual(http, 201, "Session should be opened")
+        upload_id = data["upload_id"]
+
+        chunks = [content[:500], content[500:1000], content[1000:]]
+        for number in (2, 0):
+            data, http = response_read(self.client.put(
+                "/perseids/uploads/{}/{}".format(upload_id, number), data=chunks[number],
+                headers={"fproxy-chunk-hash": sha256(chunks[number]).hexdigest()}
+            ))
+            self.assertEqual(http, 201)
+        self.assertEqual(data["ranges"], [[0, 0], [2, 2]])
+        data, http = response_read(self.client.put(
+            "/perseids/uploads/{}/1".format(upload_id), data=chunks[1],
+            headers={"fproxy-chunk-hash": sha256(b"Another chunk").hexdigest()}
+        ))
+        self.assertEqual(http, 300, "Chunk not matching its hash should be refused")
+
+        data, http = response_read(self.client.get("/perseids/uploads/{}".format(upload_id)))
+        self.assertEqual((data["chunks"], data["size"]), ({"0": 500, "2": len(content) - 1000}, len(content) - 500))
+        data, http = response_read(self.client.post(
+            "/perseids/uploads/{}/commit".format(upload_id),
+            headers={"fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret)}
+        ))
+        self.assertEqual(http, 409, "Commit should wait for missing chunks")
+
+        self.client.put("/perseids/uploads/{}/1".format(upload_id), data=chunks[1])
+        data, http = response_read(self.client.post(
+            "/perseids/uploads/{}/commit".format(upload_id),
+            headers={"fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret)}
+        ))
+        self.assertEqual(http, 201, "Commit should go through the push workflow")
+        self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), b'Some content' * 100)
+        self.assertEqual(
+            (self.github_api.uploads[-1]["branch"], self.github_api.uploads[-1]["message"]), ("uuid-1234", "Chunked")
+        )
+        self.assertEqual(
+            self.client.get("/perseids/uploads/{}".format(upload_id)).status_code, 404,
+            "Session should be removed once committed"
+        )
+
+    def test_upload_commit_retry(self):
+        """ Test that a failed commit is retried, not answered with the error of the former attempt
+        """
+        content = base64.encodebytes(b'Some content')
+        data, http = response_read(self.client.post(
+            "/perseids/upload/path/to/some/file.xml?branch=uuid-1234",
+            headers={"fproxy-secure-hash": make_secret("path/to/some/file.xml", self.secret)}
+        ))
+        upload_id = data["upload_id"]
+        self.client.put("/perseids/uploads/{}/0".format(upload_id), data=content)
+
+        contents = "http://localhost/repos/ponteineptique/dummy/contents/path/to/some/file.xml"
+        self.github_api.route_fail[contents] = True
+        for failure, expected in ((True, 404), (False, 201)):
+            if not failure:
+                del self.github_api.route_fail[contents]
+            data, http = response_read(self.client.post(
+                "/perseids/uploads/{}/commit".format(upload_id),
+                headers={"fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret)}
+            ))
+            self.assertEqual(http, expected)
+        self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), b'Some content')
+
+    def test_upload_session_errors(self):
+        """ Test that sessions need a signature to be opened, and to exist and stay small enough to receive chunks
+        """
+        result = self.client.post("/perseids/upload/path/to/some/file.xml", headers={"fproxy-secure-hash": "wrong"})
+        self.assertEqual(result.status_code, 300)
+        self.assertEqual(self.client.put("/perseids/uploads/../../etc/0", data=b"...").status_code, 404)
+        self.assertEqual(self.client.put("/perseids/uploads/{}/0".format("0" * 32), data=b"...").status_code, 404)
+
+        data, http = response_read(self.client.post(
+            "/perseids/upload/path/to/some/file.xml",
+            headers={"fproxy-secure-hash": make_secret("path/to/some/file.xml", self.secret)}
+        ))
+        self.proxy.uploads.max_size = 1024
+        result = self.client.put("/perseids/uploads/{}/0".format(data["upload_id"]), data=b"A" * 2048)
+        self.assertEqual(result.status_code, 413, "Sessions should not grow past their limit")
+
+        self.proxy.uploads.max_sessions = 1
+        result = self.client.post(
+            "/perseids/upload/path/to/some/file.xml",
+            headers={"fproxy-secure-hash": make_secret("path/to/some/file.xml", self.secret)}
+        )
+        self.assertEqual(result.status_code, 503, "The number of sessions should be limited")
+
+    def make_patch(self, patch, base, content, fmt="unified"):
+        return self.client.post(
+            "/perseids/patch/path/to/some/file.xml?branch=uuid-1234&base={}&sha={}&format={}".format(
+                base, sha256(content).hexdigest(), fmt
+            ),
+            data=patch,
+            headers={"fproxy-secure-hash": sha256(patch + self.secret.encode("utf-8")).hexdigest()}
+        )
+
+    def test_patch(self):
+        """ Test that a unified diff is applied to its base and that the result is pushed as an update
+        """
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.blobs[self.github_api.sha_origin] = b"line 1\nline 2\nline 3\n"
+        patch = b"--- a/file.xml\n+++ b/file.xml\n@@ -1,3 +1,3 @@\n line 1\n-line 2\n+line two\n line 3\n"
+        result = self.make_patch(patch, self.github_api.sha_origin, b"line 1\nline two\nline 3\n")
+        data, http = response_read(result)
+        self.assertEqual(http, 201, "Workflow should succeed")
+        self.assertEqual(data["blob"], self.github_api.new_sha, "The new blob should be given for the next patch")
+        self.assertEqual(self.github_api.uploads[-1]["sha"], self.github_api.sha_origin)
+        self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), b"line 1\nline two\nline 3\n")
+        self.assertEqual(
+            self.proxy.bases.get(self.github_api.new_sha), b"line 1\nline two\nline 3\n",
+            "The new version should be cached as a base"
+        )
+
+    def test_patch_delta(self):
+        """ Test that a git binary delta is applied to its base, fetched once
+        """
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.blobs[self.github_api.sha_origin] = b"0123456789" * 10
+        # Copy the 50 first bytes, insert "abc", copy the 50 last bytes
+        delta = bytes([100, 103, 0x90, 50]) + b"\x03abc" + bytes([0x91, 50, 50])
+        expected = b"0123456789" * 5 + b"abc" + b"0123456789" * 5
+        for branch in ("uuid-1234", "uuid-5678"):
+            result = self.make_patch(delta, self.github_api.sha_origin, expected, fmt="delta")
+            self.assertEqual(result.status_code, 201, "Workflow should succeed")
+            self.assertEqual(base64.b64decode(self.github_api.uploads[-1]["content"]), expected)
+            self.github_api.blobs.clear()
+
+    def test_patch_stale_base(self):
+        """ Test that a patch never replaces a version other than its base
+        """
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.blobs["0ld5ha"] = b"line 1\n"
+        result = self.make_patch(b"@@ -1 +1 @@\n-line 1\n+line one\n", "0ld5ha", b"line one\n")
+        data, http = response_read(result)
+        self.assertEqual(http, 409, "The file changed since the base of the patch")
+        self.assertEqual(self.github_api.uploads, [], "Nothing should be written")
+
+        self.github_api.blobs[self.github_api.sha_origin] = b"line 1\n"
+        self.github_api.conflicts = 1
+        result = self.make_patch(b"@@ -1 +1 @@\n-line 1\n+line one\n", self.github_api.sha_origin, b"line one\n")
+        self.assertEqual(result.status_code, 409, "A conflicting patch should not be replayed")
+        self.assertEqual(len(self.github_api.uploads), 1)
+
+    def test_patch_errors(self):
+        """ Test that patches need their parameters, a signature, a known base, to apply and to match their sha
+        """
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.blobs[self.github_api.sha_origin] = b"line 1\n"
+        patch = b"@@ -1 +1 @@\n-line 1\n+line one\n"
+        self.assertEqual(self.client.post("/perseids/patch/file.xml?base=123456", data=patch).status_code, 400)
+        self.assertEqual(self.make_patch(patch, "123456", b"line one\n", fmt="zip").status_code, 400)
+        self.assertEqual(self.client.post(
+            "/perseids/patch/file.xml?base=123456&sha=abc", data=patch, headers={"fproxy-secure-hash": "wrong"}
+        ).status_code, 300)
+        self.assertEqual(self.make_patch(patch, "unknown", b"line one\n").status_code, 404)
+        self.assertEqual(self.make_patch(patch, "123456", b"line two\n").status_code, 422)
+        self.assertEqual(self.make_patch(b"@@ -1 +1 @@\n-line 2\n+line one\n", "123456", b"line one\n").status_code, 422)
+        self.assertEqual(self.make_patch(bytes([7, 3, 0x91]), "123456", b"line one\n", fmt="delta").status_code, 422)
+        self.assertEqual(self.github_api.uploads, [], "Nothing should be written")
+
+    def test_hmac_signature(self):
+        """ Test that HMAC signatures are checked against every active secret, and legacy hashes only if allowed
+        """
+        content = base64.encodebytes(b'Some content')
+
+        def sign(secret):
+            return "sha256=" + hmac.new(secret.encode("utf-8"), sha256(content).digest(), sha256).hexdigest()
+
+        result = self.client.post(
+            "/perseids/push/path/to/some/file.xml?branch=uuid-1234", data=content,
+            headers={"fproxy-signature": sign(self.secret)}
+        )
+        self.assertEqual(result.status_code, 201, "HMAC signature should be accepted")
+
+        self.proxy.secrets = ["n3w-s3cr3t", self.secret]
+        self.assertEqual(self.proxy.secret, "n3w-s3cr3t", "First secret is the current one")
+        for secret, code in ((self.secret, 201), ("n3w-s3cr3t", 201), ("0th3r", 300)):
+            result = self.client.post(
+                "/perseids/push/path/to/some/file.xml?branch=uuid-1234", data=content,
+                headers={"fproxy-signature": sign(secret)}
+            )
+            self.assertEqual(result.status_code, code)
+        result = self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        self.assertEqual(result.status_code, 201, "Legacy hashes should be checked against every secret")
+
+        self.proxy.legacy_signatures = False
+        result = self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        self.assertEqual(result.status_code, 300, "Legacy hashes should be refused once disabled")
+
+    def make_archive(self, kind):
+        body = io.BytesIO()
+        if kind == "zip":
+            with zipfile.ZipFile(body, "w") as archive:
+                archive.writestr("texts/a.xml", b"<a/>")
+                archive.writestr("texts/", b"")
+                archive.writestr("texts/b.xml", b"<b/>" * 1000)
+                archive.writestr("../escape.xml", b"<c/>")
+        else:
+            with tarfile.open(fileobj=body, mode="w:gz") as archive:
+                for name, content in (("texts/a.xml", b"<a/>"), ("texts/b.xml", b"<b/>" * 1000), ("/etc/c", b"")):
+                    info = tarfile.TarInfo(name)
+                    info.size = len(content)
+                    archive.addfile(info, io.BytesIO(content))
+        return body.getvalue()
+
+    def test_archive(self):
+        """ Test that the files of tar and zip archives are committed at once, with progress reported line by line
+        """
+        for kind in ("tar", "zip"):
+            body = self.make_archive(kind)
+            result = self.client.post(
+                "/perseids/archive?branch=uuid-{}&path=data".format(kind), data=body,
+                headers={"fproxy-secure-hash": sha256(body + self.secret.encode("utf-8")).hexdigest()}
+            )
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(result.mimetype, "application/x-ndjson")
+            lines = [json.loads(line) for line in result.data.decode("utf-8").splitlines()]
+            self.assertEqual(
+                [line.get("step") for line in lines if line["status"] == "progress"],
+                ["branch", "blob", "blob", "commit"]
+            )
+            self.assertEqual(lines[-1]["status"], "success")
+            self.assertEqual(lines[-1]["files"], 2)
+            self.assertEqual(len([line for line in lines if line["status"] == "skipped"]), 1, "Unsafe paths are skipped")
+            tree = self.github_api.trees[-1]["tree"]
+            self.assertEqual([entry["path"] for entry in tree], ["data/texts/a.xml", "data/texts/b.xml"])
+            self.assertEqual(self.github_api.blobs[tree[1]["sha"]], b"<b/>" * 1000)
+            self.assertEqual(self.github_api.uploads, [], "Files should not go through the contents API")
+        self.assertEqual(len(self.github_api.commits), 2, "Each archive should make one commit")
+        self.assertEqual(self.proxy.counters["blob_reused"], 2, "Known blobs should not be uploaded again")
+
+    def test_archive_errors(self):
+        """ Test that archives need a signature and a known format, and that failures end the progress report
+        """
+        body = self.make_archive("tar")
+        result = self.client.post("/perseids/archive", data=body, headers={"fproxy-secure-hash": "wrong"})
+        self.assertEqual(result.status_code, 300)
+        result = self.client.post(
+            "/perseids/archive", data=b"Not an archive",
+            headers={"fproxy-secure-hash": sha256(b"Not an archive" + self.secret.encode("utf-8")).hexdigest()}
+        )
+        self.assertEqual(result.status_code, 415)
+
+        self.proxy.max_decompressed_size = 1000
+        result = self.client.post(
+            "/perseids/archive?branch=uuid-1234", data=body,
+            headers={"fproxy-secure-hash": sha256(body + self.secret.encode("utf-8")).hexdigest()}
+        )
+        last = json.loads(result.data.decode("utf-8").splitlines()[-1])
+        self.assertEqual((last["status"], last["code"], last["step"]), ("error", 413, "archive"))
+        self.assertEqual(self.github_api.commits, [], "Nothing should be committed")
+
+        encrypted = io.BytesIO()
+        with zipfile.ZipFile(encrypted, "w") as archive:
+            archive.writestr("a.xml", b"<a/>")
+            archive.infolist()[0].flag_bits |= 0x1
+        body = encrypted.getvalue()
+        result = self.client.post(
+            "/perseids/archive?branch=uuid-1234", data=body,
+            headers={"fproxy-secure-hash": sha256(body + self.secret.encode("utf-8")).hexdigest()}
+        )
+        last = json.loads(result.data.decode("utf-8").splitlines()[-1])
+        self.assertEqual((last["status"], last["code"]), ("error", 400), "Encrypted entries should end the report")
+
+    def test_metrics(self):
+        """ Test that steps, requests to Github, responses, body sizes and rate limits are exposed
+        """
+        content = base64.encodebytes(b'Some content')
+        self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        self.client.post("/perseids/push/path/to/some/file.xml", data=content, headers={"fproxy-secure-hash": "no"})
+        result = self.client.get("/perseids/metrics")
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, "text/plain")
+        text = result.data.decode("utf-8")
+        for line in (
+            'github_proxy_step_duration_seconds_count{step="get_ref",outcome="success"} 1',
+            'github_proxy_step_duration_seconds_count{step="put",outcome="success"} 1',
+            'github_proxy_step_duration_seconds_count{step="pull_request",outcome="success"} 1',
+            'github_proxy_step_duration_seconds_count{step="workflow",outcome="success"} 1',
+            'github_proxy_github_request_duration_seconds_count{method="PUT",status="201"} 1',
+            'github_proxy_response_duration_seconds_count{endpoint="receive",status="201"} 1',
+            'github_proxy_response_duration_seconds_count{endpoint="receive",status="300"} 1',
+            'github_proxy_body_size_bytes_bucket{endpoint="receive",le="1024"} 2',
+            'github_proxy_workflows_in_flight 0',
+            'github_proxy_github_rate_limit{resource="core",kind="remaining"} ' + str(self.github_api.rate_limit)
+        ):
+            self.assertIn(line + "\n", text)
+
+    def test_server_timing(self):
+        """ Test that responses, successful or not, break their duration down in a Server-Timing header
+        """
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.conflicts = 1
+        content = base64.encodebytes(b'Some content')
+        result = self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        self.assertEqual(result.status_code, 201)
+        timing = dict(entry.split(";", 1) for entry in result.headers["Server-Timing"].split(", "))
+        self.assertEqual(
+            sorted(timing), ["branch", "exists", "github", "github-calls", "hash", "pr", "retries", "total", "upload",
+                             "write"]
+        )
+        self.assertEqual(timing["github-calls"], 'desc="7"')
+        self.assertEqual(timing["retries"], 'desc="1"')
+
+        result = self.client.post("/perseids/push/path/to/some/file.xml", data=content, headers={"fproxy-secure-hash": "no"})
+        self.assertEqual(result.status_code, 300)
+        self.assertIn("hash;dur=", result.headers["Server-Timing"])
+        self.assertIn("Server-Timing", self.client.get("/perseids/update").headers)
+
+    def test_slow_workflow(self):
+        """ Test that only requests slower than the threshold are logged, with each of their calls to Github
+        """
+        content = base64.encodebytes(b'Some content')
+        secure = make_secret(content.decode("utf-8"), self.secret)
+        with mock.patch('logging.Logger.warning') as logger:
+            self.proxy.slow_workflow_threshold = 60
+            self.makeRequest(content, secure, {"branch": "uuid-1234"})
+            self.assertFalse(logger.called)
+
+            self.proxy.slow_workflow_threshold = 0
+            self.github_api.exist_file["path/to/some/file.xml"] = True
+            self.github_api.conflicts = 1
+            result = self.makeRequest(content, secure, {"branch": "uuid-1234"})
+            self.assertEqual(result.status_code, 201)
+            logger.assert_called_once()
+
+        message, = logger.call_args[0]
+        record = logger.call_args[1]["extra"]
+        self.assertEqual(message, "Slow workflow::receive")
+        self.assertEqual((record["endpoint"], record["status"], record["threshold"]), ("receive", 201, 0))
+        self.assertEqual(record["events"]["retries"], 1)
+        self.assertIn("write", record["phases"])
+        self.assertEqual(len(record["calls"]), record["events"]["github-calls"])
+        conflict = [call for call in record["calls"] if call["status"] == 409][0]
+        self.assertEqual(
+            (conflict["method"], conflict["url"]), ("PUT", "/repos/{owner}/{repo}/contents/{path}")
+        )
+        self.assertGreater(conflict["request_bytes"], len(content))
+        self.assertIn("remaining", conflict["rate_limit"])
+        self.assertEqual(self.proxy.counters["slow_workflows"], 1)
+
+    def test_profile(self):
+        """ Test that the profiler samples the requests served while it runs, and that it is protected
+        """
+        self.assertEqual(self.client.get("/perseids/debug/profile?seconds=1").status_code, 404)
+        self.app = Flask("name")
+        self.proxy = GithubProxy(
+            "/perseids", "ponteineptique/dummy", "perseusDL/dummy", token="client-id", secret=self.secret,
+            app=self.app, debug_routes=True
+        )
+        self.proxy.github_api_url = ""
+        self.client = self.app.test_client()
+
+        def signed(query, timestamp=None):
+            query = "{}&timestamp={}".format(query, int(timestamp or time.time()))
+            return "/perseids/debug/profile?{}".format(query), {"fproxy-secure-hash": make_secret(query, self.secret)}
+
+        def slow_request(method, url, **kwargs):
+            time.sleep(0.05)
+            return make_request(method, url, **kwargs)
+
+        make_request = self.mock
+        self.patcher.stop()
+        self.patcher = mock.patch("flask_github_proxy.make_request", slow_request)
+        self.patcher.start()
+
+        content = base64.encodebytes(b'Some content')
+        push = Thread(
+            target=self.makeRequest, args=(content, make_secret(content.decode("utf-8"), self.secret)),
+            kwargs={"data": {"branch": "uuid-1234"}}
+        )
+        push.start()
+        url, headers = signed("seconds=0.2&interval=0.01")
+        result = self.client.get(url, headers=headers)
+        push.join()
+        self.assertEqual(result.status_code, 200)
+        self.assertGreater(int(result.headers["X-Profile-Samples"]), 5)
+        stacks = result.data.decode("utf-8").splitlines()
+        self.assertTrue(stacks)
+        self.assertTrue(all(stack.startswith("receive;") for stack in stacks))
+        self.assertTrue(any("test_integrate.py:slow_request" in stack for stack in stacks))
+        self.assertTrue(all(stack.rsplit(" ", 1)[1].isdigit() for stack in stacks))
+
+        url, headers = signed("seconds=2")
+        self.assertEqual(self.client.get(url.replace("seconds=2", "seconds=1"), headers=headers).status_code, 300)
+        url, headers = signed("seconds=600")
+        self.assertEqual(self.client.get(url, headers=headers).status_code, 400)
+        url, headers = signed("seconds=1", timestamp=time.time() - 120)
+        self.assertEqual(self.client.get(url, headers=headers).status_code, 300, "Old signatures should be refused")
+        query = "seconds=1"
+        self.assertEqual(self.client.get(
+            "/perseids/debug/profile?" + query, headers={"fproxy-secure-hash": make_secret(query, self.secret)}
+        ).status_code, 300, "Queries without timestamp should be refused")
+
+    def test_memory(self):
+        """ Test that the peak of allocations of each request is recorded and that snapshots are compared
+        """
+        self.app = Flask("name")
+        self.proxy = GithubProxy(
+            "/perseids", "ponteineptique/dummy", "perseusDL/dummy", token="client-id", secret=self.secret,
+            app=self.app, debug_routes=True, memory_tracking=True, memory_top=5
+        )
+        self.addCleanup(tracemalloc.stop)
+        self.proxy.github_api_url = ""
+        self.client = self.app.test_client()
+        query = "timestamp={}".format(int(time.time()))
+        url, headers = "/perseids/debug/memory?" + query, {"fproxy-secure-hash": make_secret(query, self.secret)}
+
+        self.assertEqual(self.client.get(url).status_code, 300)
+        self.assertEqual(self.client.get(
+            "/perseids/debug/memory", headers={"fproxy-secure-hash": make_secret("", self.secret)}
+        ).status_code, 300, "The signature of the empty query should not be a permanent pass")
+        first = response_read(self.client.get(url, headers=headers))[0]
+        self.assertNotIn("growth", first)
+
+        content = base64.encodebytes(b'Some content' * 4096)
+        result = self.makeRequest(content, make_secret(content.decode("utf-8"), self.secret), {"branch": "uuid-1234"})
+        self.assertEqual(result.status_code, 201)
+
+        report, status = response_read(self.client.get(url, headers=headers))
+        self.assertEqual(status, 200)
+        self.assertTrue(report["tracing"])
+        self.assertEqual(report["routes"]["receive"]["calls"], 1)
+        self.assertGreater(report["routes"]["receive"]["peak_max"], len(content))
+        self.assertEqual(len(report["top"]), 5)
+        self.assertEqual(len(report["growth"]), 5)
+        self.assertIn(
+            'github_proxy_allocation_peak_bytes_count{endpoint="receive"} 1',
+            self.client.get("/perseids/metrics").data.decode("utf-8")
+        )
+
+        # A request starting while another runs does not reset the peak of the first one
+        outer = self.proxy.allocations.begin()
+        block = bytearray(1024 * 1024)
+        del block
+        self.proxy.allocations.end("inner", self.proxy.allocations.begin())
+        self.assertGreaterEqual(self.proxy.allocations.end("outer", outer), 1024 * 1024)
+
+        # Without tracemalloc.reset_peak(), the memory still allocated at the end of the request is recorded
+        with mock.patch("flask_github_proxy.memory.RESET_PEAK", False), \
+                mock.patch("tracemalloc.reset_peak", side_effect=AttributeError):
+            baseline = self.proxy.allocations.begin()
+            block = bytearray(1024 * 1024)
+            self.assertGreaterEqual(self.proxy.allocations.end("kept", baseline), 1024 * 1024)
+            del block
+
+    def test_budget(self):
+        """ Test that the calls to Github of a workflow are accounted by kind, and that a budget is enforced
+        """
+        content = base64.encodebytes(b'Some content')
+        secure = make_secret(content.decode("utf-8"), self.secret)
+        self.proxy.budget_in_response = True
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.conflicts = 1
+        data, status = response_read(self.makeRequest(content, secure, {"branch": "uuid-1234"}))
+        self.assertEqual(status, 201)
+        self.assertEqual(data["budget"], {
+            "read": 3, "write": 2, "pr": 2, "total": 7, "cached": 0, "coalesced": 0, "retries": 1, "limit": None
+        })
+
+        # The pull request is now known : the same push only checks it is still open
+        data, status = response_read(self.makeRequest(content, secure, {"branch": "uuid-1234"}))
+        self.assertEqual(data["budget"]["cached"], 1)
+        self.assertEqual(data["budget"]["pr"], 1)
+
+        self.proxy.call_budget = 2
+        data, status = response_read(self.makeRequest(content, secure, {"branch": "uuid-5678"}))
+        self.assertEqual(status, 503)
+        self.assertEqual(data["step"], "budget")
+        self.assertEqual(data["budget"]["total"], 2)
+        metrics = self.client.get("/perseids/metrics").data.decode("utf-8")
+        self.assertIn('github_proxy_budget_rejections_total{endpoint="receive"} 1', metrics)
+        self.assertIn('github_proxy_workflow_github_calls_count{endpoint="receive",kind="pr"} 3', metrics)
+
+        # Responses are read as they are on Flask 0.11 : a JSON mimetype does not make a JSON body
+        response = Response("Not JSON", mimetype="application/json")
+        self.proxy.account(Budget(), response)
+        self.assertEqual(response.get_data(), b"Not JSON")
+
+    def test_tracing(self):
+        """ Test that a push is traced in a root span continuing the incoming trace, with a child span per call to Github
+        """
+        spans = []
+        self.proxy.tracer.exporter = mock.Mock(export=spans.append)
+        self.github_api.exist_file["path/to/some/file.xml"] = True
+        self.github_api.conflicts = 1
+        content = base64.encodebytes(b'Some content')
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        result = self.client.post(
+            "/perseids/push/path/to/some/file.xml", data=content, query_string={"branch": "uuid-1234"},
+            headers={
+                "fproxy-secure-hash": make_secret(content.decode("utf-8"), self.secret),
+                "traceparent": "00-{}-00f067aa0ba902b7-01".format(trace_id)
+            }
+        )
+        self.assertEqual(result.status_code, 201)
+        result.close()
+
+        root = spans[-1]
+        self.assertEqual(root.name, "receive")
+        self.assertEqual((root.trace_id, root.parent_id), (trace_id, "00f067aa0ba902b7"))
+        self.assertEqual(root.attributes["status"], 201)
+        self.assertEqual(root.attributes["retries"], 1)
+        self.assertEqual(root.attributes["github_calls"], 7)
+
+        calls = spans[:-1]
+        self.assertEqual(len(calls), 7)
+        self.assertTrue(all(span.trace_id == trace_id and span.parent_id == root.span_id for span in calls))
+        update = [span for span in calls if span.attributes["method"] == "PUT"]
+        self.assertEqual(update[0].attributes["url"], "/repos/{owner}/{repo}/contents/{path}")
+        self.assertEqual([span.attributes["status"] for span in update], [409, 200])
+        self.assertGreater(update[0].attributes["request_bytes"], len(content))
+        self.assertGreater(update[0].attributes["response_bytes"], 0)
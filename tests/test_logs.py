@@ -0,0 +1,48 @@
+from unittest import TestCase
+from hashlib import sha256
+import io
+import json
+import logging
+from flask_github_proxy.logs import Lazy, summarize, install_json_handler, LISTENERS
+
+
+class TestLogs(TestCase):
+    """ Test the summaries of payloads and the JSON handler running off the request thread
+    """
+    def test_summarize(self):
+        """ Test that large values are truncated and hashed, and that secret headers are redacted
+        """
+        content = b"a" * 2048
+        self.assertEqual(
+            summarize({
+                "headers": {"Authorization": "token secret", "Content-Type": "application/json"},
+                "data": content,
+                "params": ["short", 1, None]
+            }, size=1024),
+            {
+                "headers": {"Authorization": "<redacted>", "Content-Type": "application/json"},
+                "data": {"length": 2048, "sha256": sha256(content).hexdigest(), "head": "a" * 64},
+                "params": ["short", 1, None]
+            }
+        )
+        self.assertEqual(summarize(b"short"), "short")
+
+    def test_handler(self):
+        """ Test that records are written as JSON by the listener, with their lazy values computed, and that \
+        the handler is installed once
+        """
+        logger = logging.getLogger("tests.logs")
+        calls = []
+        listener = install_json_handler(logger)
+        self.assertIs(install_json_handler(logger), listener)
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertEqual(logger.level, logging.INFO)
+
+        output = io.StringIO()
+        listener.handlers[0].setStream(output)
+        logger.info("Hello", extra={"payload": Lazy(lambda: calls.append(1) or {"size": 3})})
+        listener.stop()
+        del LISTENERS[logger.name]
+        logger.handlers = []
+        self.assertEqual(json.loads(output.getvalue()), {"message": "Hello", "payload": {"size": 3}})
+        self.assertEqual(calls, [1])
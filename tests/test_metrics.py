@@ -0,0 +1,37 @@
+from unittest import TestCase
+from collections import Counter
+from flask_github_proxy.metrics import Registry, Histogram
+
+
+class TestMetrics(TestCase):
+    """ Test the metrics registry and its exposition
+    """
+    def test_histogram(self):
+        """ Test that buckets are cumulated when exposed
+        """
+        histogram = Histogram("duration", "Duration", ("step",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, "get")
+        self.assertEqual(list(histogram.expose()), [
+            "# HELP duration Duration",
+            "# TYPE duration histogram",
+            "duration_bucket{step=\"get\",le=\"0.1\"} 2",
+            "duration_bucket{step=\"get\",le=\"1\"} 3",
+            "duration_bucket{step=\"get\",le=\"+Inf\"} 4",
+            "duration_sum{step=\"get\"} 3.65",
+            "duration_count{step=\"get\"} 4"
+        ])
+
+    def test_registry(self):
+        """ Test that gauges, rate limits and counters of events are exposed
+        """
+        registry = Registry()
+        registry.in_flight.inc()
+        registry.observe_rate_limit({"X-RateLimit-Remaining": "42", "X-RateLimit-Limit": "5000"})
+        registry.observe_rate_limit({})
+        text = registry.expose(Counter({"conflicts": 2}))
+        self.assertIn("github_proxy_workflows_in_flight 1\n", text)
+        self.assertIn("github_proxy_github_rate_limit{resource=\"core\",kind=\"remaining\"} 42\n", text)
+        self.assertIn("github_proxy_github_rate_limit{resource=\"core\",kind=\"limit\"} 5000\n", text)
+        self.assertIn("github_proxy_events_total{event=\"conflicts\"} 2\n", text)
+        self.assertIn("# TYPE github_proxy_step_duration_seconds histogram\n", text)
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from flask_github_proxy.patches import PatchError, apply_unified, apply_delta
+
+
+class TestUnified(TestCase):
+    """ Test the application of unified diffs
+    """
+    BASE = b"".join("line {}\n".format(i).encode("ascii") for i in range(1, 21))
+
+    def test_hunks(self):
+        """ Test that several hunks are applied, with additions and removals
+        """
+        patch = (
+            b"diff --git a/file.txt b/file.txt\n--- a/file.txt\n+++ b/file.txt\n"
+            b"@@ -1,3 +1,4 @@\n+line 0\n line 1\n line 2\n line 3\n"
+            b"@@ -10,3 +11,2 @@\n line 10\n-line 11\n line 12\n"
+        )
+        result = apply_unified(self.BASE, patch).splitlines()
+        self.assertEqual(result[0], b"line 0")
+        self.assertNotIn(b"line 11", result)
+        self.assertEqual(len(result), 20)
+
+    def test_insertion_and_end_of_file(self):
+        """ Test empty ranges and missing newlines at the end of the file
+        """
+        self.assertEqual(apply_unified(b"a\nb\n", b"@@ -1,0 +2 @@\n+c\n"), b"a\nc\nb\n")
+        self.assertEqual(apply_unified(b"", b"@@ -0,0 +1 @@\n+a\n\\ No newline at end of file\n"), b"a")
+        self.assertEqual(
+            apply_unified(b"a\nb", b"@@ -2 +2 @@\n-b\n\\ No newline at end of file\n+b\n"), b"a\nb\n"
+        )
+
+    def test_not_applying(self):
+        """ Test that context mismatches and hunks out of the file are refused
+        """
+        with self.assertRaises(PatchError):
+            apply_unified(self.BASE, b"@@ -1,2 +1,2 @@\n line 2\n-line 3\n+line three\n")
+        with self.assertRaises(PatchError):
+            apply_unified(self.BASE, b"@@ -30 +30 @@\n-line 30\n+line thirty\n")
+
+
+class TestDelta(TestCase):
+    """ Test the application of git binary deltas
+    """
+    def test_copy_and_insert(self):
+        """ Test copies (with offsets and sizes on several bytes) and insertions
+        """
+        base = bytes(range(256)) * 300
+        # Copy 0x10000 bytes (size 0) from offset 0x0100, then insert 2 bytes
+        delta = b"\x80\xd8\x04\x82\x80\x04" + bytes([0x82, 0x01]) + b"\x02ok"
+        self.assertEqual(apply_delta(base, delta), base[0x100:0x10100] + b"ok")
+
+    def test_errors(self):
+        """ Test that wrong base sizes, truncated deltas and copies out of the base are refused
+        """
+        with self.assertRaises(PatchError):
+            apply_delta(b"abc", b"\x04\x01\x01a")
+        with self.assertRaises(PatchError):
+            apply_delta(b"abc", b"\x03\x02\x02a")
+        with self.assertRaises(PatchError):
+            apply_delta(b"abc", b"\x03\x02\x91\x02\x02")
+        with self.assertRaises(PatchError):
+            apply_delta(b"abc", b"\x03\x01\x00")
+
+    def test_truncated_copy(self):
+        """ Test that a copy whose operands are missing is refused
+        """
+        for delta in (bytes([3, 3, 0x91]), bytes([3, 3, 0x91, 0x00]), bytes([3, 3, 0xb0, 0x01])):
+            with self.assertRaises(PatchError):
+                apply_delta(b"abc", delta)
+
+    def test_larger_than_target(self):
+        """ Test that a delta is stopped as soon as it produces more than its target size
+        """
+        with self.assertRaises(PatchError):
+            apply_delta(b"abc" * 100, bytes([0xac, 0x02, 0x01]) + bytes([0x90, 0xff]) * 100000)
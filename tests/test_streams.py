@@ -0,0 +1,134 @@
+from unittest import TestCase, skipUnless
+from flask_github_proxy.models import File, Author
+from flask_github_proxy.streams import Base64Decoder, Spool, JSONStream, Decompressor, DecompressionError, zstandard
+from hashlib import sha1, sha256
+from io import BytesIO
+import base64
+import binascii
+import gzip
+import zlib
+import json
+import mock
+
+
+class TestStreams(TestCase):
+    def setUp(self):
+        self.content = bytes(range(256)) * 40
+        self.encoded = base64.encodebytes(self.content)
+
+    def test_decoder(self):
+        """ Test that base64 can be decoded from chunks cut anywhere
+        """
+        decoder = Base64Decoder()
+        decoded = b"".join(decoder.decode(self.encoded[i:i + 7]) for i in range(0, len(self.encoded), 7))
+        self.assertEqual(decoded, self.content)
+        decoder.finish()
+
+        decoder.decode(b"QUJD\nRA")
+        with self.assertRaises(binascii.Error):
+            decoder.finish()
+
+    def test_spool(self):
+        """ Test that the spool hashes the body and stores it without whitespaces
+        """
+        spool = Spool(BytesIO(self.encoded), threshold=1024, chunk_size=100)
+        self.assertEqual(spool.hash.hexdigest(), sha256(self.encoded).hexdigest(), "Raw body should be hashed")
+        self.assertEqual(spool.content_hash.hexdigest(), sha256(self.content).hexdigest(), "Content should be hashed")
+        self.assertEqual(spool.read(), base64.b64encode(self.content).decode("ascii"))
+        self.assertEqual(spool.size, len(base64.b64encode(self.content)))
+        spool.close()
+
+    def test_not_base64(self):
+        """ Test that a body out of the base64 alphabet is flagged, so that it never goes unescaped into JSON
+        """
+        injection = b'QUJD","branch":"master'
+        self.assertTrue(Spool(BytesIO(self.encoded), chunk_size=100).valid)
+        self.assertTrue(Spool(BytesIO(injection), raw=True).valid)
+        spool = Spool(BytesIO(self.encoded + injection), chunk_size=100)
+        self.assertFalse(spool.valid)
+        self.assertIsNone(spool.content_hash)
+        spool = Spool(BytesIO(self.encoded[:-2]), chunk_size=100)
+        self.assertFalse(spool.valid, "A body cut in the middle of a group of four characters is not base64")
+        self.assertIsNone(spool.content_hash)
+        with self.assertRaises(ValueError):
+            File("path.xml", injection, Author("a", "b"), "19/06/2016", "Logs")
+
+    def test_json_stream(self):
+        """ Test that a streamed JSON document is valid, and as long as announced
+        """
+        spool = Spool(BytesIO(self.encoded), threshold=1024)
+        file = File("path.xml", spool, Author("Name", "mail@mail.com"), "2016-06-19", "Logs")
+        stream = JSONStream({"message": "Logs", "content": file, "branch": "master"}, "content", file)
+        body = b"".join(iter(lambda: stream.read(1000), b""))
+        self.assertEqual(len(body), len(stream), "Length should be known beforehand")
+        document = json.loads(body.decode("utf-8"))
+        self.assertEqual(base64.b64decode(document["content"]), self.content)
+        self.assertEqual((document["message"], document["branch"]), ("Logs", "master"))
+
+        nested = {"query": "...", "variables": {"additions": [{"path": "path.xml", "contents": file}]}}
+        stream = JSONStream(nested, ("variables", "additions", 0, "contents"), file)
+        body = stream.read()
+        self.assertEqual(len(body), len(stream), "Length should be known beforehand")
+        document = json.loads(body.decode("utf-8"))
+        self.assertEqual(base64.b64decode(document["variables"]["additions"][0]["contents"]), self.content)
+        self.assertEqual(document["variables"]["additions"][0]["path"], "path.xml")
+
+
+class TestFile(TestCase):
+    def setUp(self):
+        self.content = b"Some content\n" * 500
+        self.author = Author("Name", "mail@mail.com")
+
+    def test_derived_values(self):
+        """ Test that in memory and spooled files derive the same values, git sha included
+        """
+        in_memory = File("path.xml", base64.encodebytes(self.content).decode("utf-8"), self.author, "", "Logs")
+        spooled = File("path.xml", Spool(BytesIO(base64.encodebytes(self.content)), threshold=10), self.author, "", "")
+        git_sha = sha1(b"blob 6500\0" + self.content).hexdigest()
+        for file in (in_memory, spooled):
+            self.assertEqual(file.sha, sha256(self.content).hexdigest())
+            self.assertEqual(file.git_sha, git_sha)
+            self.assertEqual(file.content, self.content)
+            self.assertEqual(file.size, len(base64.b64encode(self.content)), "Whitespaces should be dropped")
+
+    def test_decoded_once(self):
+        """ Test that the content is decoded only once, whatever the number of accesses
+        """
+        file = File("path.xml", base64.encodebytes(self.content), self.author, "", "Logs")
+        with mock.patch("flask_github_proxy.models.base64.b64decode", wraps=base64.b64decode) as decode:
+            file.content, file.sha, file.git_sha, file.dict(), file.content
+        self.assertEqual(decode.call_count, 1)
+
+
+class TestDecompressor(TestCase):
+    def setUp(self):
+        self.content = b"<TEI><text>Some content</text></TEI>\n" * 1000
+
+    def read(self, stream):
+        return b"".join(iter(lambda: stream.read(1000), b""))
+
+    def test_gzip_deflate(self):
+        """ Test that gzip and deflate bodies are decompressed by bounded reads
+        """
+        self.assertEqual(self.read(Decompressor(BytesIO(gzip.compress(self.content)), "gzip")), self.content)
+        self.assertEqual(self.read(Decompressor(BytesIO(zlib.compress(self.content)), "deflate")), self.content)
+
+    @skipUnless(zstandard, "zstandard is not installed")
+    def test_zstd(self):
+        compressed = zstandard.ZstdCompressor().compress(self.content)
+        self.assertEqual(self.read(Decompressor(BytesIO(compressed), "zstd")), self.content)
+
+    def test_limits(self):
+        """ Test that size and ratio limits stop the decompression
+        """
+        bomb = gzip.compress(b"0" * 10 * 1024 * 1024)
+        with self.assertRaises(DecompressionError) as error:
+            self.read(Decompressor(BytesIO(bomb), "gzip", max_ratio=100))
+        self.assertEqual(error.exception.code, 413)
+        with self.assertRaises(DecompressionError):
+            self.read(Decompressor(BytesIO(gzip.compress(self.content)), "gzip", max_size=1000))
+        with self.assertRaises(DecompressionError) as error:
+            self.read(Decompressor(BytesIO(b"Not compressed at all"), "gzip"))
+        self.assertEqual(error.exception.code, 400)
+        with self.assertRaises(ValueError):
+            Decompressor(BytesIO(b""), "br")
@@ -0,0 +1,81 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+import json
+import os
+from flask_github_proxy.tracing import Tracer, JSONLinesExporter, url_template
+
+
+class ListExporter(object):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class TestTracing(TestCase):
+    """ Test spans, their propagation and their export
+    """
+    def test_url_template(self):
+        """ Test that calls of the same kind share a template
+        """
+        api = "https://api.github.com"
+        self.assertEqual(
+            url_template(api + "/repos/ponteineptique/dummy/contents/path/to/file.xml?ref=master", api),
+            "/repos/{owner}/{repo}/contents/{path}"
+        )
+        self.assertEqual(
+            url_template(api + "/repos/perseusDL/dummy/git/refs/heads/feature/branch", api),
+            "/repos/{owner}/{repo}/git/refs/heads/{branch}"
+        )
+        self.assertEqual(
+            url_template(api + "/repos/ponteineptique/dummy/git/commits/" + "a" * 40, api),
+            "/repos/{owner}/{repo}/git/commits/{sha}"
+        )
+        self.assertEqual(url_template("/repos/perseusDL/dummy/pulls"), "/repos/{owner}/{repo}/pulls")
+
+    def test_traceparent(self):
+        """ Test that a valid traceparent is continued, and that an invalid one starts a new trace
+        """
+        tracer = Tracer(ListExporter())
+        trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        span = tracer.start("receive", traceparent="00-{}-{}-01".format(trace_id, parent_id))
+        self.assertEqual((span.trace_id, span.parent_id), (trace_id, parent_id))
+        self.assertRegex(span.traceparent, "^00-{}-[0-9a-f]{{16}}-01$".format(trace_id))
+
+        for invalid in (None, "garbage", "00-{}-{}-01".format("0" * 32, parent_id)):
+            span = tracer.start("receive", traceparent=invalid)
+            self.assertIsNone(span.parent_id)
+            self.assertNotEqual(span.trace_id, trace_id)
+            self.assertEqual(len(span.trace_id), 32)
+
+    def test_export(self):
+        """ Test that children share the trace of their parent and that spans are exported once, as JSON lines
+        """
+        with TemporaryDirectory() as directory:
+            exporter = JSONLinesExporter(os.path.join(directory, "spans.jsonl"))
+            tracer = Tracer(exporter)
+            root = tracer.start("receive", method="POST")
+            child = root.child("github", method="GET", status=200)
+            root.inc("retries")
+            child.end()
+            root.end()
+            root.end()
+            exporter.close()
+            with open(exporter.path) as f:
+                spans = [json.loads(line) for line in f]
+
+        self.assertEqual([span["name"] for span in spans], ["github", "receive"])
+        self.assertEqual(spans[0]["trace_id"], spans[1]["trace_id"])
+        self.assertEqual(spans[0]["parent_id"], spans[1]["span_id"])
+        self.assertEqual(spans[1]["attributes"], {"method": "POST", "retries": 1})
+        self.assertGreaterEqual(spans[0]["duration"], 0)
+
+    def test_failing_exporter(self):
+        """ Test that a failing exporter does not raise
+        """
+        class Failing(object):
+            def export(self, span):
+                raise IOError("Disk is full")
+
+        Tracer(Failing()).start("receive").end()
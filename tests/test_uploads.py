@@ -0,0 +1,84 @@
+from unittest import TestCase
+from flask_github_proxy.uploads import UploadStore, UploadStoreFull, UploadTooLarge
+from io import BytesIO
+import os
+import tempfile
+import shutil
+
+
+class TestUploadStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = UploadStore(self.directory, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reader(self):
+        """ Test that chunks are read back in order as one stream
+        """
+        upload_id = self.store.open({"path": "file.xml"})
+        for number, chunk in enumerate([b"abc", b"", b"defgh"]):
+            self.store.write(upload_id, number, BytesIO(chunk))
+        reader = self.store.reader(upload_id, 3)
+        self.assertEqual(b"".join(iter(lambda: reader.read(2), b"")), b"abcdefgh")
+        self.assertEqual(self.store.metadata(upload_id), {"path": "file.xml"})
+
+    def test_sweep(self):
+        """ Test that idle sessions are removed by the sweep
+        """
+        old, recent = self.store.open({}), self.store.open({})
+        os.utime(os.path.join(self.directory, old), (0, 0))
+        self.assertEqual(self.store.sweep(), 1)
+        self.assertIsNone(self.store.path(old), "Expired session should be removed")
+        self.assertIsNotNone(self.store.path(recent), "Recent session should be kept")
+
+    def test_expired_path(self):
+        """ Test that an expired session can not be reached anymore, even before a sweep
+        """
+        upload_id = self.store.open({})
+        os.utime(os.path.join(self.directory, upload_id), (0, 0))
+        self.assertIsNone(self.store.path(upload_id), "Expired session should not be found")
+        self.assertIsNone(self.store.metadata(upload_id))
+        self.assertEqual(os.listdir(self.directory), [], "Expired session should be removed")
+
+    def test_limits(self):
+        """ Test that the number of sessions and the size of their chunks altogether are limited
+        """
+        store = UploadStore(self.directory, max_sessions=2, max_total_size=8, chunk_size=2)
+        first, second = store.open({}), store.open({})
+        with self.assertRaises(UploadStoreFull):
+            store.open({})
+        store.write(first, 0, BytesIO(b"abcde"))
+        with self.assertRaises(UploadStoreFull):
+            store.write(second, 0, BytesIO(b"fghi"))
+        self.assertEqual(store.chunks(second), {}, "A chunk past the limit should not be kept")
+        self.assertEqual(store.write(second, 0, BytesIO(b"fgh")), 3)
+        self.assertEqual(store.size(), 8)
+
+        store.delete(first)
+        third = store.open({})
+        self.assertEqual(store.write(third, 0, BytesIO(b"jklmn")), 5, "Deleted sessions should free their room")
+
+    def test_max_size(self):
+        """ Test that a chunk making its session too large is refused and not kept, replaced chunks aside
+        """
+        store = UploadStore(self.directory, max_size=8, chunk_size=2)
+        upload_id = store.open({})
+        store.write(upload_id, 0, BytesIO(b"abcdef"))
+        with self.assertRaises(UploadTooLarge):
+            store.write(upload_id, 1, BytesIO(b"ghi"))
+        self.assertEqual(store.chunks(upload_id), {0: 6})
+        self.assertEqual(sorted(os.listdir(store.path(upload_id))), ["0.chunk", "metadata.json"])
+        self.assertEqual(store.write(upload_id, 0, BytesIO(b"abcdefgh")), 8, "A replaced chunk does not count")
+
+    def test_private_directory(self):
+        """ Test that the default folder is private to the user running the proxy
+        """
+        stores = [UploadStore(), UploadStore()]
+        try:
+            self.assertEqual(os.stat(stores[0].directory).st_mode & 0o777, 0o700)
+            self.assertNotEqual(stores[0].directory, stores[1].directory, "Folder should not be predictable")
+        finally:
+            for store in stores:
+                shutil.rmtree(store.directory)